@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 from sklearn.metrics import roc_auc_score
 
 from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab
+from pyhawkes.posterior import PosteriorAccumulator
 
 np.random.seed(0)
 
@@ -49,13 +50,14 @@ def demo(K=3, T=1000, dt_max=20, p=0.25):
     # Fit the test model with Gibbs sampling
     ###########################################################
     N_samples = 100
-    samples = []
+    posterior = PosteriorAccumulator(test_model, burnin=N_samples // 2,
+                                     n_snapshots=N_samples // 2)
     lps = []
     for itr in range(N_samples):
         print("Gibbs iteration ", itr)
         test_model.resample_model()
         lps.append(test_model.log_probability())
-        samples.append(test_model.copy_sample())
+        posterior.update()
 
         # Update plots
         test_model.plot(handles=test_handles)
@@ -63,19 +65,17 @@ def demo(K=3, T=1000, dt_max=20, p=0.25):
     ###########################################################
     # Analyze the samples
     ###########################################################
-    analyze_samples(true_model, samples, lps)
+    analyze_samples(true_model, posterior, lps)
 
-def analyze_samples(true_model, samples, lps):
-    N_samples = len(samples)
+def analyze_samples(true_model, posterior, lps):
+    lps = np.array(lps)
+    N_samples = len(lps)
 
-    # Compute sample statistics for second half of samples
-    A_samples       = np.array([s.weight_model.A     for s in samples])
-    W_samples       = np.array([s.weight_model.W     for s in samples])
-    lps             = np.array(lps)
-
-    offset = N_samples // 2
-    A_mean       = A_samples[offset:, ...].mean(axis=0)
-    W_mean       = W_samples[offset:, ...].mean(axis=0)
+    # Sample statistics for second half of samples
+    A_mean = posterior.mean("A")
+    W_mean = posterior.mean("W")
+    A_samples, itrs = posterior.get_snapshots("A")
+    itrs += posterior.burnin
 
     plt.figure()
     plt.plot(np.arange(N_samples), lps, 'k')
@@ -94,9 +94,9 @@ def analyze_samples(true_model, samples, lps):
         aucs.append(roc_auc_score(true_model.weight_model.A.ravel(), A.ravel()))
 
     plt.figure()
-    plt.plot(aucs, '-r')
-    plt.plot(auc_A_mean * np.ones_like(aucs), '--r')
-    plt.plot(auc_W_mean * np.ones_like(aucs), '--b')
+    plt.plot(itrs, aucs, '-r')
+    plt.plot(itrs, auc_A_mean * np.ones_like(aucs), '--r')
+    plt.plot(itrs, auc_W_mean * np.ones_like(aucs), '--b')
     plt.xlabel("Iteration")
     plt.ylabel("Link prediction AUC")
     plt.show()
@@ -12,6 +12,7 @@ from pybasicbayes.util.text import progprint_xrange
 from pyhawkes.models import \
     DiscreteTimeNetworkHawkesModelGammaMixture, \
     DiscreteTimeStandardHawkesModel
+from pyhawkes.posterior import PosteriorAccumulator
 
 
 if __name__ == "__main__":
@@ -74,28 +75,24 @@ if __name__ == "__main__":
     # Fit the test model with Gibbs sampling
     ###########################################################
     N_samples = 500
-    samples = []
+    posterior = PosteriorAccumulator(test_model, burnin=N_samples // 2,
+                                     n_snapshots=100)
     lps = []
     for itr in progprint_xrange(N_samples):
         lps.append(test_model.log_probability())
-        samples.append(test_model.copy_sample())
+        posterior.update()
         test_model.resample_model()
 
     ###########################################################
     # Analyze the samples
     ###########################################################
-    N_samples = len(samples)
-    A_samples       = np.array([s.weight_model.A     for s in samples])
-    W_samples       = np.array([s.weight_model.W     for s in samples])
-    g_samples       = np.array([s.impulse_model.g    for s in samples])
-    lambda0_samples = np.array([s.bias_model.lambda0 for s in samples])
-    lps             = np.array(lps)
-
-    offset = N_samples // 2
-    A_mean       = A_samples[offset:, ...].mean(axis=0)
-    W_mean       = W_samples[offset:, ...].mean(axis=0)
-    g_mean       = g_samples[offset:, ...].mean(axis=0)
-    lambda0_mean = lambda0_samples[offset:, ...].mean(axis=0)
+    lps          = np.array(lps)
+    A_mean       = posterior.mean("A")
+    W_mean       = posterior.mean("W")
+    g_mean       = posterior.mean("g")
+    lambda0_mean = posterior.mean("lambda0")
+    A_samples, itrs = posterior.get_snapshots("A")
+    itrs += posterior.burnin
 
     plt.figure()
     plt.plot(np.arange(N_samples), lps, 'k')
@@ -116,10 +113,10 @@ if __name__ == "__main__":
         aucs.append(roc_auc_score(true_model.weight_model.A.ravel(), A.ravel()))
 
     plt.figure()
-    plt.plot(aucs, '-r')
-    plt.plot(auc_A_mean * np.ones_like(aucs), '--r')
-    plt.plot(auc_W_mean * np.ones_like(aucs), '--b')
-    plt.plot(auc_init * np.ones_like(aucs), '--k')
+    plt.plot(itrs, aucs, '-r')
+    plt.plot(itrs, auc_A_mean * np.ones_like(aucs), '--r')
+    plt.plot(itrs, auc_W_mean * np.ones_like(aucs), '--b')
+    plt.plot(itrs, auc_init * np.ones_like(aucs), '--k')
     plt.xlabel("Iteration")
     plt.ylabel("Link prediction AUC")
     plt.show()
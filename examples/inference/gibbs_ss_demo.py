@@ -15,6 +15,7 @@ from pyhawkes.internals.network import StochasticBlockModel
 from pyhawkes.models import \
     DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
     DiscreteTimeStandardHawkesModel
+from pyhawkes.posterior import PosteriorAccumulator
 
 def demo(seed=None):
     """
@@ -89,13 +90,15 @@ def demo(seed=None):
     # Fit the test model with Gibbs sampling
     ###########################################################
     N_samples = 50
-    samples = []
+    posterior = PosteriorAccumulator(
+        test_model, burnin=N_samples // 2, n_snapshots=N_samples // 2,
+        parameters=dict(c="network.c", p="network.p", v="network.v"))
     lps = []
     # plls = []
     for itr in range(N_samples):
         lps.append(test_model.log_probability())
         # plls.append(test_model.heldout_log_likelihood(S_test, F=F_test))
-        samples.append(test_model.copy_sample())
+        posterior.update()
 
         print("")
         print("Gibbs iteration ", itr)
@@ -110,7 +113,7 @@ def demo(seed=None):
     ###########################################################
     # Analyze the samples
     ###########################################################
-    analyze_samples(true_model, init_model, samples, lps)
+    analyze_samples(true_model, init_model, posterior, lps)
 
 def initialize_plots(true_model, test_model, S):
     K = true_model.K
@@ -177,25 +180,20 @@ def update_plots(itr, test_model, S, ln, im_clus, im_net):
     im_net.set_data(test_model.weight_model.W_effective)
     plt.pause(0.001)
 
-def analyze_samples(true_model, init_model, samples, lps):
-    N_samples = len(samples)
-    # Compute sample statistics for second half of samples
-    A_samples       = np.array([s.weight_model.A     for s in samples])
-    W_samples       = np.array([s.weight_model.W     for s in samples])
-    g_samples       = np.array([s.impulse_model.g    for s in samples])
-    lambda0_samples = np.array([s.bias_model.lambda0 for s in samples])
-    c_samples       = np.array([s.network.c          for s in samples])
-    p_samples       = np.array([s.network.p          for s in samples])
-    v_samples       = np.array([s.network.v          for s in samples])
-    lps             = np.array(lps)
-
-    offset = N_samples // 2
-    A_mean       = A_samples[offset:, ...].mean(axis=0)
-    W_mean       = W_samples[offset:, ...].mean(axis=0)
-    g_mean       = g_samples[offset:, ...].mean(axis=0)
-    lambda0_mean = lambda0_samples[offset:, ...].mean(axis=0)
-    p_mean       = p_samples[offset:, ...].mean(axis=0)
-    v_mean       = v_samples[offset:, ...].mean(axis=0)
+def analyze_samples(true_model, init_model, posterior, lps):
+    N_samples = posterior.n_seen
+    # Sample statistics for second half of samples
+    lps          = np.array(lps)
+    A_mean       = posterior.mean("A")
+    W_mean       = posterior.mean("W")
+    g_mean       = posterior.mean("g")
+    lambda0_mean = posterior.mean("lambda0")
+    p_mean       = posterior.mean("p")
+    v_mean       = posterior.mean("v")
+    A_samples, itrs = posterior.get_snapshots("A")
+    c_samples, _    = posterior.get_snapshots("c")
+    c_samples       = c_samples.astype(np.int64)
+    itrs           += posterior.burnin
 
 
     print("A true:        ", true_model.weight_model.A)
@@ -238,10 +236,10 @@ def analyze_samples(true_model, init_model, samples, lps):
         aucs.append(roc_auc_score(true_model.weight_model.A.ravel(), A.ravel()))
 
     plt.figure()
-    plt.plot(aucs, '-r')
-    plt.plot(auc_A_mean * np.ones_like(aucs), '--r')
-    plt.plot(auc_W_mean * np.ones_like(aucs), '--b')
-    plt.plot(auc_init * np.ones_like(aucs), '--k')
+    plt.plot(itrs, aucs, '-r')
+    plt.plot(itrs, auc_A_mean * np.ones_like(aucs), '--r')
+    plt.plot(itrs, auc_W_mean * np.ones_like(aucs), '--b')
+    plt.plot(itrs, auc_init * np.ones_like(aucs), '--k')
     plt.xlabel("Iteration")
     plt.ylabel("Link prediction AUC")
     plt.show()
@@ -255,8 +253,8 @@ def analyze_samples(true_model, init_model, samples, lps):
         arss.append(adjusted_rand_score(true_model.network.c, c))
 
     plt.figure()
-    plt.plot(np.arange(N_samples), amis, '-r')
-    plt.plot(np.arange(N_samples), arss, '-b')
+    plt.plot(itrs, amis, '-r')
+    plt.plot(itrs, arss, '-b')
     plt.xlabel("Iteration")
     plt.ylabel("Clustering score")
 
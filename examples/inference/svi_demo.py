@@ -14,6 +14,7 @@ from pyhawkes.internals.network import StochasticBlockModel
 from pyhawkes.models import \
     DiscreteTimeNetworkHawkesModelGammaMixture, \
     DiscreteTimeStandardHawkesModel
+from pyhawkes.posterior import PosteriorAccumulator
 
 
 init_with_map = True
@@ -98,17 +99,19 @@ def demo(seed=None):
     delay = 1.0
     forgetting_rate = 0.5
     stepsize = (np.arange(N_iters) + delay)**(-forgetting_rate)
-    samples = []
+    posterior = PosteriorAccumulator(
+        test_model, burnin=N_iters // 2, n_snapshots=N_iters // 2,
+        parameters=dict(c="network.c", p="network.p", v="network.v"))
     for itr in range(N_iters):
         print("SVI Iter: ", itr, "\tStepsize: ", stepsize[itr])
         test_model.sgd_step(minibatchsize=minibatchsize, stepsize=stepsize[itr])
         test_model.resample_from_mf()
-        samples.append(test_model.copy_sample())
+        posterior.update()
 
     ###########################################################
     # Analyze the samples
     ###########################################################
-    analyze_samples(true_model, init_model, samples)
+    analyze_samples(true_model, init_model, posterior)
 
 # TODO: Update the plotting code as in the Gibbs demo
 def initialize_plots(true_model, test_model, S):
@@ -167,24 +170,19 @@ def update_plots(itr, test_model, S, ln, im_clus, im_net):
     im_net.set_data(test_model.weight_model.W_effective)
     plt.pause(0.001)
 
-def analyze_samples(true_model, init_model, samples):
-    N_samples = len(samples)
-    # Compute sample statistics for second half of samples
-    A_samples       = np.array([s.weight_model.A     for s in samples])
-    W_samples       = np.array([s.weight_model.W     for s in samples])
-    g_samples       = np.array([s.impulse_model.g    for s in samples])
-    lambda0_samples = np.array([s.bias_model.lambda0 for s in samples])
-    c_samples       = np.array([s.network.c          for s in samples])
-    p_samples       = np.array([s.network.p          for s in samples])
-    v_samples       = np.array([s.network.v          for s in samples])
-
-    offset = N_samples // 2
-    A_mean       = A_samples[offset:, ...].mean(axis=0)
-    W_mean       = W_samples[offset:, ...].mean(axis=0)
-    g_mean       = g_samples[offset:, ...].mean(axis=0)
-    lambda0_mean = lambda0_samples[offset:, ...].mean(axis=0)
-    p_mean       = p_samples[offset:, ...].mean(axis=0)
-    v_mean       = v_samples[offset:, ...].mean(axis=0)
+def analyze_samples(true_model, init_model, posterior):
+    N_samples = posterior.n_seen
+    # Sample statistics for second half of samples
+    A_mean       = posterior.mean("A")
+    W_mean       = posterior.mean("W")
+    g_mean       = posterior.mean("g")
+    lambda0_mean = posterior.mean("lambda0")
+    p_mean       = posterior.mean("p")
+    v_mean       = posterior.mean("v")
+    A_samples, itrs = posterior.get_snapshots("A")
+    c_samples, _    = posterior.get_snapshots("c")
+    c_samples       = c_samples.astype(np.int64)
+    itrs           += posterior.burnin
 
 
     print("A true:        ", true_model.weight_model.A)
@@ -225,10 +223,10 @@ def analyze_samples(true_model, init_model, samples):
         aucs.append(roc_auc_score(true_model.weight_model.A.ravel(), A.ravel()))
 
     plt.figure()
-    plt.plot(aucs, '-r')
-    plt.plot(auc_A_mean * np.ones_like(aucs), '--r')
-    plt.plot(auc_W_mean * np.ones_like(aucs), '--b')
-    plt.plot(auc_init * np.ones_like(aucs), '--k')
+    plt.plot(itrs, aucs, '-r')
+    plt.plot(itrs, auc_A_mean * np.ones_like(aucs), '--r')
+    plt.plot(itrs, auc_W_mean * np.ones_like(aucs), '--b')
+    plt.plot(itrs, auc_init * np.ones_like(aucs), '--k')
     plt.xlabel("Iteration")
     plt.ylabel("Link prediction AUC")
     plt.ylim(-0.1, 1.1)
@@ -242,8 +240,8 @@ def analyze_samples(true_model, init_model, samples):
         arss.append(adjusted_rand_score(true_model.network.c, c))
 
     plt.figure()
-    plt.plot(np.arange(N_samples), amis, '-r')
-    plt.plot(np.arange(N_samples), arss, '-b')
+    plt.plot(itrs, amis, '-r')
+    plt.plot(itrs, arss, '-b')
     plt.xlabel("Iteration")
     plt.ylabel("Clustering score")
 
@@ -13,6 +13,7 @@ from pyhawkes.internals.network import StochasticBlockModel
 from pyhawkes.models import \
     DiscreteTimeNetworkHawkesModelGammaMixture, \
     DiscreteTimeStandardHawkesModel
+from pyhawkes.posterior import PosteriorAccumulator
 
 init_with_map = True
 
@@ -94,7 +95,8 @@ def demo(seed=None):
     # VB coordinate descent
     N_iters = 100
     vlbs = []
-    samples = []
+    posterior = PosteriorAccumulator(test_model, burnin=N_iters // 2,
+                                     n_snapshots=N_iters // 2)
     for itr in range(N_iters):
         vlbs.append(test_model.meanfield_coordinate_descent_step())
         print("VB Iter: ", itr, "\tVLB: ", vlbs[-1])
@@ -104,24 +106,20 @@ def demo(seed=None):
 
         # Resample from variational distribution and plot
         test_model.resample_from_mf()
-        samples.append(test_model.copy_sample())
+        posterior.update()
 
     ###########################################################
     # Analyze the samples
     ###########################################################
-    N_samples = len(samples)
-    # Compute sample statistics for second half of samples
-    A_samples       = np.array([s.weight_model.A     for s in samples])
-    W_samples       = np.array([s.weight_model.W     for s in samples])
-    g_samples       = np.array([s.impulse_model.g    for s in samples])
-    lambda0_samples = np.array([s.bias_model.lambda0 for s in samples])
-    vlbs            = np.array(vlbs)
-
-    offset = N_samples // 2
-    A_mean       = A_samples[offset:, ...].mean(axis=0)
-    W_mean       = W_samples[offset:, ...].mean(axis=0)
-    g_mean       = g_samples[offset:, ...].mean(axis=0)
-    lambda0_mean = lambda0_samples[offset:, ...].mean(axis=0)
+    N_samples = N_iters
+    # Sample statistics for second half of samples
+    vlbs         = np.array(vlbs)
+    A_mean       = posterior.mean("A")
+    W_mean       = posterior.mean("W")
+    g_mean       = posterior.mean("g")
+    lambda0_mean = posterior.mean("lambda0")
+    A_samples, itrs = posterior.get_snapshots("A")
+    itrs += posterior.burnin
 
     # Plot the VLBs
     plt.figure()
@@ -143,10 +141,10 @@ def demo(seed=None):
         aucs.append(roc_auc_score(true_model.weight_model.A.ravel(), A.ravel()))
 
     plt.figure()
-    plt.plot(aucs, '-r')
-    plt.plot(auc_A_mean * np.ones_like(aucs), '--r')
-    plt.plot(auc_W_mean * np.ones_like(aucs), '--b')
-    plt.plot(auc_init * np.ones_like(aucs), '--k')
+    plt.plot(itrs, aucs, '-r')
+    plt.plot(itrs, auc_A_mean * np.ones_like(aucs), '--r')
+    plt.plot(itrs, auc_W_mean * np.ones_like(aucs), '--b')
+    plt.plot(itrs, auc_init * np.ones_like(aucs), '--k')
     plt.xlabel("Iteration")
     plt.ylabel("Link prediction AUC")
     plt.show()
@@ -3,7 +3,6 @@ Test harness for fitting the competing models.
 """
 import time
 import pickle
-import copy
 import os
 import gzip
 import numpy as np
@@ -18,6 +17,7 @@ if "DISPLAY" not in os.environ:
     matplotlib.use('Agg')
 
 from pyhawkes.utils.utils import convert_discrete_to_continuous
+from pyhawkes.posterior import PosteriorAccumulator
 from pyhawkes.models import DiscreteTimeNetworkHawkesModelGammaMixture, \
     DiscreteTimeNetworkHawkesModelGammaMixtureSBM, \
     DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
@@ -27,6 +27,11 @@ from pyhawkes.standard_models import ReluNonlinearHawkesProcess, StandardHawkesP
 
 Results = namedtuple("Results", ["samples", "timestamps", "lps", "test_lls"])
 
+# Number of thinned snapshots of the parameters kept in the results of the
+# iterative fits, whose samples are summarized by a PosteriorAccumulator.
+# Results.samples[i] is then a dict of the parameters of snapshot i.
+N_SNAPSHOTS = 100
+
 def fit_homogeneous_pp_model(S, S_test, dt, dt_max, output_path,
                              model_args={}):
 
@@ -69,57 +74,37 @@ def fit_standard_hawkes_model_bfgs(S, S_test, dt, dt_max, output_path,
         S_train = S[:-xv_len]
         S_xv    = S[xv_len:]
 
+        print("Fitting a standard Hawkes model along a regularization path")
 
-        def _fit(lmbda):
-            print("Fitting a standard Hawkes model using BFGS")
-
-            test_model = StandardHawkesProcess(K=K, dt=dt, dt_max=dt_max, lmbda=lmbda, **model_args)
-            test_model.add_data(S_train)
-
-            # Initialize the background rates to their mean
-            test_model.initialize_to_background_rate()
-            lps = [test_model.log_likelihood()]
-            hlls = [test_model.heldout_log_likelihood(S_test)]
-
-            # Fit with BFGS
-            tic = time.clock()
-            test_model.fit_with_bfgs()
-            init_time = time.clock() - tic
-
-            lps.append(test_model.log_likelihood())
-            hlls.append(test_model.heldout_log_likelihood(S_test))
-
-            # Convert to arrays
-            lps = np.array(lps)
-            hlls = np.array(hlls)
-            timestamps = np.array([0, init_time])
+        test_model = StandardHawkesProcess(K=K, dt=dt, dt_max=dt_max, **model_args)
+        test_model.add_data(S_train)
 
-            # Make results object
-            results = Results([test_model.copy_sample()], timestamps, lps, hlls)
+        # Initialize the background rates to their mean
+        test_model.initialize_to_background_rate()
+        lp0 = test_model.log_likelihood()
+        hll0 = test_model.heldout_log_likelihood(S_test)
 
-            # Compute cross validation log likelihood
-            xv_ll = test_model.heldout_log_likelihood(S_xv)
-
-            return xv_ll, results
-
-        # Fit models with a range of regularization parameters
+        # Fit models with a range of regularization parameters,
+        # warm starting each fit from the previous one
         lmbdas = [.1, 1., 5., 10.]
-        xv_lls = []
-        xv_results = []
-
-        for lmbda in lmbdas:
-            xv_ll, results = _fit(lmbda)
-            xv_lls.append(xv_ll)
-            xv_results.append(results)
+        tic = time.clock()
+        models, path_lps, xv_lls = test_model.fit_path(lmbdas, S_heldout=S_xv)
+        init_time = time.clock() - tic
 
         # Find the best
         for lmbda, xv_ll in zip(lmbdas, xv_lls):
             print("Lambda: ", lmbda, "\tXV LL: ", xv_ll)
 
         best = np.argmax(xv_lls)
-        results = xv_results[best]
         print("Best: ", best)
 
+        # Make results object
+        best_model = models[best]
+        lps = np.array([lp0, path_lps[best]])
+        hlls = np.array([hll0, best_model.heldout_log_likelihood(S_test)])
+        timestamps = np.array([0, init_time])
+        results = Results([best_model], timestamps, lps, hlls)
+
         # Save the model
         with gzip.open(output_path, 'w') as f:
             print("Saving std BFGS results to ", output_path)
@@ -144,57 +129,37 @@ def fit_nonlinear_hawkes_model_bfgs(S, S_test, dt, dt_max, output_path,
         S_train = S[:-xv_len]
         S_xv    = S[xv_len:]
 
+        print("Fitting a nonlinear Hawkes model along a regularization path")
 
-        def _fit(lmbda):
-            print("Fitting a nonlinear Hawkes model using BFGS")
+        test_model = ReluNonlinearHawkesProcess(K=K, dt=dt, dt_max=dt_max, **model_args)
+        test_model.add_data(S_train)
 
-            test_model = ReluNonlinearHawkesProcess(K=K, dt=dt, dt_max=dt_max, lmbda=lmbda, **model_args)
-            test_model.add_data(S_train)
+        # Initialize the background rates to their mean
+        test_model.initialize_to_background_rate()
+        lp0 = test_model.log_likelihood()
+        hll0 = test_model.heldout_log_likelihood(S_test)
 
-            # Initialize the background rates to their mean
-            test_model.initialize_to_background_rate()
-            lps = [test_model.log_likelihood()]
-            hlls = [test_model.heldout_log_likelihood(S_test)]
-
-            # Fit with BFGS
-            tic = time.clock()
-            test_model.fit_with_bfgs()
-            init_time = time.clock() - tic
-
-            lps.append(test_model.log_likelihood())
-            hlls.append(test_model.heldout_log_likelihood(S_test))
-
-            # Convert to arrays
-            lps = np.array(lps)
-            hlls = np.array(hlls)
-            timestamps = np.array([0, init_time])
-
-            # Make results object
-            results = Results([test_model.copy_sample()], timestamps, lps, hlls)
-
-            # Compute cross validation log likelihood
-            xv_ll = test_model.heldout_log_likelihood(S_xv)
-
-            return xv_ll, results
-
-        # Fit models with a range of regularization parameters
+        # Fit models with a range of regularization parameters,
+        # warm starting each fit from the previous one
         lmbdas = [.1, 1., 5., 10.]
-        xv_lls = []
-        xv_results = []
-
-        for lmbda in lmbdas:
-            xv_ll, results = _fit(lmbda)
-            xv_lls.append(xv_ll)
-            xv_results.append(results)
+        tic = time.clock()
+        models, path_lps, xv_lls = test_model.fit_path(lmbdas, S_heldout=S_xv)
+        init_time = time.clock() - tic
 
         # Find the best
         for lmbda, xv_ll in zip(lmbdas, xv_lls):
             print("Lambda: ", lmbda, "\tXV LL: ", xv_ll)
 
         best = np.argmax(xv_lls)
-        results = xv_results[best]
         print("Best: ", best)
 
+        # Make results object
+        best_model = models[best]
+        lps = np.array([lp0, path_lps[best]])
+        hlls = np.array([hll0, best_model.heldout_log_likelihood(S_test)])
+        timestamps = np.array([0, init_time])
+        results = Results([best_model], timestamps, lps, hlls)
+
         # Save the model
         with gzip.open(output_path, 'w') as f:
             print("Saving nonlinear BFGS results to ", output_path)
@@ -228,7 +193,8 @@ def fit_spikeslab_network_hawkes_gibbs(S, S_test, dt, dt_max, output_path,
 
 
         # Gibbs sample
-        samples = []
+        samples = PosteriorAccumulator(test_model, n_snapshots=N_SNAPSHOTS,
+                                       parameters=dict(impulses="impulses"))
         lps = [test_model.log_probability()]
         hlls = [test_model.heldout_log_likelihood(S_test)]
         times = [0]
@@ -236,7 +202,7 @@ def fit_spikeslab_network_hawkes_gibbs(S, S_test, dt, dt_max, output_path,
             # Update the model
             tic = time.time()
             test_model.resample_model()
-            samples.append(copy.deepcopy(test_model.get_parameters()))
+            samples.update()
             times.append(time.time() - tic)
 
             # Compute log probability and heldout log likelihood
@@ -292,7 +258,7 @@ def fit_ct_network_hawkes_gibbs(S, S_test, dt, dt_max, output_path,
             test_model.initialize_with_standard_model(standard_model)
 
         # Gibbs sample
-        samples = []
+        samples = PosteriorAccumulator(test_model, n_snapshots=N_SNAPSHOTS)
         lps = [test_model.log_probability()]
         hlls = [test_model.heldout_log_likelihood(S_test_ct, C_test_ct, T_test)]
         times = [0]
@@ -302,7 +268,7 @@ def fit_ct_network_hawkes_gibbs(S, S_test, dt, dt_max, output_path,
             test_model.resample_model()
             times.append(time.time() - tic)
 
-            samples.append(copy.deepcopy(test_model.get_parameters()))
+            samples.update()
 
             # Compute log probability and heldout log likelihood
             # lps.append(test_model.log_probability())
@@ -361,7 +327,8 @@ def fit_network_hawkes_vb(S, S_test, dt, dt_max, output_path,
             test_model.initialize_with_standard_model(standard_model)
 
         # Batch variational inference
-        samples = []
+        samples = PosteriorAccumulator(test_model, n_snapshots=N_SNAPSHOTS,
+                                       parameters=dict(impulses="impulses"))
         lps = [test_model.log_probability()]
         hlls = [test_model.heldout_log_likelihood(S_test)]
         times = [0]
@@ -373,8 +340,7 @@ def fit_network_hawkes_vb(S, S_test, dt, dt_max, output_path,
 
             # Resample from variational posterior to compute log prob and hlls
             test_model.resample_from_mf()
-            # samples.append(test_model.copy_sample())
-            samples.append(copy.deepcopy(test_model.get_parameters()))
+            samples.update()
 
 
             # Compute log probability and heldout log likelihood
@@ -440,7 +406,8 @@ def fit_network_hawkes_svi(S, S_test, dt, dt_max, output_path,
         stepsize = (np.arange(N_samples) + delay)**(-forgetting_rate)
 
         # Stochastic variational inference
-        samples = []
+        samples = PosteriorAccumulator(test_model, n_snapshots=N_SNAPSHOTS,
+                                       parameters=dict(impulses="impulses"))
         lps = [test_model.log_probability()]
         hlls = [test_model.heldout_log_likelihood(S_test)]
         times = [0]
@@ -452,8 +419,7 @@ def fit_network_hawkes_svi(S, S_test, dt, dt_max, output_path,
 
             # Resample from variational posterior to compute log prob and hlls
             test_model.resample_from_mf()
-            # samples.append(test_model.copy_sample())
-            samples.append(copy.deepcopy(test_model.get_parameters()))
+            samples.update()
 
             # Compute log probability and heldout log likelihood
             # lps.append(test_model.log_probability())
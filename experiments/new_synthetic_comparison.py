@@ -18,6 +18,7 @@ import matplotlib.pyplot as plt
 # colors = np.array(colors)[goodcolors]
 
 import harness
+from pyhawkes.utils.utils import logit
 
 
 
@@ -118,17 +119,23 @@ def plot_impulse_responses(models, results):
     y_max = 0
 
     for i, (model, result) in enumerate(zip(models, results)):
+        # The last snapshot of the parameters
         smpl = result.samples[-1]
-        W = smpl.W_effective
-        if "continuous" in str(smpl.__class__).lower():
-            t, irs = smpl.impulses
+        W = smpl["W_effective"]
+        if "mu" in smpl:
+            # Logistic normal impulse responses of the continuous time model
+            mu, tau = smpl["mu"], smpl["tau"]
+            t = np.linspace(0, dt_max, 50)
+            lags = t[:,None,None]
+            Z = lags * (dt_max - lags) / dt_max * np.sqrt(2*np.pi/tau)
+            irs = 1./Z * np.exp(-tau/2. * (logit(lags/dt_max) - mu)**2)
 
             for k1 in range(K):
                 for k2 in range(K):
                     plt.subplot(K,K,k1*K + k2 + 1)
                     plt.plot(t, W[k1,k2] * irs[:,k1,k2], color=col[i], lw=2)
         else:
-            irs = smpl.impulses
+            irs = smpl["impulses"]
             for k1 in range(K):
                 for k2 in range(K):
                     plt.subplot(K,K,k1*K + k2 + 1)
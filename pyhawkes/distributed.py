@@ -0,0 +1,383 @@
+"""
+Data-parallel Gibbs sampling and mean field variational inference.
+
+The global model components (the bias, impulse response, weight and
+network models) only depend on the data through the sufficient
+statistics of the parents summed over all data sets. DataParallelModel
+splits the data sets over a set of workers, each of which keeps the
+parents of its shard resident. Every iteration, the workers receive the
+parameters of the global components, update their parents, and return
+only their summed statistics, which are reduced and used to update the
+global components of the model held by the caller.
+
+The workers are reached through a Transport. LocalTransport runs them in
+processes on this machine. ConnectionTransport talks to workers on other
+machines that connect with serve(), e.g.
+
+    # On the master
+    listener = Listener(("", 6000), authkey=b"secret")
+    ... start the workers with serve(("master", 6000), b"secret") ...
+    model = DataParallelModel(model, ConnectionTransport.accept(listener, 8))
+"""
+import multiprocessing
+import traceback
+from multiprocessing.connection import Client
+
+import numpy as np
+
+# The components whose parameters the parent updates depend on
+_GLOBAL_COMPONENTS = ("bias_model", "impulse_model", "weight_model")
+
+
+def get_global_parameters(model):
+    """
+    Get the parameters of the global components that the parents
+    depend on, as a dict of {component: {parameter: value}}.
+    """
+    params = {}
+    for name in _GLOBAL_COMPONENTS:
+        component = getattr(model, name)
+        params[name] = {p: getattr(component, p)
+                        for p in component._versioned_params
+                        if p in component.__dict__}
+    return params
+
+
+def set_global_parameters(model, params):
+    """
+    Set the parameters of the global components from the output of
+    get_global_parameters. Assigning the parameters invalidates the
+    caches of the components.
+    """
+    for name, component_params in params.items():
+        component = getattr(model, name)
+        for p, value in component_params.items():
+            setattr(component, p, value)
+
+
+class ReducedStatistics(object):
+    """
+    Sufficient statistics of the parents summed over a set of data sets.
+    It stands in for the parents in the data list of a model: it exposes
+    their compute_*_ss methods, and its resample and meanfieldupdate
+    methods do nothing, since the parents were already updated remotely.
+    """
+    def __init__(self, **stats):
+        self.stats = stats
+
+    @classmethod
+    def from_parents(cls, pool, data, names, **extra):
+        stats = {n: pool.sum(lambda d: getattr(d, "compute_" + n)(), data)
+                 for n in names}
+        stats.update(extra)
+        return cls(**stats)
+
+    def __add__(self, other):
+        if isinstance(other, int) and other == 0:
+            return self
+        return ReducedStatistics(**{n: self.stats[n] + other.stats[n]
+                                    for n in self.stats})
+
+    __radd__ = __add__
+
+    def resample(self):
+        pass
+
+    def meanfieldupdate(self, compute_vlb=False):
+        return self.stats.get("vlb", 0) if compute_vlb else None
+
+    def compute_bkgd_ss(self):
+        return self.stats["bkgd_ss"]
+
+    def compute_weight_ss(self):
+        return self.stats["weight_ss"]
+
+    def compute_ir_ss(self):
+        return self.stats["ir_ss"]
+
+    def compute_exp_bkgd_ss(self):
+        return self.stats["exp_bkgd_ss"]
+
+    def compute_exp_weight_ss(self):
+        return self.stats["exp_weight_ss"]
+
+    def compute_exp_ir_ss(self):
+        return self.stats["exp_ir_ss"]
+
+
+class _Shard(object):
+    """
+    The state of a worker: a copy of the model without data, to which
+    the data sets of the shard are added.
+    """
+    def __init__(self, model, seed):
+        self.model = model
+        np.random.seed(seed)
+
+    def add_data(self, S, kwargs):
+        self.model.add_data(S, **kwargs)
+        return len(self.model.data_list)
+
+    def resample(self, params):
+        set_global_parameters(self.model, params)
+        pool, data = self.model.data_pool, self.model.data_list
+        pool.map(lambda p: p.resample(), data)
+        return ReducedStatistics.from_parents(
+            pool, data, ("bkgd_ss", "weight_ss", "ir_ss"))
+
+    def meanfieldupdate(self, params):
+        set_global_parameters(self.model, params)
+        pool, data = self.model.data_pool, self.model.data_list
+        vlb = sum(pool.map(lambda p: p.meanfieldupdate(compute_vlb=True), data))
+        return ReducedStatistics.from_parents(
+            pool, data, ("exp_bkgd_ss", "exp_weight_ss", "exp_ir_ss"), vlb=vlb)
+
+    def log_likelihood(self, params):
+        set_global_parameters(self.model, params)
+        return self.model.log_likelihood()
+
+    def get_vlb(self, params):
+        set_global_parameters(self.model, params)
+        pool, data = self.model.data_pool, self.model.data_list
+        return sum(pool.map(lambda d: d.get_vlb(), data))
+
+
+class _WorkerError(object):
+    def __init__(self, message):
+        self.message = message
+
+
+def run_worker(connection):
+    """
+    Serve the commands of a DataParallelModel received on a connection
+    with the send and recv methods of multiprocessing connections, until
+    the transport is closed.
+    """
+    shard = None
+    while True:
+        command, args = connection.recv()
+        if command == "close":
+            connection.close()
+            return
+
+        try:
+            if command == "init":
+                shard = _Shard(*args)
+                reply = None
+            else:
+                reply = getattr(shard, command)(*args)
+        except Exception:
+            reply = _WorkerError(traceback.format_exc())
+        connection.send(reply)
+
+
+def serve(address, authkey=None):
+    """
+    Run a worker for a ConnectionTransport listening at address
+    """
+    run_worker(Client(address, authkey=authkey))
+
+
+class Transport(object):
+    """
+    Interface to a set of workers running run_worker. A transport sends
+    a command and its arguments to a worker, and receives the replies of
+    each worker in order.
+    """
+    n_workers = 0
+
+    def send(self, worker, command, args):
+        raise NotImplementedError()
+
+    def recv(self, worker):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class ConnectionTransport(Transport):
+    """
+    Transport to workers at the other end of multiprocessing connections,
+    e.g. pipes to local processes or sockets to workers on other machines.
+    """
+    def __init__(self, connections):
+        self.connections = list(connections)
+        self.n_workers = len(self.connections)
+
+    @classmethod
+    def accept(cls, listener, n_workers):
+        """
+        Accept connections from n_workers workers, started with serve(),
+        on a multiprocessing.connection.Listener
+        """
+        return cls([listener.accept() for _ in range(n_workers)])
+
+    def send(self, worker, command, args):
+        self.connections[worker].send((command, args))
+
+    def recv(self, worker):
+        return self.connections[worker].recv()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", ()))
+            connection.close()
+        self.connections = []
+
+
+class LocalTransport(ConnectionTransport):
+    """
+    Transport to worker processes on this machine
+    """
+    def __init__(self, n_workers=None, context=None):
+        """
+        :param n_workers: Number of worker processes, or None for one per core
+        :param context:   Start method of the processes, e.g. "spawn",
+                          or None for the multiprocessing default
+        """
+        ctx = multiprocessing.get_context(context)
+        n_workers = ctx.cpu_count() if n_workers is None else n_workers
+
+        connections = []
+        self.processes = []
+        for _ in range(n_workers):
+            connection, worker_connection = ctx.Pipe()
+            process = ctx.Process(target=run_worker, args=(worker_connection,))
+            process.daemon = True
+            process.start()
+            worker_connection.close()
+
+            connections.append(connection)
+            self.processes.append(process)
+
+        super(LocalTransport, self).__init__(connections)
+
+    def close(self):
+        super(LocalTransport, self).close()
+        for process in self.processes:
+            process.join()
+
+
+class DataParallelModel(object):
+    """
+    Run Gibbs sampling or mean field variational inference for a discrete
+    time network Hawkes model with its data sets sharded over a set of
+    workers. The global components live in the wrapped model, which must
+    not have any data itself, and the other attributes of the model,
+    e.g. W_effective or copy_sample, are available on the wrapper.
+
+    Only the weight models that are resampled from the parent statistics
+    alone can be sampled this way. For the spike-and-slab models that
+    means the collapsed sampler, weight_hypers=dict(joint_resampling=True).
+    """
+    def __init__(self, model, transport=None, n_workers=None):
+        """
+        :param model:     A discrete time network Hawkes model without data
+        :param transport: Transport to the workers. Defaults to a
+                          LocalTransport with n_workers processes.
+        """
+        assert len(model.data_list) == 0, \
+            "Add the data to the DataParallelModel, not to the model"
+        self.model = model
+        self.transport = transport if transport is not None \
+            else LocalTransport(n_workers)
+        self.n_workers = self.transport.n_workers
+        assert self.n_workers > 0, "There must be at least one worker"
+
+        # Send every worker a copy of the model and a seed
+        seeds = np.random.randint(2**31, size=self.n_workers)
+        self._call("init", [(model.copy_sample(), seed) for seed in seeds])
+        self.shard_sizes = np.zeros(self.n_workers, dtype=int)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found on the wrapper
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def _check(self, reply):
+        if isinstance(reply, _WorkerError):
+            raise RuntimeError("Worker failed:\n" + reply.message)
+        return reply
+
+    def _call(self, command, args):
+        """
+        Send a command to all the workers, with their arguments, and
+        return their replies once they have all finished.
+        """
+        for worker, worker_args in enumerate(args):
+            self.transport.send(worker, command, worker_args)
+        return [self._check(self.transport.recv(worker))
+                for worker in range(self.n_workers)]
+
+    def _broadcast(self, command):
+        params = get_global_parameters(self.model)
+        return self._call(command, [(params,)] * self.n_workers)
+
+    def add_data(self, S, worker=None, **kwargs):
+        """
+        Add a data set to the shard of a worker, by default the one with
+        the fewest data sets. The keyword arguments are passed on to the
+        add_data method of the model.
+        """
+        if worker is None:
+            worker = int(np.argmin(self.shard_sizes))
+        self.transport.send(worker, "add_data", (S, kwargs))
+        self.shard_sizes[worker] = self._check(self.transport.recv(worker))
+
+    def _step(self, command, update):
+        """
+        Update the global components with the reduced statistics of the
+        workers standing in for the parents of the model
+        """
+        stats = self.model.data_pool.sum(lambda s: s, self._broadcast(command))
+        self.model.data_list = [stats]
+        try:
+            return update()
+        finally:
+            self.model.data_list = []
+
+    def resample_model(self, *args, **kwargs):
+        """
+        Perform one iteration of Gibbs sampling
+        """
+        assert getattr(self.model.weight_model, "joint_resampling", True), \
+            "Resampling A | W needs the data. " \
+            "Use weight_hypers=dict(joint_resampling=True)."
+        self._step("resample", lambda: self.model.resample_model(*args, **kwargs))
+
+    def meanfield_coordinate_descent_step(self, fast_vlb=True):
+        """
+        Perform one round of mean field coordinate ascent and return the
+        VLB. See the method of the model for fast_vlb.
+        """
+        vlb = self._step("meanfieldupdate",
+                         lambda: self.model.meanfield_coordinate_descent_step(fast_vlb=True))
+        return vlb if fast_vlb else self.get_vlb()
+
+    def log_likelihood(self):
+        return sum(self._broadcast("log_likelihood"))
+
+    def log_probability(self):
+        return self.log_likelihood() + self.model.log_prior()
+
+    def get_vlb(self):
+        vlb = sum(self._broadcast("get_vlb"))
+        vlb += self.model.bias_model.get_vlb()
+        vlb += self.model.impulse_model.get_vlb()
+        vlb += self.model.weight_model.get_vlb()
+        vlb += self.model.network.get_vlb()
+        return vlb
+
+    def close(self):
+        """
+        Stop the workers
+        """
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,2 +1,2 @@
 
-from . import bias, continuous_time_helpers, distributions, impulses, network, parallel_adjacency_resampling, parent_updates, parents, weights
+from . import bias, continuous_time_helpers, distributions, impulses, network, parallel_adjacency_resampling, parallel_bfgs_fitting, parent_updates, parents, weights
@@ -3,11 +3,14 @@ from scipy.special import gammaln, psi
 
 from pybasicbayes.abstractions import GibbsSampling, MeanField, MeanFieldSVI
 from pyhawkes.internals.distributions import Gamma
+from pyhawkes.utils.cache import VersionedParameters, cached_by_version
 
-class GammaBias(GibbsSampling, MeanField, MeanFieldSVI):
+class GammaBias(VersionedParameters, GibbsSampling, MeanField, MeanFieldSVI):
     """
     Encapsulates the vector of K gamma-distributed bias variables.
     """
+    _versioned_params = ("lambda0", "mf_alpha", "mf_beta")
+
     def __init__(self, model, alpha, beta):
         """
         Initialize a bias vector for each of the K processes.
@@ -69,7 +72,7 @@ class GammaBias(GibbsSampling, MeanField, MeanFieldSVI):
         :param data: Z0, a TxK matrix of events assigned to the background.
         """
         ss = np.zeros((2, self.K)) + \
-             sum([d.compute_bkgd_ss() for d in data])
+             self.model.data_pool.sum(lambda d: d.compute_bkgd_ss(), data)
 
         alpha_post = self.alpha + ss[0,:]
         beta_post  = self.beta + ss[1,:]
@@ -78,9 +81,11 @@ class GammaBias(GibbsSampling, MeanField, MeanFieldSVI):
                                                 1.0/beta_post)).reshape((self.K, ))
 
     ### Mean Field
+    @cached_by_version
     def expected_lambda0(self):
         return self.mf_alpha / self.mf_beta
 
+    @cached_by_version
     def expected_log_lambda0(self):
         return psi(self.mf_alpha) - np.log(self.mf_beta)
 
@@ -92,7 +97,7 @@ class GammaBias(GibbsSampling, MeanField, MeanFieldSVI):
         Update background rates given expected parent assignments.
         :return:
         """
-        exp_ss = sum([d.compute_exp_bkgd_ss() for d in data])
+        exp_ss = self.model.data_pool.sum(lambda d: d.compute_exp_bkgd_ss(), data)
         alpha_hat = self.alpha + exp_ss[0] / minibatchfrac
         self.mf_alpha = (1-stepsize) * self.mf_alpha + stepsize * alpha_hat
 
@@ -3,14 +3,17 @@ from scipy.special import gammaln, psi
 
 from pybasicbayes.abstractions import GibbsSampling, MeanField, MeanFieldSVI
 from pyhawkes.internals.distributions import Dirichlet
+from pyhawkes.utils.cache import VersionedParameters, cached_by_version
 
-class DirichletImpulseResponses(GibbsSampling, MeanField, MeanFieldSVI):
+class DirichletImpulseResponses(VersionedParameters, GibbsSampling, MeanField, MeanFieldSVI):
     """
     Encapsulates the impulse response vector distribution. In the
     discrete time Hawkes model this is a set of Dirichlet-distributed
     vectors of length B for each pair of processes, k and k', which
     we denote $\bbeta^{(k,k')}. This class contains all K^2 vectors.
     """
+    _versioned_params = ("g", "mf_gamma")
+
     def __init__(self, model, gamma=None):
         """
         Initialize a set of Dirichlet weight vectors.
@@ -80,35 +83,33 @@ class DirichletImpulseResponses(GibbsSampling, MeanField, MeanFieldSVI):
         Resample the
         """
         ss = np.zeros((self.K, self.K, self.B)) + \
-             sum([d.compute_ir_ss() for d in data])
+             self.model.data_pool.sum(lambda d: d.compute_ir_ss(), data)
 
         for k1 in range(self.K):
             for k2 in range(self.K):
                 alpha_post = self.gamma + ss[k1, k2, :]
                 self.g[k1,k2,:] = np.random.dirichlet(alpha_post)
+        self.touch()
 
+    @cached_by_version
     def expected_g(self):
         # \sum_{b} \gamma_b
         trm2 = self.mf_gamma.sum(axis=2)
         E_g = self.mf_gamma / trm2[:,:,None]
         return E_g
 
+    @cached_by_version
     def expected_log_g(self):
-        E_lng = np.zeros_like(self.mf_gamma)
-
         # \psi(\sum_{b} \gamma_b)
         trm2 = psi(self.mf_gamma.sum(axis=2))
-        for b in range(self.B):
-            E_lng[:,:,b] = psi(self.mf_gamma[:,:,b]) - trm2
-
-        return E_lng
+        return psi(self.mf_gamma) - trm2[:,:,None]
 
     def mf_update_gamma(self, data, minibatchfrac=1.0, stepsize=1.0):
         """
         Update gamma given E[Z]
         :return:
         """
-        exp_ss = sum([d.compute_exp_ir_ss() for d in data])
+        exp_ss = self.model.data_pool.sum(lambda d: d.compute_exp_ir_ss(), data)
         gamma_hat = self.gamma + exp_ss / minibatchfrac
         self.mf_gamma = (1.0 - stepsize) * self.mf_gamma + stepsize * gamma_hat
 
@@ -150,6 +151,7 @@ class DirichletImpulseResponses(GibbsSampling, MeanField, MeanFieldSVI):
         for k1 in range(self.K):
             for k2 in range(self.K):
                 self.g[k1,k2,:] = np.random.dirichlet(self.mf_gamma[k1,k2,:])
+        self.touch()
 
 
 class SBMDirichletImpulseResponses(GibbsSampling):
@@ -4,6 +4,7 @@ Network models expose a probability of connection and a scale of the weights
 import abc
 
 import numpy as np
+import scipy.sparse
 from scipy.special import gammaln, psi
 from scipy.misc import logsumexp
 
@@ -13,6 +14,23 @@ from pybasicbayes.util.stats import sample_discrete_from_log
 
 from pyhawkes.internals.distributions import Discrete, Bernoulli, \
                                              Gamma, Dirichlet, Beta
+from pyhawkes.utils.cache import VersionedParameters, cached_by_version
+
+def _edge_matrices(A, W):
+    """
+    Get the edges present in A (or their probabilities, for E[A]) and A * W
+    as KxK scipy.sparse CSR matrices with the same sparsity pattern. A and
+    W may be dense arrays or scipy.sparse matrices, e.g. those of a weight
+    model restricted to candidate edges, so the cost of the network
+    updates scales with the number of edges.
+    """
+    A = scipy.sparse.csr_matrix(A, dtype=np.float64)
+    A.eliminate_zeros()
+    rows, cols = A.nonzero()
+    w = np.asarray(W[rows, cols], dtype=np.float64).ravel()
+    AW = scipy.sparse.csr_matrix((A.data * w, A.indices, A.indptr), shape=A.shape)
+    return A, AW
+
 
 # TODO: Make a base class for networks
 # class Network(BayesianDistribution):
@@ -40,7 +58,7 @@ from pyhawkes.internals.distributions import Discrete, Bernoulli, \
 #         """
 #         pass
 
-class _StochasticBlockModelBase(BayesianDistribution):
+class _StochasticBlockModelBase(VersionedParameters, BayesianDistribution):
     """
     A stochastic block model is a clustered network model with
     K:          Number of nodes in the network
@@ -58,6 +76,9 @@ class _StochasticBlockModelBase(BayesianDistribution):
 
     __metaclass__ = abc.ABCMeta
 
+    _versioned_params = ("c", "m", "p", "v", "kappa", "allow_self_connections",
+                         "mf_m", "mf_pi", "mf_tau0", "mf_tau1", "mf_alpha", "mf_beta")
+
     def __init__(self, K, C,
                  c=None, m=None, pi=1.0,
                  p=None, tau0=0.1, tau1=0.1,
@@ -137,6 +158,7 @@ class _StochasticBlockModelBase(BayesianDistribution):
             self.fixed = False
 
     @property
+    @cached_by_version
     def P(self):
         """
         Get the KxK matrix of probabilities
@@ -148,6 +170,7 @@ class _StochasticBlockModelBase(BayesianDistribution):
         return P
 
     @property
+    @cached_by_version
     def V(self):
         """
         Get the KxK matrix of scales
@@ -159,6 +182,19 @@ class _StochasticBlockModelBase(BayesianDistribution):
     def Kappa(self):
         return self.kappa * np.ones((self.K, self.K))
 
+    def prior_on_edges(self, rows, cols):
+        """
+        Get the probability of connection and the shape and scale of
+        the weights of the edges from rows to cols, without forming
+        the KxK matrices
+        :return: p, kappa, v as vectors over the edges
+        """
+        c1, c2 = self.c[rows], self.c[cols]
+        p = self.p[c1, c2]
+        if not self.allow_self_connections:
+            p = np.where(rows == cols, 0.0, p)
+        return p, self.kappa * np.ones(len(rows)), self.v[c1, c2]
+
     def log_likelihood(self, x):
         """
         Compute the log likelihood of a set of SBM parameters
@@ -210,78 +246,130 @@ class GibbsSBM(_StochasticBlockModelBase, GibbsSampling):
             # self.v = self.alpha / self.beta * np.ones((self.C, self.C))
             self.v = np.random.gamma(self.alpha, 1.0/self.beta, size=(self.C, self.C))
 
-    def resample_p(self, A):
+    def _one_hot(self):
         """
-        Resample p given observations of the weights
+        Get the KxC one-hot matrix of block assignments
         """
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                Ac1c2 = A[np.ix_(self.c==c1, self.c==c2)]
+        X = np.zeros((self.K, self.C))
+        X[np.arange(self.K), self.c] = 1
+        return X
 
-                if not self.allow_self_connections:
-                    # TODO: Account for self connections
-                    pass
+    def _block_stats(self, A, W=None):
+        """
+        Compute the CxC matrices of edge counts, non-edge counts and
+        (if W is given) weight sums between each pair of blocks
+        """
+        X = self._one_hot()
+        n = X.sum(0)
+        A = scipy.sparse.csr_matrix(A, dtype=np.float64)
+        n_edges = X.T.dot(A.dot(X))
+        n_nonedges = np.outer(n, n) - n_edges
+        W_sum = X.T.dot(_edge_matrices(A, W)[1].dot(X)) if W is not None else None
+        return n_edges, n_nonedges, W_sum
 
-                tau1 = self.tau1 + Ac1c2.sum()
-                tau0 = self.tau0 + (1-Ac1c2).sum()
-                self.p[c1,c2] = np.random.beta(tau1, tau0)
+    def resample_p(self, A):
+        """
+        Resample p given observations of the weights
+        """
+        # TODO: Account for self connections
+        n_edges, n_nonedges, _ = self._block_stats(A)
+        tau1 = self.tau1 + n_edges
+        tau0 = self.tau0 + n_nonedges
+        self.p = np.random.beta(tau1, tau0)
 
     def resample_v(self, A, W):
         """
         Resample v given observations of the weights
         """
-        # import pdb; pdb.set_trace()
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                Ac1c2 = A[np.ix_(self.c==c1, self.c==c2)]
-                Wc1c2 = W[np.ix_(self.c==c1, self.c==c2)]
-                alpha = self.alpha + Ac1c2.sum() * self.kappa
-                beta  = self.beta + Wc1c2[Ac1c2 > 0].sum()
-                self.v[c1,c2] = np.random.gamma(alpha, 1.0/beta)
+        n_edges, _, W_sum = self._block_stats(A, W)
+        alpha = self.alpha + n_edges * self.kappa
+        beta  = self.beta + W_sum
+        self.v = np.random.gamma(alpha, 1.0/beta)
 
     def resample_c(self, A, W):
         """
         Resample block assignments given the weighted adjacency matrix
         and the impulse response fits (if used)
+
+        The log likelihood of the edges out of and into a node only
+        depends on their counts and weight sums in each block, so we
+        keep these KxC node statistics and update them from the node's
+        edges whenever it changes blocks.
         """
         if self.C == 1:
             return
 
+        # Rows of A are the edges out of each node, rows of At the edges into it
+        A, AW = _edge_matrices(A, W)
+        At, AWt = A.T.tocsr(), AW.T.tocsr()
+        a_self, aw_self = A.diagonal(), AW.diagonal()
+
+        # Node statistics of the edges out of (rows) and into (columns) each node
+        X = self._one_hot()
+        n = X.sum(0)
+        out_stats = np.array([A.dot(X), AW.dot(X)])         # (2,K,C)
+        in_stats = np.array([At.dot(X), AWt.dot(X)])        # (2,K,C)
+
+        # Block pair log probabilities. Clip the logs so that probabilities
+        # of exactly zero or one give large negative numbers instead of nan.
+        tiny = np.finfo(np.float64).tiny
+        log_p = np.log(np.clip(self.p, tiny, 1.0))
+        log_notp = np.log(np.clip(1.0 - self.p, tiny, 1.0))
+        log_v = np.log(np.clip(self.v, tiny, np.inf))
+        kappa, v = self.kappa, self.v
+        diag_log_p, diag_log_notp = np.diag(log_p), np.diag(log_notp)
+        diag_log_v, diag_v = np.diag(log_v), np.diag(v)
+
+        def _lp(stats, n_other, log_p, log_notp, log_v, v):
+            # Log likelihood of a node's edges to other blocks for each of
+            # its candidate blocks, up to a constant. The (kappa-1) log W and
+            # log Gamma(kappa) terms of the weights do not depend on c.
+            a, aw = stats
+            return log_p.dot(a) + log_notp.dot(n_other - a) \
+                   + kappa * log_v.dot(a) - v.dot(aw)
+
         # Sample each assignment in order
         for k in range(self.K):
-            # Compute unnormalized log probs of each connection
-            lp = np.zeros(self.C)
+            ck = self.c[k]
 
-            # Prior from m
-            lp += np.log(self.m)
+            # Remove the self connection from the statistics
+            n_other = n.copy()
+            n_other[ck] -= 1
+            out_k = out_stats[:,k,:].copy()
+            out_k[:,ck] -= [a_self[k], aw_self[k]]
+            in_k = in_stats[:,k,:].copy()
+            in_k[:,ck] -= [a_self[k], aw_self[k]]
 
-            # Likelihood from network
-            for ck in range(self.C):
-                c_temp = self.c.copy().astype(np.int)
-                c_temp[k] = ck
-
-                # p(A[k,k'] | c)
-                lp[ck] += Bernoulli(self.p[ck, c_temp])\
-                                .log_probability(A[k,:]).sum()
-
-                # p(A[k',k] | c)
-                lp[ck] += Bernoulli(self.p[c_temp, ck])\
-                                .log_probability(A[:,k]).sum()
-
-                # p(W[k,k'] | c)
-                lp[ck] += (A[k,:] * Gamma(self.kappa, self.v[ck, c_temp])\
-                                .log_probability(W[k,:])).sum()
+            # Prior from m
+            lp = np.log(self.m)
 
-                # p(W[k,k'] | c)
-                lp[ck] += (A[:,k] * Gamma(self.kappa, self.v[c_temp, ck])\
-                                .log_probability(W[:,k])).sum()
+            # p(A[k,k'], W[k,k'] | c) and p(A[k',k], W[k',k] | c)
+            lp += _lp(out_k, n_other, log_p, log_notp, log_v, v)
+            lp += _lp(in_k, n_other, log_p.T, log_notp.T, log_v.T, v.T)
 
-                # TODO: Subtract of self connection since we double counted
+            # The self connection is in block (c_k, c_k). It is counted
+            # once as an outgoing and once as an incoming edge.
+            lp += 2 * (a_self[k] * (diag_log_p + kappa * diag_log_v) - diag_v * aw_self[k]
+                       + (1 - a_self[k]) * diag_log_notp)
 
-                # TODO: Get probability of impulse responses g
+            # TODO: Get probability of impulse responses g
 
             # Resample from lp
-            self.c[k] = sample_discrete_from_log(lp)
+            cn = sample_discrete_from_log(lp)
+            self.c[k] = cn
+            self.touch()
+
+            # Move node k from block ck to block cn. The edges into k
+            # change the out statistics of their senders and the edges
+            # out of k change the in statistics of their receivers.
+            if cn != ck:
+                n[ck] -= 1
+                n[cn] += 1
+                for stats, M, MW in ((out_stats, At, AWt), (in_stats, A, AW)):
+                    edges = slice(M.indptr[k], M.indptr[k+1])
+                    nodes = M.indices[edges]
+                    stats[:,nodes,ck] -= [M.data[edges], MW.data[edges]]
+                    stats[:,nodes,cn] += [M.data[edges], MW.data[edges]]
 
     def resample_m(self):
         """
@@ -329,6 +417,46 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         self.mf_alpha = self.alpha * np.ones((self.C, self.C))
         self.mf_beta  = self.beta  * np.ones((self.C, self.C))
 
+    def _average_over_c(self, X):
+        """
+        Average a CxC matrix of block pair parameters over the joint
+        class assignment probabilities of each pair of nodes,
+        sum_{c1,c2} mf_m[k1,c1] * mf_m[k2,c2] * X[c1,c2]
+        :return: KxK matrix
+        """
+        return self.mf_m.dot(X).dot(self.mf_m.T)
+
+    def expected_on_edges(self, rows, cols):
+        """
+        Compute the expected log probabilities of connection and no
+        connection and the expected scale and log scale of the edges
+        from rows to cols, averaging over c without forming the KxK
+        matrices
+        :return: E[ln p], E[ln (1-p)], E[v], E[ln v] as vectors over the edges
+        """
+        if self.fixed:
+            c1, c2 = self.c[rows], self.c[cols]
+            p, v = self.p[c1, c2], self.v[c1, c2]
+            E_ln_p, E_ln_notp = np.log(p), np.log(1.0 - p)
+            E_v, E_ln_v = v, np.log(v)
+        else:
+            def _average(X):
+                return (self.mf_m[rows].dot(X) * self.mf_m[cols]).sum(1)
+
+            psi_tau = psi(self.mf_tau0 + self.mf_tau1)
+            E_ln_p = _average(psi(self.mf_tau1) - psi_tau)
+            E_ln_notp = _average(psi(self.mf_tau0) - psi_tau)
+            E_v = _average(self.mf_alpha / self.mf_beta)
+            E_ln_v = _average(psi(self.mf_alpha) - np.log(self.mf_beta))
+
+        if not self.allow_self_connections:
+            self_edges = rows == cols
+            E_ln_p = np.where(self_edges, -np.inf, E_ln_p)
+            E_ln_notp = np.where(self_edges, 0.0, E_ln_notp)
+
+        return E_ln_p, E_ln_notp, E_v, E_ln_v
+
+    @cached_by_version
     def expected_p(self):
         """
         Compute the expected probability of a connection, averaging over c
@@ -337,14 +465,9 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         if self.fixed:
             return self.P
 
-        E_p = np.zeros((self.K, self.K))
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                # Get the KxK matrix of joint class assignment probabilities
-                pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                # Get the probability of a connection for this pair of classes
-                E_p += pc1c2 * self.mf_tau1[c1,c2] / (self.mf_tau0[c1,c2] + self.mf_tau1[c1,c2])
+        # Average the probability of a connection for each pair of classes
+        # over the joint class assignment probabilities
+        E_p = self._average_over_c(self.mf_tau1 / (self.mf_tau0 + self.mf_tau1))
 
         if not self.allow_self_connections:
             np.fill_diagonal(E_p, 0.0)
@@ -358,6 +481,7 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         """
         return 1.0 - self.expected_p()
 
+    @cached_by_version
     def expected_log_p(self):
         """
         Compute the expected log probability of a connection, averaging over c
@@ -366,21 +490,15 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         if self.fixed:
             E_ln_p = np.log(self.P)
         else:
-            E_ln_p = np.zeros((self.K, self.K))
-            for c1 in range(self.C):
-                for c2 in range(self.C):
-                    # Get the KxK matrix of joint class assignment probabilities
-                    pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                    # Get the probability of a connection for this pair of classes
-                    E_ln_p += pc1c2 * (psi(self.mf_tau1[c1,c2])
-                                       - psi(self.mf_tau0[c1,c2] + self.mf_tau1[c1,c2]))
+            E_ln_p = self._average_over_c(psi(self.mf_tau1)
+                                          - psi(self.mf_tau0 + self.mf_tau1))
 
         if not self.allow_self_connections:
             np.fill_diagonal(E_ln_p, -np.inf)
 
         return E_ln_p
 
+    @cached_by_version
     def expected_log_notp(self):
         """
         Compute the expected log probability of NO connection, averaging over c
@@ -389,21 +507,15 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         if self.fixed:
             E_ln_notp = np.log(1.0 - self.P)
         else:
-            E_ln_notp = np.zeros((self.K, self.K))
-            for c1 in range(self.C):
-                for c2 in range(self.C):
-                    # Get the KxK matrix of joint class assignment probabilities
-                    pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                    # Get the probability of a connection for this pair of classes
-                    E_ln_notp += pc1c2 * (psi(self.mf_tau0[c1,c2])
-                                          - psi(self.mf_tau0[c1,c2] + self.mf_tau1[c1,c2]))
+            E_ln_notp = self._average_over_c(psi(self.mf_tau0)
+                                             - psi(self.mf_tau0 + self.mf_tau1))
 
         if not self.allow_self_connections:
             np.fill_diagonal(E_ln_notp, 0.0)
 
         return E_ln_notp
 
+    @cached_by_version
     def expected_v(self):
         """
         Compute the expected scale of a connection, averaging over c
@@ -412,16 +524,9 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         if self.fixed:
             return self.V
 
-        E_v = np.zeros((self.K, self.K))
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                # Get the KxK matrix of joint class assignment probabilities
-                pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                # Get the probability of a connection for this pair of classes
-                E_v += pc1c2 * self.mf_alpha[c1,c2] / self.mf_beta[c1,c2]
-        return E_v
+        return self._average_over_c(self.mf_alpha / self.mf_beta)
 
+    @cached_by_version
     def expected_log_v(self):
         """
         Compute the expected log scale of a connection, averaging over c
@@ -430,16 +535,7 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         if self.fixed:
             return np.log(self.V)
 
-        E_log_v = np.zeros((self.K, self.K))
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                # Get the KxK matrix of joint class assignment probabilities
-                pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                # Get the probability of a connection for this pair of classes
-                E_log_v += pc1c2 * (psi(self.mf_alpha[c1,c2])
-                                    - np.log(self.mf_beta[c1,c2]))
-        return E_log_v
+        return self._average_over_c(psi(self.mf_alpha) - np.log(self.mf_beta))
 
     def expected_m(self):
         return self.mf_pi / self.mf_pi.sum()
@@ -455,136 +551,95 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
     def expected_log_likelihood(self,x):
         pass
 
-    def mf_update_c(self, E_A, E_notA, E_W_given_A, E_ln_W_given_A, stepsize=1.0):
+    def mf_update_c(self, E_A, E_W_given_A, stepsize=1.0):
         """
         Update the block assignment probabilitlies one at a time.
         This one involves a number of not-so-friendly expectations.
+
+        The expected log likelihood of a node's connections is linear in
+        the block probabilities of the other nodes, so for each node we
+        sum the expected connections to every other node weighted by mf_m
+        and combine these C-vectors with the CxC expected parameters.
+        Terms that do not depend on the node's block, like the expected
+        log weights, are dropped since they cancel in the normalization.
+        The expected non-connections are the block sizes minus the expected
+        connections, so only the nonzero entries of E_A are visited.
         :return:
         """
+        # Expected parameters of each pair of blocks
+        E_ln_p    = psi(self.mf_tau1) - psi(self.mf_tau0 + self.mf_tau1)
+        E_ln_notp = psi(self.mf_tau0) - psi(self.mf_tau0 + self.mf_tau1)
+        E_v       = self.mf_alpha / self.mf_beta
+        E_ln_v    = psi(self.mf_alpha) - np.log(self.mf_beta)
+        kappa     = self.kappa
+
+        # Rows of E_A are the expected connections out of each node and
+        # rows of E_At the expected connections into it
+        E_A, E_AW = _edge_matrices(E_A, E_W_given_A)
+        E_At, E_AWt = E_A.T.tocsr(), E_AW.T.tocsr()
+        a_self, aw_self = E_A.diagonal(), E_AW.diagonal()
+
+        # Expected number of nodes in each block
+        n = self.mf_m.sum(0)
+
+        def _stats(M, MW, k):
+            # Sum the expected connections of node k to each block, excluding k
+            edges = slice(M.indptr[k], M.indptr[k+1])
+            nodes = M.indices[edges]
+            a = M.data[edges].dot(self.mf_m[nodes]) - a_self[k] * self.mf_m[k]
+            aw = MW.data[edges].dot(self.mf_m[nodes]) - aw_self[k] * self.mf_m[k]
+            return a, n - self.mf_m[k] - a, aw
+
+        def _lp(stats, E_ln_p, E_ln_notp, E_v, E_ln_v):
+            a, nota, aw = stats
+            return E_ln_p.dot(a) + E_ln_notp.dot(nota) \
+                   + kappa * E_ln_v.dot(a) - E_v.dot(aw)
+
         # Sample each assignment in order
         for k in range(self.K):
-            notk = np.concatenate((np.arange(k), np.arange(k+1,self.K)))
+            # Prior from m
+            lp = self.expected_log_m()
 
-            # Compute unnormalized log probs of each connection
-            lp = np.zeros(self.C)
+            # Compute E[ln p(A | c, p)] and E[ln p(W | A=1, c, v)]
+            lp += _lp(_stats(E_A, E_AW, k), E_ln_p, E_ln_notp, E_v, E_ln_v)
+            lp += _lp(_stats(E_At, E_AWt, k), E_ln_p.T, E_ln_notp.T, E_v.T, E_ln_v.T)
 
-            # Prior from m
-            lp += self.expected_log_m()
-
-            # Likelihood from network
-            for ck in range(self.C):
-
-                # Compute expectations with respect to other block assignments, c_{\neg k}
-                # Initialize vectors for expected parameters
-                E_ln_p_ck_to_cnotk    = np.zeros(self.K-1)
-                E_ln_notp_ck_to_cnotk = np.zeros(self.K-1)
-                E_ln_p_cnotk_to_ck    = np.zeros(self.K-1)
-                E_ln_notp_cnotk_to_ck = np.zeros(self.K-1)
-                E_v_ck_to_cnotk       = np.zeros(self.K-1)
-                E_ln_v_ck_to_cnotk    = np.zeros(self.K-1)
-                E_v_cnotk_to_ck       = np.zeros(self.K-1)
-                E_ln_v_cnotk_to_ck    = np.zeros(self.K-1)
-
-                for cnotk in range(self.C):
-                    # Get the (K-1)-vector of other class assignment probabilities
-                    p_cnotk = self.mf_m[notk,cnotk]
-
-                    # Expected log probability of a connection from ck to cnotk
-                    E_ln_p_ck_to_cnotk    += p_cnotk * (psi(self.mf_tau1[ck, cnotk])
-                                                        - psi(self.mf_tau0[ck, cnotk] + self.mf_tau1[ck, cnotk]))
-                    E_ln_notp_ck_to_cnotk += p_cnotk * (psi(self.mf_tau0[ck, cnotk])
-                                                        - psi(self.mf_tau0[ck, cnotk] + self.mf_tau1[ck, cnotk]))
-
-                    # Expected log probability of a connection from cnotk to ck
-                    E_ln_p_cnotk_to_ck    += p_cnotk * (psi(self.mf_tau1[cnotk, ck])
-                                                        - psi(self.mf_tau0[cnotk, ck] + self.mf_tau1[cnotk, ck]))
-                    E_ln_notp_cnotk_to_ck += p_cnotk * (psi(self.mf_tau0[cnotk, ck])
-                                                        - psi(self.mf_tau0[cnotk, ck] + self.mf_tau1[cnotk, ck]))
-
-                    # Expected log scale of connections from ck to cnotk
-                    E_v_ck_to_cnotk       += p_cnotk * (self.mf_alpha[ck, cnotk] / self.mf_beta[ck, cnotk])
-                    E_ln_v_ck_to_cnotk    += p_cnotk * (psi(self.mf_alpha[ck, cnotk])
-                                                        - np.log(self.mf_beta[ck, cnotk]))
-
-                    # Expected log scale of connections from cnotk to ck
-                    E_v_cnotk_to_ck       += p_cnotk * (self.mf_alpha[cnotk, ck] / self.mf_beta[cnotk, ck])
-                    E_ln_v_cnotk_to_ck    += p_cnotk * (psi(self.mf_alpha[cnotk, ck])
-                                                        - np.log(self.mf_beta[cnotk, ck]))
-
-                # Compute E[ln p(A | c, p)]
-                lp[ck] += Bernoulli().negentropy(E_x=E_A[k, notk],
-                                                 E_notx=E_notA[k, notk],
-                                                 E_ln_p=E_ln_p_ck_to_cnotk,
-                                                 E_ln_notp=E_ln_notp_ck_to_cnotk).sum()
-
-                lp[ck] += Bernoulli().negentropy(E_x=E_A[notk, k],
-                                                 E_notx=E_notA[notk, k],
-                                                 E_ln_p=E_ln_p_cnotk_to_ck,
-                                                 E_ln_notp=E_ln_notp_cnotk_to_ck).sum()
-
-                # Compute E[ln p(W | A=1, c, v)]
-                lp[ck] += (E_A[k, notk] *
-                           Gamma(self.kappa).negentropy(E_ln_lambda=E_ln_W_given_A[k, notk],
-                                                        E_lambda=E_W_given_A[k,notk],
-                                                        E_beta=E_v_ck_to_cnotk,
-                                                        E_ln_beta=E_ln_v_ck_to_cnotk)).sum()
-
-                lp[ck] += (E_A[notk, k] *
-                           Gamma(self.kappa).negentropy(E_ln_lambda=E_ln_W_given_A[notk, k],
-                                                        E_lambda=E_W_given_A[notk,k],
-                                                        E_beta=E_v_cnotk_to_ck,
-                                                        E_ln_beta=E_ln_v_cnotk_to_ck)).sum()
-
-                # Compute expected log prob of self connection
-                if self.allow_self_connections:
-                    E_ln_p_ck_to_ck    = psi(self.mf_tau1[ck, ck]) - psi(self.mf_tau0[ck, ck] + self.mf_tau1[ck, ck])
-                    E_ln_notp_ck_to_ck = psi(self.mf_tau0[ck, ck]) - psi(self.mf_tau0[ck, ck] + self.mf_tau1[ck, ck])
-                    lp[ck] += Bernoulli().negentropy(E_x=E_A[k, k],
-                                                     E_notx=E_notA[k, k],
-                                                     E_ln_p=E_ln_p_ck_to_ck,
-                                                     E_ln_notp=E_ln_notp_ck_to_ck
-                                                    )
-                    E_v_ck_to_ck    = self.mf_alpha[ck, ck] / self.mf_beta[ck, ck]
-                    E_ln_v_ck_to_ck = psi(self.mf_alpha[ck, ck]) - np.log(self.mf_beta[ck, ck])
-                    lp[ck] += (E_A[k, k] *
-                               Gamma(self.kappa).negentropy(E_ln_lambda=E_ln_W_given_A[k, k],
-                                                            E_lambda=E_W_given_A[k,k],
-                                                            E_beta=E_v_ck_to_ck,
-                                                            E_ln_beta=E_ln_v_ck_to_ck))
-
-
-                # TODO: Get probability of impulse responses g
+            # Compute expected log prob of self connection
+            if self.allow_self_connections:
+                lp += a_self[k] * np.diag(E_ln_p) + (1.0 - a_self[k]) * np.diag(E_ln_notp)
+                lp += a_self[k] * kappa * np.diag(E_ln_v) - np.diag(E_v) * aw_self[k]
 
+            # TODO: Get probability of impulse responses g
 
             # Normalize the log probabilities to update mf_m
             Z = logsumexp(lp)
             mk_hat = np.exp(lp - Z)
 
-            self.mf_m[k,:] = (1.0 - stepsize) * self.mf_m[k,:] + stepsize * mk_hat
+            mk = (1.0 - stepsize) * self.mf_m[k,:] + stepsize * mk_hat
+            n += mk - self.mf_m[k,:]
+            self.mf_m[k,:] = mk
+            self.touch()
 
 
-    def mf_update_p(self, E_A, E_notA, stepsize=1.0):
+    def mf_update_p(self, E_A, stepsize=1.0):
         """
         Mean field update for the CxC matrix of block connection probabilities
         :param E_A:
         :return:
         """
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                # Get the KxK matrix of joint class assignment probabilities
-                pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-
-                if self.allow_self_connections:
-                    tau1_hat = self.tau1 + (pc1c2 * E_A).sum()
-                    tau0_hat = self.tau0 + (pc1c2 * E_notA).sum()
-                else:
-                    # TODO: Account for self connections
-                    tau1_hat = self.tau1 + (pc1c2 * E_A).sum()
-                    tau0_hat = self.tau0 + (pc1c2 * E_notA).sum()
-
-                self.mf_tau1[c1,c2] = (1.0 - stepsize) * self.mf_tau1[c1,c2] + stepsize * tau1_hat
-                self.mf_tau0[c1,c2] = (1.0 - stepsize) * self.mf_tau0[c1,c2] + stepsize * tau0_hat
+        # Sum the expected connections between each pair of blocks,
+        # weighted by the joint class assignment probabilities. The
+        # expected non-connections are all pairs minus the connections.
+        # TODO: Account for self connections
+        M = self.mf_m
+        n = M.sum(0)
+        E_A = scipy.sparse.csr_matrix(E_A, dtype=np.float64)
+        n_edges = M.T.dot(E_A.dot(M))
+        tau1_hat = self.tau1 + n_edges
+        tau0_hat = self.tau0 + np.outer(n, n) - n_edges
+
+        self.mf_tau1 = (1.0 - stepsize) * self.mf_tau1 + stepsize * tau1_hat
+        self.mf_tau0 = (1.0 - stepsize) * self.mf_tau0 + stepsize * tau0_hat
 
     def mf_update_v(self, E_A, E_W_given_A, stepsize=1.0):
         """
@@ -593,15 +648,12 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         :param E_W_given_A: Expected W given A
         :return:
         """
-        for c1 in range(self.C):
-            for c2 in range(self.C):
-                # Get the KxK matrix of joint class assignment probabilities
-                pc1c2 = self.mf_m[:,c1][:, None] * self.mf_m[:,c2][None, :]
-
-                alpha_hat = self.alpha + (pc1c2 * E_A * self.kappa).sum()
-                beta_hat  = self.beta + (pc1c2 * E_A * E_W_given_A).sum()
-                self.mf_alpha[c1,c2] = (1.0 - stepsize) * self.mf_alpha[c1,c2] + stepsize * alpha_hat
-                self.mf_beta[c1,c2]  = (1.0 - stepsize) * self.mf_beta[c1,c2] + stepsize * beta_hat
+        M = self.mf_m
+        E_A, E_AW = _edge_matrices(E_A, E_W_given_A)
+        alpha_hat = self.alpha + self.kappa * M.T.dot(E_A.dot(M))
+        beta_hat  = self.beta + M.T.dot(E_AW.dot(M))
+        self.mf_alpha = (1.0 - stepsize) * self.mf_alpha + stepsize * alpha_hat
+        self.mf_beta  = (1.0 - stepsize) * self.mf_beta + stepsize * beta_hat
 
     def mf_update_m(self, stepsize=1.0):
         """
@@ -616,15 +668,13 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
                         update_v=True,
                         update_m=True,
                         update_c=True):
-        # Get expectations from the weight model
-        E_A = weight_model.expected_A()
-        E_notA = 1.0 - E_A
-        E_W_given_A = weight_model.expected_W_given_A(1.0)
-        E_ln_W_given_A = weight_model.expected_log_W_given_A(1.0)
+        # Get expectations on the edges of the weight model
+        E_A = weight_model.expected_A_sparse()
+        E_W_given_A = weight_model.expected_W_given_A_sparse(1.0)
 
         # Update the remaining SBM parameters
         if update_c:
-            self.mf_update_p(E_A=E_A, E_notA=E_notA)
+            self.mf_update_p(E_A=E_A)
 
         if update_v:
             self.mf_update_v(E_A=E_A, E_W_given_A=E_W_given_A)
@@ -634,25 +684,20 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
 
         # Update the block assignments
         if update_c:
-            self.mf_update_c(E_A=E_A,
-                             E_notA=E_notA,
-                             E_W_given_A=E_W_given_A,
-                             E_ln_W_given_A=E_ln_W_given_A)
+            self.mf_update_c(E_A=E_A, E_W_given_A=E_W_given_A)
 
     def meanfield_sgdstep(self,weight_model, minibatchfrac, stepsize,
                           update_p=True,
                           update_v=True,
                           update_m=True,
                           update_c=True):
-        # Get expectations from the weight model
-        E_A = weight_model.expected_A()
-        E_notA = 1.0 - E_A
-        E_W_given_A = weight_model.expected_W_given_A(1.0)
-        E_ln_W_given_A = weight_model.expected_log_W_given_A(1.0)
+        # Get expectations on the edges of the weight model
+        E_A = weight_model.expected_A_sparse()
+        E_W_given_A = weight_model.expected_W_given_A_sparse(1.0)
 
         # Update the remaining SBM parameters
         if update_p:
-            self.mf_update_p(E_A=E_A, E_notA=E_notA, stepsize=stepsize)
+            self.mf_update_p(E_A=E_A, stepsize=stepsize)
 
         if update_v:
             self.mf_update_v(E_A=E_A, E_W_given_A=E_W_given_A, stepsize=stepsize)
@@ -662,11 +707,7 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
 
         # Update the block assignments
         if update_c:
-            self.mf_update_c(E_A=E_A,
-                             E_notA=E_notA,
-                             E_W_given_A=E_W_given_A,
-                             E_ln_W_given_A=E_ln_W_given_A,
-                             stepsize=stepsize)
+            self.mf_update_c(E_A=E_A, E_W_given_A=E_W_given_A, stepsize=stepsize)
 
     def get_vlb(self,
                 vlb_c=True,
@@ -728,6 +769,7 @@ class MeanFieldSBM(_StochasticBlockModelBase, MeanField, MeanFieldSVI):
         self.c = np.zeros(self.K, dtype=np.int)
         for k in range(self.K):
             self.c[k] = int(np.random.choice(self.C, p=self.mf_m[k,:]))
+        self.touch()
 
 class StochasticBlockModel(GibbsSBM, MeanFieldSBM):
     pass
@@ -821,6 +863,16 @@ class StochasticBlockModelFixedSparsity(StochasticBlockModel):
             np.fill_diagonal(E_ln_notp, np.inf)
         return E_ln_notp
 
+    def expected_on_edges(self, rows, cols):
+        """
+        The probability of connection is fixed given c, so only the
+        scales are averaged over the block assignments
+        """
+        _, _, E_v, E_ln_v = super(StochasticBlockModelFixedSparsity, self).\
+            expected_on_edges(rows, cols)
+        p = self.prior_on_edges(rows, cols)[0]
+        return np.log(p), np.log(1.0 - p), E_v, E_ln_v
+
     def meanfieldupdate(self, weight_model,
                         update_p=False,
                         update_v=True,
@@ -870,6 +922,7 @@ class StochasticBlockModelFixedSparsity(StochasticBlockModel):
         self.c = np.zeros(self.K, dtype=np.int)
         for k in range(self.K):
             self.c[k] = int(np.random.choice(self.C, p=self.mf_m[k,:]))
+        self.touch()
 
 
 
@@ -882,17 +935,20 @@ class ErdosRenyiModel(StochasticBlockModel):
                  v=None, alpha=1.0, beta=1.0,
                  kappa=1.0):
         C = 1
-        c = np.zeros(K, dtype=np.int)
+        c = np.zeros(K, dtype=int)
         super(ErdosRenyiModel, self).__init__(K, C, c=c,
                                               p=p, tau0=tau0, tau1=tau1,
                                               v=v, alpha=alpha, beta=beta,
                                               kappa=kappa)
 
 
-class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
+class ErdosRenyiFixedSparsity(VersionedParameters, GibbsSampling, MeanField):
     """
     An ErdosRenyi model with fixed parameters
     """
+    _versioned_params = ("p", "v", "kappa", "allow_self_connections",
+                         "mf_alpha", "mf_beta")
+
     def __init__(self, K, p, kappa=1.0, alpha=None, beta=None, v=None, allow_self_connections=True):
         self.K = K
         self.p = p
@@ -927,6 +983,7 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
             self.mf_beta = self.beta
 
     @property
+    @cached_by_version
     def P(self):
         """
         Get the KxK matrix of probabilities
@@ -938,6 +995,7 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
         return P
 
     @property
+    @cached_by_version
     def V(self):
         """
         Get the KxK matrix of scales
@@ -949,6 +1007,17 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
     def Kappa(self):
         return self.kappa * np.ones((self.K, self.K))
 
+    def prior_on_edges(self, rows, cols):
+        """
+        Get the probability of connection and the shape and scale of
+        the weights of the edges from rows to cols
+        :return: p, kappa, v as vectors over the edges
+        """
+        p = self.p * np.ones(len(rows))
+        if not self.allow_self_connections:
+            p[rows == cols] = 0.0
+        return p, self.kappa * np.ones(len(rows)), self.v * np.ones(len(rows))
+
     def log_likelihood(self, x):
         """
         Compute the log likelihood of a set of SBM parameters
@@ -971,8 +1040,9 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
         """
         Resample v given observations of the weights
         """
+        A, AW = _edge_matrices(A, W)
         alpha = self.alpha + A.sum() * self.kappa
-        beta  = self.beta + W[A > 0].sum()
+        beta  = self.beta + AW.sum()
         self.v = np.random.gamma(alpha, 1.0/beta)
 
     def resample(self, data=[]):
@@ -987,9 +1057,11 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
     def expected_notp(self):
         return 1.0 - self.expected_p()
 
+    @cached_by_version
     def expected_log_p(self):
         return np.log(self.P)
 
+    @cached_by_version
     def expected_log_notp(self):
          return np.log(1.0 - self.P)
 
@@ -1000,6 +1072,17 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
     def expected_log_v(self):
         return psi(self.mf_alpha) - np.log(self.mf_beta)
 
+    def expected_on_edges(self, rows, cols):
+        """
+        Get E[ln p], E[ln (1-p)], E[v] and E[ln v] on the edges from rows to cols
+        :return: vectors over the edges
+        """
+        p = self.prior_on_edges(rows, cols)[0]
+        ones = np.ones(len(rows))
+        E_v = self.mf_alpha / self.mf_beta
+        E_ln_v = psi(self.mf_alpha) - np.log(self.mf_beta)
+        return np.log(p), np.log(1.0 - p), E_v * ones, E_ln_v * ones
+
     def expected_log_likelihood(self,x):
         pass
 
@@ -1010,14 +1093,15 @@ class ErdosRenyiFixedSparsity(GibbsSampling, MeanField):
         :param E_W_given_A: Expected W given A
         :return:
         """
-        alpha_hat = self.alpha + (E_A * self.kappa).sum()
-        beta_hat  = self.beta + (E_A * E_W_given_A).sum()
+        E_A, E_AW = _edge_matrices(E_A, E_W_given_A)
+        alpha_hat = self.alpha + E_A.sum() * self.kappa
+        beta_hat  = self.beta + E_AW.sum()
         self.mf_alpha = (1.0 - stepsize) * self.mf_alpha + stepsize * alpha_hat
         self.mf_beta  = (1.0 - stepsize) * self.mf_beta + stepsize * beta_hat
 
     def meanfieldupdate(self, weight_model, stepsize=1.0):
-        E_A = weight_model.expected_A()
-        E_W_given_A = weight_model.expected_W_given_A(1.0)
+        E_A = weight_model.expected_A_sparse()
+        E_W_given_A = weight_model.expected_W_given_A_sparse(1.0)
         self.mf_update_v(E_A=E_A, E_W_given_A=E_W_given_A, stepsize=stepsize)
 
     def meanfield_sgdstep(self,weight_model, minibatchfrac, stepsize):
@@ -1064,7 +1148,13 @@ class LatentDistanceAdjacencyModel(ErdosRenyiModel):
     def L(self):
         return self.A_dist.L
 
+    def prior_on_edges(self, rows, cols):
+        p, kappa, v = super(LatentDistanceAdjacencyModel, self).prior_on_edges(rows, cols)
+        return self.P[rows, cols], kappa, v
+
     def resample(self, data=[]):
         A,W = data
         self.resample_v(A, W)
+        if scipy.sparse.issparse(A):
+            A = A.toarray()
         self.A_dist.resample(A)
\ No newline at end of file
@@ -80,6 +80,45 @@ def _resample_column_of_A(k2):
 
     return A_col
 
+def _resample_candidates_of_column(k2, p):
+    """
+    Resample the entries of A[:,k2] on the candidate edges of a
+    sparse weight model, given their prior probabilities p. Only
+    the candidate senders can contribute to the rate of process k2,
+    so the likelihood only needs their filtered data.
+    """
+    weight_model = model.weight_model
+    start, stop = weight_model.indptr[k2], weight_model.indptr[k2+1]
+    k1s = weight_model.rows[start:stop]
+    A_col = weight_model.A_edges[start:stop].copy()
+    W_col = weight_model.W_edges[start:stop]
+    lambda0 = model.lambda0[k2]
+    g = model.impulse_model.g[k1s, k2, :]
+
+    # The weighted impulse responses of the candidates at the events on k2
+    FGs = [(d.Fs[k2][:, k1s, :] * g).sum(axis=2) for d in data]
+
+    def _log_likelihood(A_col):
+        ll = 0
+        for d, FG in zip(data, FGs):
+            ll += -lambda0 * d.T * model.dt
+            ll += -(A_col * W_col * d.Ns[k1s]).sum()
+            ll += (d.Ss[k2] * np.log(lambda0 + FG.dot(A_col * W_col))).sum()
+        return ll
+
+    for e in range(stop - start):
+        if p[e] == 0 or p[e] == 1:
+            A_col[e] = p[e]
+            continue
+
+        A_col[e] = 0
+        lp0 = _log_likelihood(A_col) + np.log(1.0 - p[e])
+        A_col[e] = 1
+        lp1 = _log_likelihood(A_col) + np.log(p[e])
+        A_col[e] = np.log(np.random.rand()) < lp1 - logsumexp([lp0, lp1])
+
+    return A_col
+
 
 ### Now do the same thing for continuous time
 def _compute_weighted_impulses_at_events(data):
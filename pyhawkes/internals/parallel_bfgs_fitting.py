@@ -0,0 +1,38 @@
+"""
+Helpers to facilitate joblib Parallel fitting of the
+ per-process problems of the standard Hawkes models.
+ The model (or node) of each problem is passed to its
+ task explicitly, so this works with any start method
+ and backend. The standard model only sends the event
+ rows of F of the process being fit. Arrays larger than
+ max_nbytes, like the filtered data of the nonlinear
+ nodes, are dumped once and memory mapped by the workers
+ instead of being copied into every task. Only the
+ fitted weights are sent back.
+"""
+from joblib import Parallel, delayed
+
+def _fit_standard_process(model, k, verbose=False, **kwargs):
+    """
+    Fit the weights of the k-th process of a
+    DiscreteTimeStandardHawkesModel, or of the copy made by
+    its _copy_for_process(k).
+    """
+    return model._fit_process_with_bfgs(k, verbose=verbose, **kwargs)
+
+def _fit_nonlinear_node(node, method="bfgs", **kwargs):
+    """
+    Fit the weights of a node of a _NonlinearHawkesProcessBase
+    with node.fit_with_<method>.
+    """
+    getattr(node, "fit_with_" + method)(**kwargs)
+    return node.w
+
+def fit_in_parallel(fn, args, n_jobs, max_nbytes="1M", **kwargs):
+    """
+    Call fn(*a, **kwargs) for each tuple a in args in a pool of
+    n_jobs worker processes. The memory maps are copy-on-write,
+    so the workers may still update their copies of the data.
+    """
+    return Parallel(n_jobs=n_jobs, max_nbytes=max_nbytes, mmap_mode="c")(
+        delayed(fn)(*a, **kwargs) for a in args)
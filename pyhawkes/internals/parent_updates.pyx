@@ -11,73 +11,139 @@ cimport numpy as np
 
 from libc.math cimport log
 
-from cython.parallel import prange
+# The variational parents and the filtered data are stored in either single
+# or double precision. The sums below are always accumulated in doubles.
+from cython cimport floating
 
-cpdef mf_update_Z(int k2,
-                  double[:,::1] EZ,
-                  long[::1] Sk,
-                  double[::1] exp_E_log_lambda0,
-                  double[:,::1] exp_E_log_W,
-                  double[:,:,::1] exp_E_log_g,
-                  double[:,:,::1] F):
+# The event counts keep the compact type they are stored in
+from libc.stdint cimport uint8_t, uint16_t, uint32_t
 
-    cdef int t, k1, b, i
+ctypedef fused count_t:
+    uint8_t
+    uint16_t
+    uint32_t
 
-    cdef int T, K, B
-    T = EZ.shape[0]
-    K = exp_E_log_lambda0.shape[0]
-    B = exp_E_log_g.shape[2]
+from cython.parallel import prange
 
-    cdef double Z
+cdef inline double _mf_update_event(int t,
+                                    floating[:,::1] EZ,
+                                    count_t[::1] S,
+                                    long[::1] ks,
+                                    const double[::1] exp_E_log_lambda0,
+                                    long[::1] indptr,
+                                    long[::1] rows,
+                                    const double[:,::1] exp_E_log_Wg,
+                                    floating[:,:,::1] F) nogil:
+    """
+    Update the expected parents of event t and return S[t] * log(Z)
+    """
+    cdef int e, k1, b
+    cdef int k2 = ks[t]
+    cdef int K = F.shape[1]
+    cdef int B = F.shape[2]
+    cdef long start = indptr[k2]
+    cdef long stop = indptr[k2+1]
+    cdef double Z, p, scale
+
+    # Senders without an edge into k2 cannot be parents
+    if stop - start < K:
+        for k1 in range(K*B):
+            EZ[t,1+k1] = 0
+
+    # Compute the rate from the background and from each
+    # basis function of each edge into k2, and their sum Z
+    Z = exp_E_log_lambda0[k2]
+    for e in range(start, stop):
+        k1 = rows[e]
+        for b in range(B):
+            p = exp_E_log_Wg[e, b] * F[t, k1, b]
+            EZ[t, 1+k1*B+b] = p
+            Z = Z + p
+
+    # Now normalize to get the expected counts
+    scale = S[t] / Z
+    EZ[t,0] = exp_E_log_lambda0[k2] * scale
+    for e in range(start, stop):
+        k1 = rows[e]
+        for b in range(B):
+            EZ[t,1+k1*B+b] = EZ[t,1+k1*B+b] * scale
+
+    return S[t] * log(Z)
+
+
+cpdef mf_update_Z(floating[:,::1] EZ,
+                  count_t[::1] S,
+                  long[::1] ks,
+                  const double[::1] exp_E_log_lambda0,
+                  long[::1] indptr,
+                  long[::1] rows,
+                  const double[:,::1] exp_E_log_Wg,
+                  floating[:,:,::1] F,
+                  bint compute_vlb=False,
+                  int num_threads=0):
+    """
+    Update the expected parents of the events of all processes at once.
+    Row t of EZ and F corresponds to S[t] events on process ks[t]. The
+    edges of the weight model are sorted by receiver, so the edges into
+    k2 are indptr[k2]:indptr[k2+1], rows holds their senders and
+    exp_E_log_Wg[e,b] = exp(E[log W[k1,k2]] + E[log g[k1,k2,b]]) is
+    precomputed for each edge e = (k1,k2). The unnormalized
+    probabilities are written straight into EZ, so no temporaries are
+    needed.
+
+    If compute_vlb is True, also return the per-event part of the parents'
+    VLB under the updated EZ. Since log(EZ[t,i] / S[t]) = E[log p_i] - log Z,
+    every term but S[t] * log(Z) cancels, so this costs one log per event.
+
+    The events are split over num_threads OpenMP threads, or the OpenMP
+    default if num_threads is 0. Callers running on a thread pool should
+    pass 1, so that the pool and the OpenMP teams do not oversubscribe
+    the cores.
+    """
+    cdef int t
+    cdef int T = EZ.shape[0]
+    cdef double vlb = 0, vlb_t
 
     with nogil:
-        # Iterate over each event count, t and k2, in parallel
-        for t in prange(T):
-            # Zero out the Z buffer
-            Z = 0.0
-
-            # TODO: We should have removed the zeros during preprocessing
-            if Sk[t] == 0:
-                continue
-
-            # First compute the normalizer of the multinomial probability vector
-            # TODO: Check that we are not reusing p
-            # Compute the background rate
-            Z = Z + exp_E_log_lambda0[k2]
-
-            # Compute the rate from each other proc and basis function
-            for k1 in range(K):
-                for b in range(B):
-                    Z = Z + exp_E_log_W[k1, k2] * exp_E_log_g[k1,k2,b] * F[t, k1, b]
-
-
-            # Now compute the expected counts
-            EZ[t,0] = exp_E_log_lambda0[k2] / Z * Sk[t]
-
-            # TODO: Should we try to avoid recomputing the multiplications?
-            for k1 in range(K):
-                for b in range(B):
-                    EZ[t,1+k1*B+b] = exp_E_log_W[k1, k2] * exp_E_log_g[k1, k2, b] * F[t, k1, b] / Z * Sk[t]
-
+        # Iterate over the events of every process in parallel
+        if num_threads > 0:
+            for t in prange(T, schedule="static", num_threads=num_threads):
+                vlb_t = _mf_update_event(t, EZ, S, ks, exp_E_log_lambda0,
+                                         indptr, rows, exp_E_log_Wg, F)
+                if compute_vlb:
+                    vlb += vlb_t
+        else:
+            for t in prange(T, schedule="static"):
+                vlb_t = _mf_update_event(t, EZ, S, ks, exp_E_log_lambda0,
+                                         indptr, rows, exp_E_log_Wg, F)
+                if compute_vlb:
+                    vlb += vlb_t
+
+    return vlb
 
 
 cpdef mf_vlb(int k2,
              int T_total,
-             double[:,::1] EZ,
-             unsigned int[::1] Sk,
+             floating[:,::1] EZ,
+             count_t[::1] Sk,
              long[::1] Ns,
-             double[::1] E_log_lambda0,
-             double[::1] E_lambda0,
-             double[:,::1] E_log_W,
-             double[:,::1] E_W,
-             double[:,:,::1] E_log_g,
-             double[:,:,::1] F):
-
-    cdef int t, k1, b, i
-
-    cdef int T, K, B
+             const double[::1] E_log_lambda0,
+             const double[::1] E_lambda0,
+             long[::1] rows,
+             const double[::1] E_log_W,
+             const double[::1] E_W,
+             const double[:,:,::1] E_log_g,
+             floating[:,:,::1] F):
+    """
+    Compute the VLB of the parents of the events on process k2. rows
+    holds the senders of the edges into k2, and E_log_W and E_W the
+    expected (log) weights of those edges.
+    """
+    cdef int t, e, k1, b, i
+
+    cdef int T, E, B
     T = EZ.shape[0]
-    K = E_log_lambda0.shape[0]
+    E = rows.shape[0]
     B = E_log_g.shape[2]
     cdef double vlb = 0
 
@@ -85,8 +151,8 @@ cpdef mf_vlb(int k2,
     # vlb += (-self.T * E_lam[k2]).sum()
     # vlb += -(self.Ns * E_W[:,k2]).sum()
     vlb += -T_total * E_lambda0[k2]
-    for k1 in range(K):
-        vlb += -Ns[k1] * E_W[k1,k2]
+    for e in range(E):
+        vlb += -Ns[rows[e]] * E_W[e]
 
     # Iterate over each event count, t, in parallel
     cdef double[::1] vlbs = np.zeros(T)
@@ -99,15 +165,20 @@ cpdef mf_vlb(int k2,
             # vlb += (-EZk[:,0] * ln_u0).sum()
             vlbs[t] += -EZ[t,0] * log(EZ[t,0] / Sk[t] + 1e-32)
 
-            # Impulse terms
-            for k1 in range(K):
+            # Impulse terms of the edges into k2. Parents with zero
+            # probability, e.g. those with E[ln W] = -inf, do not contribute.
+            for e in range(E):
+                k1 = rows[e]
                 for b in range(B):
+                    if EZ[t,1+k1*B+b] == 0:
+                        continue
+
                     # E_ln_Wg = (log(Fk) +
                     #            weight_model.expected_log_W()[:,k][None,:,None] +
                     #            impulse_model.expected_log_g()[:,k,:][None,:,:])
                     # E_ln_Wg = np.nan_to_num(E_ln_Wg)
                     # vlb += (EZk[:,1:] * E_ln_Wg.reshape((Tk, K*B))).sum()
-                    vlbs[t] += EZ[t,1+k1*B+b] * (log(F[t,k1,b]+1e-32) + E_log_W[k1,k2] + E_log_g[k1,k2,b])
+                    vlbs[t] += EZ[t,1+k1*B+b] * (log(F[t,k1,b]+1e-32) + E_log_W[e] + E_log_g[k1,k2,b])
 
                     # Second term
                     # ln_u = log(EZk[:,1:] / Sk[:,None].astype(np.float))
@@ -117,4 +188,4 @@ cpdef mf_vlb(int k2,
 
     # Now sum up the vlbs serially
     vlb += np.sum(vlbs)
-    return vlb
\ No newline at end of file
+    return vlb
@@ -1,16 +1,53 @@
 import os
+import copy
 import numpy as np
 from warnings import warn
 
 from pybasicbayes.abstractions import GibbsSampling, MeanField
 from pyhawkes.internals.parent_updates import mf_update_Z, mf_vlb
 from pyhawkes.internals.continuous_time_helpers import ct_resample_Z_logistic_normal, ct_compute_suff_stats
+from pyhawkes.utils.utils import event_counts
+from pyhawkes.utils.parallel import in_pool_thread
+
+
+def _sample_multinomial_rows(rng, S, P, out):
+    """
+    Sample out[t] ~ Mult(S[t], P[t] / P[t].sum()) for every row t at
+    once, by inverting the cumulative distribution of row t at S[t]
+    uniform draws. The normalized distribution of row t is shifted by
+    t, so that one binary search over all the rows finds the parents
+    of all the draws, with memory linear in the number of draws.
+    """
+    n, D = P.shape
+    cdf = np.cumsum(P, axis=1, dtype=np.float64)
+    cdf /= cdf[:,-1:]
+    cdf += np.arange(n)[:,None]
+    rows = np.repeat(np.arange(n), S)
+    u = rows + rng.rand(len(rows))
+    parents = np.searchsorted(cdf.ravel(), u, side="right") - rows * D
+
+    # In case u rounds up to the next row, take the last possible parent
+    last = D - 1 - np.argmax(P[:,::-1] > 0, axis=1)
+    parents = np.minimum(parents, last[rows])
+
+    out[:] = np.bincount(rows * D + parents, minlength=n*D).reshape((n, D))
+
 
 class DiscreteTimeParents(GibbsSampling, MeanField):
     """
     Encapsulates the TxKxKxB array of parent multinomial distributed
     parent variables.
+
+    Given the global parameters, the parents of different events are
+    independent. The updates split the events into shards of about
+    SHARD_BYTES of filtered data and parents each, so that the work on
+    a shard stays in the cache of one core, and spread the shards over
+    the threads of the model's data pool. Since the filtered data F is
+    computed once for the whole data set, the events at the start of a
+    shard still see the impulse responses of the events in the previous
+    shard, and no overlap between the shards is needed.
     """
+    SHARD_BYTES = 2**20
     def __init__(self, model, T, S, F):
         """
         Initialize a parent array Z of size TxKxKxB to model the
@@ -23,42 +60,20 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         :param T: Number of time bins
         :param K: Number of processes
         :param B: Number of basis functions
-        :param S: Data matrix (TxK)
+        :param S: Data matrix (TxK), dense or scipy.sparse
         :param F: Filtered data matrix (TxKxB)
         """
         self.model = model
         self.dt = model.dt
         self.K = model.K
         self.B = model.B
+        self.dtype = model.dtype
 
         # TODO: Remove dependencies on S and F
         self.T = T
         self.S = S
         self.F = F
 
-        # Save sparse versions of S and F
-        self.ts = []
-        self.Ts = []
-        self.Ns = []
-        self.Ss = []
-        self.Fs = []
-        for k in range(self.K):
-            # Find the rows where S[:,k] is nonzero
-                tk = np.where(S[:,k])[0]
-                self.ts.append(tk)
-                self.Ts.append(len(tk))
-                self.Ss.append(S[tk,k].astype(np.uint32))
-                self.Ns.append(S[tk,k].sum())
-                self.Fs.append(F[tk])
-        self.Ns = np.array(self.Ns)
-
-
-        # The base class handles the parent variables
-        # We use a sparse representation that only considers times (rows)
-        # where there is a spike
-        self._Z = None
-        self._EZ = None
-
         # Initialize GSL RNGs for resampling Z
         try:
             from gslrandom import PyRNG, get_omp_num_threads
@@ -79,25 +94,161 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
                  "To install gslrandom, see https://github.com/slinderman/gslrandom")
             self.USE_GSL = False
 
+        # Save sparse versions of S and F
+        _, t, k, counts = event_counts(S)
+        self._set_events(t, k, counts, F[t])
+
+        # The base class handles the parent variables
+        # We use a sparse representation that only considers times (rows)
+        # where there is a spike
+        self._Z = None
+        self._Z_events = None
+        self._EZ = None
+        self._EZ_events = None
+        self._shard_rngs = []
+
+        # Minibatches of this data set for SVI
+        self._minibatches = None
+
+    def _set_events(self, t, k, counts, F_events):
+        """
+        Save the events, which must be sorted by process and then by
+        time bin, so each process gets a contiguous slice of them. The
+        events of all processes are packed into one set of arrays and
+        the per-process arrays are views of those slices. Compact counts,
+        e.g. uint16, keep their type, and so do the sampled parents.
+        """
+        self.offsets = np.searchsorted(k, np.arange(self.K+1))
+        self.t_events = t
+        self.k_events = np.ascontiguousarray(k, dtype=np.int64)
+        counts = np.asarray(counts)
+        if counts.dtype not in (np.uint8, np.uint16, np.uint32):
+            counts = counts.astype(np.uint32)
+        self.S_events = np.ascontiguousarray(counts)
+        self.F_events = F_events
+
+        # The GSL sampler only takes uint32 counts, so cast compact counts once
+        if self.USE_GSL and self.S_events.dtype != np.uint32:
+            self._S_events_gsl = self.S_events.astype(np.uint32)
+        else:
+            self._S_events_gsl = self.S_events
+
+        self.ts = []
+        self.Ts = []
+        self.Ns = []
+        self.Ss = []
+        self.Fs = []
+        for k, (start, end) in enumerate(zip(self.offsets[:-1], self.offsets[1:])):
+            self.ts.append(self.t_events[start:end])
+            self.Ts.append(end - start)
+            self.Ss.append(self.S_events[start:end])
+            self.Ns.append(self.S_events[start:end].sum())
+            self.Fs.append(self.F_events[start:end])
+        self.Ns = np.array(self.Ns, dtype=np.int64)
+
+    def minibatches(self, minibatchsize):
+        """
+        Split the data set into minibatches of minibatchsize consecutive
+        time bins for stochastic variational inference.
+
+        The events are reordered by minibatch once. Each minibatch gets a
+        parent object whose packed arrays are views of a contiguous block
+        of the reordered events. All minibatches share one EZ buffer, so
+        only one of them may be used at a time. The minibatches are cached,
+        so repeated calls with the same size copy no data.
+
+        :return: a list of DiscreteTimeParents, one per minibatch
+        """
+        if self._minibatches is not None and self._minibatches[0] == minibatchsize:
+            return self._minibatches[1]
+
+        # Sort the events by minibatch. The sort is stable, so the events in
+        # each minibatch are still sorted by process and then by time bin.
+        mbs = self.t_events // minibatchsize
+        perm = np.argsort(mbs, kind="mergesort")
+        mbs = mbs[perm]
+        t = self.t_events[perm] - mbs * minibatchsize
+        k = self.k_events[perm]
+        counts = self.S_events[perm]
+        F_events = self.F_events[perm]
+
+        n_mbs = int(np.ceil(self.T / float(minibatchsize)))
+        bounds = np.searchsorted(mbs, np.arange(n_mbs+1))
+        EZ_events = np.zeros((np.diff(bounds).max() if n_mbs > 0 else 0,
+                              1+self.K*self.B), dtype=self.dtype)
+
+        minibatches = []
+        for i in range(n_mbs):
+            start, end = i * minibatchsize, min((i+1) * minibatchsize, self.T)
+            first, last = bounds[i], bounds[i+1]
+
+            # Share the model, the GSL RNGs, etc. with this data set
+            p = copy.copy(self)
+            p.T = end - start
+            p.S = self.S[start:end]
+            p.F = self.F[start:end]
+            p._set_events(t[first:last], k[first:last],
+                          counts[first:last], F_events[first:last])
+            p._Z = None
+            p._shard_rngs = []
+            p._EZ_events = EZ_events[:last-first]
+            p._EZ = p._EZ_views()
+            p._minibatches = None
+            minibatches.append(p)
+
+        self._minibatches = (minibatchsize, minibatches)
+        return minibatches
 
     @property
     def Z(self):
+        self._ensure_Z()
+        return self._Z
+
+    def _ensure_Z(self):
+        """
+        Allocate the parents if needed. Like EZ, the parents of all
+        processes are packed into one buffer.
+        """
         if self._Z is None:
-            self._Z = []
-            for Tk in self.Ts:
-                self._Z.append(np.zeros((Tk, 1+self.K*self.B), dtype=np.uint32))
+            self._Z_events = np.zeros((len(self.S_events), 1+self.K*self.B),
+                                      dtype=self.S_events.dtype)
+            self._Z = [self._Z_events[start:end] for start, end
+                       in zip(self.offsets[:-1], self.offsets[1:])]
 
-        return self._Z
+    def _shards(self):
+        """
+        Split the packed events into contiguous shards, i.e. runs of
+        consecutive time bins of each process, of about SHARD_BYTES
+        each and with at least one shard per thread of the data pool.
+        :return: a list of (start, end) ranges of events
+        """
+        n_events = len(self.S_events)
+        KB = self.K * self.B
+
+        # The filtered data, the parents and their probabilities of an event
+        event_bytes = KB * self.F_events.itemsize + (1+KB) * (self.dtype.itemsize + 8)
+        n_shards = max(self.model.data_pool.n_threads,
+                       int(np.ceil(n_events * event_bytes / float(self.SHARD_BYTES))))
+        n_shards = max(min(n_shards, n_events), 1)
+
+        bounds = np.linspace(0, n_events, n_shards+1).astype(np.int64)
+        return list(zip(bounds[:-1], bounds[1:]))
 
     @property
     def EZ(self):
         if self._EZ is None:
-            self._EZ = []
-            for Tk in self.Ts:
-                self._EZ.append(np.zeros((Tk, 1+self.K*self.B)))
+            # Allocate one buffer for the events of all processes so that
+            # the Cython update can run over all of them in parallel
+            self._EZ_events = np.zeros((len(self.S_events), 1+self.K*self.B),
+                                       dtype=self.dtype)
+            self._EZ = self._EZ_views()
 
         return self._EZ
 
+    def _EZ_views(self):
+        return [self._EZ_events[start:end] for start, end
+                in zip(self.offsets[:-1], self.offsets[1:])]
+
     # Debugging helper functions
     def _check_Z(self):
         """
@@ -127,15 +278,21 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
             ll += self.log_likelihood_single_process(k)
         return ll
 
-    def log_likelihood_single_process(self, k2):
+    def log_likelihood_single_process(self, k2, W=None):
         """
         Compute the *marginal* log likelihood by summing over
         parent assignments. In practice, this just means compute
         the total area under the rate function (an easy sum) and
         the instantaneous rate at the time of spikes.
+
+        :param W: Effective weights of the edges into k2 to use
+                  instead of the model's
         """
+        weight_model = self.model.weight_model
+        edges, k1s = weight_model._edges_into(k2)
         lambda0 = self.model.bias_model.lambda0
-        W = self.model.weight_model.W_effective
+        if W is None:
+            W = weight_model.W_effective_edges[edges]
         g = self.model.impulse_model.g
 
         T, K, B, dt = self.T, self.K, self.B, self.dt
@@ -145,12 +302,12 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # Compute the integrated rate
         # Each event induces a weighted impulse response
         ll += -lambda0[k2] * T * dt
-        ll += -(W[:,k2] * self.Ns).sum()
+        ll += -(W * self.Ns[k1s]).sum()
 
         # Compute the instantaneous log rate
-        Wk2 = W[:,k2][None,:,None] #(1,K,1)
-        Gk2 = g[:,k2,:][None,:,:] # (1,K,B)
-        lam = lambda0[k2] + (Wk2 * Gk2 * Fk).sum(axis=(1,2))
+        Wk2 = W[None,:,None] #(1,E_k2,1)
+        Gk2 = g[k1s,k2,:][None,:,:] # (1,E_k2,B)
+        lam = lambda0[k2] + (Wk2 * Gk2 * Fk[:,k1s,:]).sum(axis=(1,2))
 
         ll += (Sk * np.log(lam)).sum()
         return ll
@@ -170,35 +327,42 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
             ss[0,k] = Zk[:,0].sum()
         return ss
 
-    def compute_approx_weight_ss(self):
+    def _edge_weight_ss(self, Z, dtype=None):
+        """
+        Sum the (expected) parents on each edge of the weight model and
+        the event counts of its sender, with the edges into process k2
+        taken from the parents of the events on k2.
+        :return: a (2,E) array
+        """
+        weight_model = self.model.weight_model
         K, B = self.K, self.B
-        ss = np.zeros((2, self.K, self.K))
-        for k2, Zk in enumerate(self.Z):
-            # ss[0,k1,k2] = \sum_t \sum_b Z_{t,k2}^{k1,b}
-            ss[0,:,k2] = Zk[:,1:].sum(0).reshape((K,B)).sum(1)
-            # ss[1,k1,k2] = N[k1] (to be multiplied by A)
-            ss[1,:,k2] = self.Ns
+        ss = np.zeros((2, weight_model.E))
+        for k2, Zk in enumerate(Z):
+            edges, k1s = weight_model._edges_into(k2)
+            # ss[0,e] = \sum_t \sum_b Z_{t,k2}^{k1,b} for the edge e = (k1,k2)
+            ss[0,edges] = Zk[:,1:].sum(0, dtype=dtype).reshape((K,B))[k1s].sum(1)
+        # ss[1,e] = N[k1] (to be multiplied by A)
+        ss[1] = self.Ns[weight_model.rows]
         return ss
 
+    def compute_approx_weight_ss(self):
+        return self._edge_weight_ss(self.Z)
+
     def compute_exact_weight_ss(self):
         """
-        For comparison, compute the exact sufficient statistics for ss[1,:,:]
+        For comparison, compute the exact sufficient statistics for ss[1]
         :param data: a TxK array of event counts assigned to the background process
         :return:
         """
-        K, B, F = self.K, self.B, self.F
-        A = self.model.weight_model.A
+        F = self.F
+        weight_model = self.model.weight_model
+        A = weight_model._edges_of(weight_model.A)
         beta = self.model.impulse_model.g
-        ss = np.zeros((2, self.K, self.K))
-
-        for k2, Zk in enumerate(self.Z):
-            # ss[0,k1,k2] = \sum_t \sum_b Z_{t,k2}^{k1,b}
-            ss[0,:,k2] = Zk[:,1:].sum(0).reshape((K,B)).sum(1)
+        ss = self.compute_approx_weight_ss()
 
-            # ss[1,k1,k2] = A_k1,k2 * \sum_t \sum_b F[t,k1,b] * beta[k1,k2,b]
-            for k1 in range(self.K):
-                for k2 in range(self.K):
-                    ss[1,k1,k2] = A[k1,k2] * (F[:,k1,:].dot(beta[k1,k2,:])).sum()
+        # ss[1,e] = A_e * \sum_t \sum_b F[t,k1,b] * beta[k1,k2,b] for the edge e = (k1,k2)
+        for e, (k1, k2) in enumerate(zip(weight_model.rows, weight_model.cols)):
+            ss[1,e] = A[e] * (F[:,k1,:].dot(beta[k1,k2,:])).sum()
 
         return ss
 
@@ -224,16 +388,18 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
             self.model.bias_model, self.model.weight_model, self.model.impulse_model
 
         for k2, (Sk, Fk, Zk) in enumerate(zip(self.Ss, self.Fs, self.Z)):
+            edges, k1s = weight_model._edges_into(k2)
+            Wk2 = weight_model.W_effective_edges[edges]     # (E_k2,)
+            Gk2 = impulse_model.g[k1s,k2,:]                 # (E_k2,B)
             for st,ft,zt in zip(Sk, Fk, Zk):
                 assert st > 0
 
                 # Compute the normalized probability vector for the background rate and
-                # each of the basis functions for every other process
+                # each of the basis functions of every edge into k2
                 p = np.zeros(1 + self.K * self.B)
                 p[0]  = bias_model.lambda0[k2]                  # Background
-                Wk2 = weight_model.W_effective[:,k2]            # (K,)
-                Gk2 = impulse_model.g[:,k2,:]                   # (K,B)
-                p[1:] = (ft *  Wk2[:,None] * Gk2).ravel()
+                pkb = p[1:].reshape((self.K, self.B))
+                pkb[k1s] = ft[k1s] * Wk2[:,None] * Gk2
 
                 # Normalize
                 p = p / p.sum()
@@ -243,43 +409,87 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
 
         # self._check_Z()
 
+    def _parent_probabilities(self, Wg, start, end):
+        """
+        Compute the unnormalized probabilities of the background and of
+        each process and basis function being the parent of the events
+        in [start, end), given Wg[e,b] = W[k1,k2] * g[k1,k2,b] for each
+        edge e = (k1,k2) of the weight model. The events are sorted by
+        process, so they are visited one receiving process at a time.
+        :return: an (end-start) x (1+K*B) array
+        """
+        weight_model = self.model.weight_model
+        ks = self.k_events[start:end]
+        P = np.zeros((end-start, 1+self.K*self.B))
+        P[:,0] = self.model.bias_model.lambda0[ks]
+        Pkb = P[:,1:].reshape((end-start, self.K, self.B))
+        for k2 in np.unique(ks):
+            first, last = np.clip(self.offsets[k2:k2+2], start, end)
+            edges, k1s = weight_model._edges_into(k2)
+            Pkb[first-start:last-start, k1s] = \
+                self.F_events[first:last][:,k1s,:] * Wg[edges]
+        return P
+
+    def _weighted_impulse_responses(self):
+        # Wg[e,b] = W[k1,k2] * g[k1,k2,b] for each edge e = (k1,k2)
+        weight_model = self.model.weight_model
+        g = self.model.impulse_model.g[weight_model.rows, weight_model.cols]
+        return weight_model.W_effective_edges[:,None] * g
+
     def _resample_Z_gsl(self, data=[]):
         """
         Resample the parents given the bias_model, weight_model, and impulse_model.
-
-        :param bias_model:
-        :param weight_model:
-        :param impulse_model:
-        :return:
+        The GSL sampler runs over the events of each shard in parallel,
+        so the shards are processed one at a time.
         """
         from gslrandom import multinomial
-        bias_model, weight_model, impulse_model = \
-            self.model.bias_model, self.model.weight_model, self.model.impulse_model
-        K, B = self.K, self.B
+        Wg = self._weighted_impulse_responses()
 
-        # Make a big matrix of size T x (K*B + 1)
-        for k2, (Sk, Fk, Tk, Zk) in enumerate(zip(self.Ss, self.Fs, self.Ts, self.Z)):
-            P = np.zeros((Tk, 1+self.K * self.B))
-            P[:,0] = bias_model.lambda0[k2]
-
-            Wk2 = np.repeat(weight_model.W_effective[:,k2], B)
-            Gk2 = impulse_model.g[:,k2,:].reshape((K*B,), order="C")
-            P[:,1:] = Wk2 * Gk2 * Fk.reshape((Tk, K*B))
+        for start, end in self._shards():
+            P = self._parent_probabilities(Wg, start, end)
 
             # Normalize the rows
             P = P / P.sum(1)[:,None]
 
-            # Sample parents from P with counts S[:,k2]
-            multinomial(self.pyrngs, Sk, P, out=Zk)
+            # Sample parents from P with counts S. The sampler writes uint32
+            # parents, so compact parents are copied out one shard at a time.
+            if self._Z_events.dtype == np.uint32:
+                multinomial(self.pyrngs, self._S_events_gsl[start:end], P,
+                            out=self._Z_events[start:end])
+            else:
+                Z = np.zeros(P.shape, dtype=np.uint32)
+                multinomial(self.pyrngs, self._S_events_gsl[start:end], P, out=Z)
+                self._Z_events[start:end] = Z
 
         # DEBUG
         # self._check_Z()
 
+    def _resample_Z_numpy(self):
+        """
+        Resample the parents with numpy, one shard per task on the data
+        pool. Each shard has its own random number generator, so the
+        samples do not depend on how the shards are scheduled.
+        """
+        Wg = self._weighted_impulse_responses()
+        shards = self._shards()
+        while len(self._shard_rngs) < len(shards):
+            self._shard_rngs.append(np.random.RandomState(np.random.randint(2**31)))
+
+        def _resample_shard(i):
+            start, end = shards[i]
+            P = self._parent_probabilities(Wg, start, end)
+            _sample_multinomial_rows(self._shard_rngs[i], self.S_events[start:end],
+                                     P, self._Z_events[start:end])
+
+        self._ensure_Z()
+        self.model.data_pool.map(_resample_shard, range(len(shards)))
+
     def resample(self, data=[]):
         if self.USE_GSL:
+            self._ensure_Z()
             self._resample_Z_gsl()
         else:
-            self._resample_Z_python()
+            self._resample_Z_numpy()
 
     ### Mean Field
     def expected_log_likelihood(self,x):
@@ -298,18 +508,20 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         T, dt, K, B = self.T, self.dt, self.K, self.B
 
         exp_lam0 = bias_model.expected_lambda0()
-        exp_W = weight_model.expected_W()
+        exp_W = weight_model.expected_W_edges()
         exp_G = impulse_model.expected_g()
 
         exp_ll = 0
         for k2, (Sk, Fk, Tk, Zk) in enumerate(zip(self.Ss, self.Fs, self.Ts, self.Z)):
+            edges, k1s = weight_model._edges_into(k2)
+
             # Compute the integrated rate
             # Each event induces a weighted impulse response
             exp_ll += -exp_lam0[k2] * T * dt
-            exp_ll += -(exp_W[:,k2] * self.Ns).sum()
+            exp_ll += -(exp_W[edges] * self.Ns[k1s]).sum()
 
             # Compute the instantaneous log rate
-            exp_lam = exp_lam0[k2] + (Fk * exp_W[:,k2][:,None] * exp_G[:,k2,:]).sum(axis=(1,2))
+            exp_lam = exp_lam0[k2] + (Fk[:,k1s,:] * exp_W[edges][:,None] * exp_G[k1s,k2,:]).sum(axis=(1,2))
 
             # Use Jensen's inequality
             exp_ll += (Sk * np.log(exp_lam)).sum()
@@ -321,20 +533,13 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # \sum_{t} z_{t,k}^{0} and T * dt
         ss = np.zeros((2, self.K))
         for k,EZk in enumerate(self.EZ):
-            ss[0,k] = EZk[:,0].sum()
+            ss[0,k] = EZk[:,0].sum(dtype=np.float64)
 
         ss[1,:] = self.T * self.dt
         return ss
 
     def compute_exp_weight_ss(self):
-        K, B = self.K, self.B
-        ss = np.zeros((2, self.K, self.K))
-        for k2, EZk in enumerate(self.EZ):
-            # ss[0,k1,k2] = \sum_t \sum_b Z_{t,k2}^{k1,b}
-            ss[0,:,k2] = EZk[:,1:].sum(0).reshape((K,B)).sum(1)
-            # ss[1,k1,k2] = N[k1] (to be multiplied by A)
-            ss[1,:,k2] = self.Ns
-        return ss
+        return self._edge_weight_ss(self.EZ, dtype=np.float64)
 
     def compute_exp_ir_ss(self):
         """
@@ -344,65 +549,105 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # ss[k1,k2,b] = \sum_t z_{t,k2}^{k1,b}
         ss = np.zeros((self.K, self.K, self.B))
         for k2, EZk in enumerate(self.EZ):
-            ss[:,k2,:] = EZk[:,1:].sum(0).reshape((K,B))
+            ss[:,k2,:] = EZk[:,1:].sum(0, dtype=np.float64).reshape((K,B))
         return ss
 
 
     # Mean field updates!
-    def _mf_update_Z_python(self):
+    def _mf_update_Z_python(self, compute_vlb=False):
         """
         Update the mean field parameters for the latent parents
-        :return:
+        :return: the VLB of the parents if compute_vlb is True
         """
         bias_model, weight_model, impulse_model = \
             self.model.bias_model, self.model.weight_model, self.model.impulse_model
         K, B = self.K, self.B
 
+        vlb = 0
         for k2, (Sk, Fk, Tk, EZk) in enumerate(zip(self.Ss, self.Fs, self.Ts, self.EZ)):
             Sk = Sk.astype(np.float)
+            edges, k1s = weight_model._edges_into(k2)
             # Compute the normalized probability vector for the background rate and
-            # each of the basis functions for every other process
-            p0  = np.exp(bias_model.expected_log_lambda0()[k2])     # scalar
-            Wk2 = np.exp(weight_model.expected_log_W()[:,k2])       # (K,)
-            Gk2 = np.exp(impulse_model.expected_log_g()[:,k2,:])    # (K,B)
-            pkb = Fk * Wk2[None,:,None] * Gk2[None,:,:]
-            assert pkb.shape == (Tk, K, B)
+            # each of the basis functions of every edge into k2
+            p0  = np.exp(bias_model.expected_log_lambda0()[k2])             # scalar
+            Wk2 = np.exp(weight_model.expected_log_W_edges()[edges])        # (E_k2,)
+            Gk2 = np.exp(impulse_model.expected_log_g()[k1s,k2,:])          # (E_k2,B)
+            pkb = np.zeros((Tk, K, B), dtype=Fk.dtype)
+            pkb[:,k1s] = Fk[:,k1s,:] * (Wk2[:,None] * Gk2).astype(Fk.dtype)[None,:,:]
 
             pkb = pkb.reshape((-1, K*B))
 
             # Combine the probabilities into a normalized vector of length KB+1
-            Z = p0 + pkb.sum(axis=1)
+            Z = p0 + pkb.sum(axis=1, dtype=np.float64)
             EZk[:,0] = p0 / Z * Sk
             EZk[:,1:] = pkb / Z[:,None] * Sk[:,None]
 
             assert np.all(np.isfinite(EZk))
 
+            if compute_vlb:
+                vlb += (Sk * np.log(Z)).sum()
+
         # self._check_EZ()
 
-    def _mf_update_Z(self):
+        if compute_vlb:
+            return vlb + self._static_vlb()
+
+    def _mf_update_Z(self, compute_vlb=False):
         """
         Update the mean field parameters for the latent parents
-        :return:
+        of all events in one parallel pass with Cython.
+        :return: the VLB of the parents if compute_vlb is True
         """
-        bias_model, weight_model, impulse_model = \
-            self.model.bias_model, self.model.weight_model, self.model.impulse_model
-        K, B = self.K, self.B
+        exp_E_log_lambda0 = np.exp(self.model.bias_model.expected_log_lambda0())
+
+        # The weighted impulse responses of the edges of the weight model,
+        # exp_E_log_Wg[e,b] = exp(E[log W[k1,k2]] + E[log g[k1,k2,b]]) for
+        # the edge e = (k1,k2), are shared by all data sets
+        weight_model = self.model.weight_model
+        exp_E_log_Wg = self.model._exp_expected_log_Wg()
+
+        # Make sure the buffer has been allocated
+        self.EZ
+
+        # The shards are spread over the threads of the data pool. A call
+        # on a thread of the pool runs on that thread alone, otherwise it
+        # parallelizes over the events of its shard with OpenMP.
+        def _update_shard(shard):
+            start, end = shard
+            return mf_update_Z(self._EZ_events[start:end],
+                               self.S_events[start:end],
+                               self.k_events[start:end], exp_E_log_lambda0,
+                               weight_model.indptr, weight_model.rows, exp_E_log_Wg,
+                               self.F_events[start:end], compute_vlb,
+                               1 if in_pool_thread() else 0)
+
+        shards = self._shards() if self.model.data_pool.n_threads > 1 \
+            else [(0, len(self.S_events))]
+        vlb = sum(self.model.data_pool.map(_update_shard, shards))
 
-        exp_E_log_lambda0 = np.exp(bias_model.expected_log_lambda0())
-        exp_E_log_W = np.exp(weight_model.expected_log_W())
-        exp_E_log_g = np.exp(impulse_model.expected_log_g())
+        # self._check_EZ()
 
-        for k2, (Sk, Fk, EZk) in enumerate(zip(self.Ss, self.Fs, self.EZ)):
-            mf_update_Z(k2, EZk, Sk,
-                        exp_E_log_lambda0,
-                        exp_E_log_W,
-                        exp_E_log_g,
-                        Fk)
+        if compute_vlb:
+            return vlb + self._static_vlb()
 
-        self._check_EZ()
+    def meanfieldupdate(self, compute_vlb=False):
+        """
+        Update the expected parents. If compute_vlb is True, the VLB of
+        the parents (the same value as get_vlb) is accumulated in the same
+        pass and returned. It is only valid until the bias, weight or
+        impulse response models are updated.
+        """
+        return self._mf_update_Z(compute_vlb=compute_vlb)
 
-    def meanfieldupdate(self):
-        return self._mf_update_Z_python()
+    def _static_vlb(self):
+        """
+        The terms of the parents' VLB that do not depend on the events,
+        -T * E[lambda0] - N * E[W] for each process.
+        """
+        weight_model = self.model.weight_model
+        E_lam = self.model.bias_model.expected_lambda0()
+        E_W = weight_model.expected_W_edges()
+        return -self.T * E_lam.sum() - (self.Ns[weight_model.rows] * E_W).sum()
 
     def get_vlb(self):
         bias_model, weight_model, impulse_model = \
@@ -414,13 +659,16 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # The factorial cancels with the second term
         E_ln_lam = bias_model.expected_log_lambda0()
         E_lam = bias_model.expected_lambda0()
-        E_ln_W = weight_model.expected_log_W()
-        E_W = weight_model.expected_W()
+        E_ln_W = weight_model.expected_log_W_edges()
+        E_W = weight_model.expected_W_edges()
         E_ln_g = impulse_model.expected_log_g()
 
         vlb = 0
         for k, (EZk, Sk, Fk) in enumerate(zip(self.EZ, self.Ss, self.Fs)):
-            vlb += mf_vlb(k, self.T, EZk, Sk, self.Ns, E_ln_lam, E_lam, E_ln_W, E_W, E_ln_g, Fk)
+            edges = slice(weight_model.indptr[k], weight_model.indptr[k+1])
+            vlb += mf_vlb(k, self.T, EZk, Sk, self.Ns, E_ln_lam, E_lam,
+                          weight_model.rows[edges], E_ln_W[edges], E_W[edges],
+                          E_ln_g, Fk)
 
         return vlb
 
@@ -439,8 +687,8 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # The factorial cancels with the second term
         E_ln_lam = bias_model.expected_log_lambda0()
         E_lam = bias_model.expected_lambda0()
-        E_ln_W = weight_model.expected_log_W()
-        E_W = weight_model.expected_W()
+        E_ln_W = weight_model.expected_log_W_edges()
+        E_W = weight_model.expected_W_edges()
         E_ln_g = impulse_model.expected_log_g()
 
         for k, EZk in enumerate(self.EZ):
@@ -461,15 +709,17 @@ class DiscreteTimeParents(GibbsSampling, MeanField):
         # TODO: We shouldn't have to look at the whole dataset
         # Since each impulse response is normalized...
         for k, (EZk, Sk, Fk, Tk, tk) in enumerate(zip(self.EZ, self.Ss, self.Fs, self.Ts, self.ts)):
-            E_ln_Wg = (np.log(Fk) +
-                       E_ln_W[:,k][None,:,None] +
-                       E_ln_g[:,k,:][None,:,:])
+            # Only the edges into k can be parents
+            edges, k1s = weight_model._edges_into(k)
+            E_ln_Wg = np.zeros((Tk, K, B))
+            E_ln_Wg[:,k1s] = (np.log(Fk[:,k1s,:]) +
+                              E_ln_W[edges][None,:,None] +
+                              E_ln_g[k1s,k,:][None,:,:])
             E_ln_Wg = np.nan_to_num(E_ln_Wg)
-            assert E_ln_Wg.shape == (Tk, K, B)
             vlb += (EZk[:,1:] * E_ln_Wg.reshape((Tk, K*B))).sum()
 
             # Compute the sum of E[W] * N
-            sum_E_Wg = (self.Ns * E_W[:,k]).sum()
+            sum_E_Wg = (self.Ns[k1s] * E_W[edges]).sum()
             vlb += -sum_E_Wg
 
 
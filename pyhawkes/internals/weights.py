@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse
 from scipy.special import gammaln, psi
 from scipy.misc import logsumexp
 
@@ -6,20 +7,166 @@ from joblib import Parallel, delayed
 
 from pybasicbayes.abstractions import GibbsSampling, MeanField, MeanFieldSVI
 from pyhawkes.internals.distributions import Bernoulli, Gamma
-from pyhawkes.utils.utils import logistic, logit
+from pyhawkes.utils.cache import VersionedParameters, cached_by_version
+from pyhawkes.utils.utils import logistic, logit, candidate_edges
 
 
-class SpikeAndSlabGammaWeights(GibbsSampling):
+class _WeightEdges(object):
+    """
+    Mixin for the discrete time weight models that exposes their
+    parameters on a list of edges, sorted by receiver. The parents and
+    the network only read these edge vectors, so their cost scales with
+    the number of edges. By default there is an edge for every pair of
+    processes and the parameters are stored as KxK arrays.
+    _CandidateEdgeWeights overrides the layout hooks below to store
+    them as vectors over a set of candidate edges instead.
+    """
+    # The candidate edges, as accepted by candidate_edges,
+    # or None for every pair of processes
+    candidates = None
+
+    def _set_edges(self):
+        candidates = self.candidates
+        if candidates is None:
+            candidates = np.ones((self.K, self.K))
+        self.rows, self.cols = candidate_edges(candidates, self.K)
+        self.E = self.rows.size
+        # The edges into receiver k2 are indptr[k2]:indptr[k2+1]
+        self.indptr = np.searchsorted(self.cols, np.arange(self.K+1))
+
+    def _edges_into(self, k2):
+        """
+        Get the edges into process k2 as a slice of the edge vectors,
+        and their senders as an index into the processes. When every
+        process is a sender the index is a slice, so it does not copy.
+        """
+        start, stop = self.indptr[k2], self.indptr[k2+1]
+        senders = self.rows[start:stop]
+        if stop - start == self.K:
+            senders = slice(None)
+        return slice(start, stop), senders
+
+    def _on_edges(self, X):
+        """
+        Get a scalar, a KxK array, or a stack of KxK arrays on the edges
+        """
+        X = np.asarray(X)
+        if X.ndim == 0:
+            return X * np.ones(self.E)
+        return X[..., self.rows, self.cols]
+
+    def _to_dense(self, x, fill=0.0):
+        """
+        Get a vector, or a stack of vectors, on the edges as KxK arrays
+        """
+        x = np.asarray(x)
+        X = fill * np.ones(x.shape[:-1] + (self.K, self.K))
+        X[..., self.rows, self.cols] = x
+        return X
+
+    def _sparse(self, x):
+        """
+        Get a vector on the edges as a KxK scipy.sparse CSC matrix
+        """
+        return scipy.sparse.csc_matrix((x, self.rows, self.indptr),
+                                       shape=(self.K, self.K))
+
+    ### Layout of the parameters
+    @property
+    def _shape(self):
+        return (self.K, self.K)
+
+    def _edges_of(self, X):
+        """
+        Get parameters in the layout of this model on the edges
+        """
+        return self._on_edges(X)
+
+    def _from_edges(self, x):
+        """
+        Get a (stack of) vector(s) on the edges in the layout of this model
+        """
+        return self._to_dense(x)
+
+    def _from_dense(self, X):
+        """
+        Get KxK parameters in the layout of this model
+        """
+        return X
+
+    def as_dense(self, X, fill=0.0):
+        """
+        Get parameters in the layout of this model, like A, W or the
+        variational parameters, as a KxK array
+        """
+        return X
+
+    def _self_connections(self):
+        """
+        Get a mask of the self connections in the layout of this model
+        """
+        return np.eye(self.K, dtype=bool)
+
+    def _prior(self):
+        """
+        Get the prior probability of each edge and the shape and
+        scale of its weight
+        """
+        return self.network.P, self.network.kappa, self.network.V
+
+    def _expected_prior(self):
+        """
+        Get E[ln p], E[ln (1-p)], E[v] and E[ln v] of each edge
+        under the mean field distribution of the network
+        """
+        network = self.network
+        return network.expected_log_p(), network.expected_log_notp(), \
+               network.expected_v(), network.expected_log_v()
+
+    def _weight_ss(self, data, expected=False):
+        """
+        Sum the (expected) parent counts and the event counts of the
+        sender of each edge over the data
+        """
+        if expected:
+            compute = lambda d: d.compute_exp_weight_ss()
+        else:
+            compute = lambda d: d.compute_weight_ss()
+        ss = np.zeros((2, self.E)) + self.model.data_pool.sum(compute, data)
+        return self._from_edges(ss)
+
+    ### Edge views read by the parents and the network
+    @property
+    @cached_by_version
+    def W_effective_edges(self):
+        return self._edges_of(self.W_effective)
+
+    @property
+    def A_sparse(self):
+        return self._sparse(self._edges_of(self.A))
+
+    @property
+    def W_sparse(self):
+        return self._sparse(self._edges_of(self.W))
+
+
+class SpikeAndSlabGammaWeights(VersionedParameters, GibbsSampling, _WeightEdges):
     """
     Encapsulates the KxK Bernoulli adjacency matrix and the
     KxK gamma weight matrix. Implements Gibbs sampling given
     the parent variables.
     """
-    def __init__(self, model, parallel_resampling=True):
+    _versioned_params = ("A", "W")
+
+    def __init__(self, model, parallel_resampling=True, joint_resampling=False):
         """
         Initialize the spike-and-slab gamma weight model with either a
         network object containing the prior or rho, alpha, and beta to
         define an independent model.
+
+        :param parallel_resampling: Resample the columns of A | W in parallel
+        :param joint_resampling:    Resample A and W jointly given the
+                                    parents, integrating W out of A | z
         """
         self.model = model
         self.K = model.K
@@ -28,13 +175,16 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
 
         # Specify whether or not to resample the columns of A in parallel
         self.parallel_resampling = parallel_resampling
+        self.joint_resampling = joint_resampling
 
         # Initialize parameters A and W
-        self.A = np.ones((self.K, self.K))
-        self.W = np.zeros((self.K, self.K))
+        self._set_edges()
+        self.A = np.ones(self._shape)
+        self.W = np.zeros(self._shape)
         self.resample()
 
     @property
+    @cached_by_version
     def W_effective(self):
         return self.A * self.W
 
@@ -45,20 +195,17 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
         :return:
         """
         A,W = x
-        assert isinstance(A, np.ndarray) and A.shape == (self.K,self.K), \
-            "A must be a KxK adjacency matrix"
-        assert isinstance(W, np.ndarray) and W.shape == (self.K,self.K), \
-            "W must be a KxK weight matrix"
+        assert isinstance(A, np.ndarray) and A.shape == self._shape, \
+            "A must be a KxK adjacency matrix, or a vector on the candidate edges"
+        assert isinstance(W, np.ndarray) and W.shape == self._shape, \
+            "W must be a KxK weight matrix, or a vector on the candidate edges"
 
         # LL of A
-        rho = np.clip(self.network.P, 1e-32, 1-1e-32)
+        p, kappa, v = self._prior()
+        rho = np.clip(p, 1e-32, 1-1e-32)
         ll = (A * np.log(rho) + (1-A) * np.log(1-rho)).sum()
         ll = np.nan_to_num(ll)
 
-        # Get the shape and scale parameters from the network model
-        kappa = self.network.kappa
-        v = self.network.V
-
         # Add the LL of the gamma weights
         lp_W = kappa * np.log(v) - gammaln(kappa) + \
                (kappa-1) * np.log(W) - v * W
@@ -70,20 +217,54 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
         return self.log_likelihood((self.A, self.W))
 
     def rvs(self,size=[]):
-        A = np.random.rand(self.K, self.K) < self.network.P
-        W = np.random.gamma(self.network.kappa, 1.0/self.network.V,
-                            size(self.K, self.K))
+        p, kappa, v = self._prior()
+        A = np.random.rand(*self._shape) < p
+        W = np.random.gamma(kappa, 1.0/v, size=self._shape)
 
         return A,W
 
-    def _joint_resample_A_W(self):
+    def _collapsed_sample_A_W(self, ss, p, kappa, v):
         """
-        Not sure how to do this yet, but it would be nice to resample A
-        from its marginal distribution after integrating out W, and then
-        sample W | A.
-        :return:
+        Sample A from its marginal distribution given the parent
+        sufficient statistics, after integrating out W, and then W | A.
+
+        An edge that is absent cannot be the parent of any event, so
+        an edge with parent counts is present with probability one.
+        An edge without them is present with probability proportional to
+        p times the probability of no parents under the gamma prior,
+        (v / (v + N_k1))^kappa. Both cases are covered by the ratio of
+        gamma normalizing constants used in GammaMixtureWeights._resample_A.
+
+        :param ss:    (2,...) parent counts and event counts
+        :param p:     prior probability of each edge
+        :param kappa: shape of the gamma prior on the weights
+        :param v:     scale of the gamma prior on the weights
+        :return:      A, W with the shape of ss[0]
         """
-        raise NotImplementedError()
+        kappa_post = kappa + ss[0]
+        v_post = v + ss[1]
+
+        with np.errstate(divide="ignore"):
+            lp0 = np.where(ss[0] > 0, -np.inf, np.log(1.0 - p))
+            lp1 = np.log(p) + kappa * np.log(v) - gammaln(kappa) + \
+                  gammaln(kappa_post) - kappa_post * np.log(v_post)
+
+        # ln p(A=1) = lp1 - ln(exp(lp0) + exp(lp1))
+        A = np.log(np.random.rand(*lp1.shape)) < lp1 - np.logaddexp(lp0, lp1)
+
+        # The weights of absent edges are drawn from their prior
+        W = np.random.gamma(kappa_post, 1.0/(v + A * ss[1]))
+        return A, W
+
+    def _joint_resample_A_W(self, data=[]):
+        """
+        Resample A from its marginal distribution given the parents,
+        after integrating out W, and then sample W | A. Unlike
+        resampling A | W, this needs no evaluations of the likelihood,
+        only the parent sufficient statistics.
+        """
+        ss = self._weight_ss(data)
+        self.A, self.W = self._collapsed_sample_A_W(ss, *self._prior())
 
     def _joblib_resample_A_given_W(self, data):
         """
@@ -116,6 +297,9 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
         :return:
         """
         p = self.network.P
+        # Update a copy of A and assign it once at the end, rather than
+        # invalidating the cached W_effective for every edge
+        A = self.A.copy()
         for k1 in range(self.K):
             for k2 in range(self.K):
                 if self.model is None:
@@ -123,12 +307,14 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
                     ll1 = 0
                 else:
                     # Compute the log likelihood of the events given W and A=0
-                    self.A[k1,k2] = 0
-                    ll0 = sum([d.log_likelihood_single_process(k2) for d in data])
+                    A[k1,k2] = 0
+                    W_eff = A[:,k2] * self.W[:,k2]
+                    ll0 = sum([d.log_likelihood_single_process(k2, W_eff) for d in data])
 
                     # Compute the log likelihood of the events given W and A=1
-                    self.A[k1,k2] = 1
-                    ll1 = sum([d.log_likelihood_single_process(k2) for d in data])
+                    A[k1,k2] = 1
+                    W_eff = A[:,k2] * self.W[:,k2]
+                    ll1 = sum([d.log_likelihood_single_process(k2, W_eff) for d in data])
 
                 # Sample A given conditional probability
                 lp0 = ll0 + np.log(1.0 - p[k1,k2])
@@ -138,23 +324,25 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
                 # ln p(A=1) = ln (exp(lp1) / (exp(lp0) + exp(lp1)))
                 #           = lp1 - ln(exp(lp0) + exp(lp1))
                 #           = lp1 - Z
-                self.A[k1,k2] = np.log(np.random.rand()) < lp1 - Z
+                A[k1,k2] = np.log(np.random.rand()) < lp1 - Z
+
+        self.A = A
 
     def resample_W_given_A_and_z(self, data=[]):
         """
         Resample the weights given A and z.
         :return:
         """
-        ss = np.zeros((2, self.K, self.K)) + \
-             sum([d.compute_weight_ss() for d in data])
+        ss = self._weight_ss(data)
 
         # Account for whether or not a connection is present in N
         ss[1] *= self.A
 
-        kappa_post = self.network.kappa + ss[0]
-        v_post  = self.network.V + ss[1 ]
+        p, kappa, v = self._prior()
+        kappa_post = kappa + ss[0]
+        v_post  = v + ss[1]
 
-        self.W = np.atleast_1d(np.random.gamma(kappa_post, 1.0/v_post)).reshape((self.K, self.K))
+        self.W = np.atleast_1d(np.random.gamma(kappa_post, 1.0/v_post)).reshape(self._shape)
 
     def resample(self, data=[]):
         """
@@ -163,6 +351,10 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
                     on each of the K processes
         :param Z:   A TxKxKxB array of parent assignment counts
         """
+        if self.joint_resampling:
+            self._joint_resample_A_W(data)
+            return
+
         # Resample W | A
         self.resample_W_given_A_and_z(data)
 
@@ -172,11 +364,14 @@ class SpikeAndSlabGammaWeights(GibbsSampling):
         else:
             self._resample_A_given_W(data)
 
-class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
+class GammaMixtureWeights(VersionedParameters, GibbsSampling, MeanField, MeanFieldSVI, _WeightEdges):
     """
     For variational inference we approximate the spike at zero with a smooth
     Gamma distribution that has infinite density at zero.
     """
+    _versioned_params = ("A", "W", "mf_p",
+                         "mf_kappa_0", "mf_v_0", "mf_kappa_1", "mf_v_1")
+
     def __init__(self, model, kappa_0=0.1, nu_0=10.0):
         """
         Initialize the spike-and-slab gamma weight model with either a
@@ -203,18 +398,20 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         # Initialize the variational parameters to the prior mean
         # Variational probability of edge
         # self.mf_p = network.P * np.ones((self.K, self.K))
-        self.mf_p = np.ones((self.K, self.K)) - 1e-3
+        self._set_edges()
+        p, kappa, v = self._prior()
+        self.mf_p = np.ones(self._shape) - 1e-3
         # Variational weight distribution given that there is no edge
-        self.mf_kappa_0 = self.kappa_0 * np.ones((self.K, self.K))
-        self.mf_v_0 = self.nu_0 * np.ones((self.K, self.K))
+        self.mf_kappa_0 = self.kappa_0 * np.ones(self._shape)
+        self.mf_v_0 = self.nu_0 * np.ones(self._shape)
         # Variational weight distribution given that there is an edge
-        self.mf_kappa_1 = self.network.kappa * np.ones((self.K, self.K))
+        self.mf_kappa_1 = kappa * np.ones(self._shape)
         # self.mf_v_1 = network.alpha / network.beta * np.ones((self.K, self.K))
-        self.mf_v_1 = self.network.V * np.ones((self.K, self.K))
+        self.mf_v_1 = v * np.ones(self._shape)
 
         # Initialize parameters A and W
-        self.A = np.ones((self.K, self.K))
-        self.W = np.zeros((self.K, self.K))
+        self.A = np.ones(self._shape)
+        self.W = np.zeros(self._shape)
         self.resample()
 
     @property
@@ -228,19 +425,15 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         :return:
         """
         A,W = x
-        assert isinstance(A, np.ndarray) and A.shape == (self.K,self.K), \
-            "A must be a KxK adjacency matrix"
-        assert isinstance(W, np.ndarray) and W.shape == (self.K,self.K), \
-            "W must be a KxK weight matrix"
+        assert isinstance(A, np.ndarray) and A.shape == self._shape, \
+            "A must be a KxK adjacency matrix, or a vector on the candidate edges"
+        assert isinstance(W, np.ndarray) and W.shape == self._shape, \
+            "W must be a KxK weight matrix, or a vector on the candidate edges"
 
         # LL of A
-        rho = self.network.P
+        rho, kappa, v = self._prior()
         lp_A = (A * np.log(rho) + (1-A) * np.log(1-rho))
 
-        # Get the shape and scale parameters from the network model
-        kappa = self.network.kappa
-        v = self.network.V
-
         # Add the LL of the gamma weights
         # lp_W = np.zeros((self.K, self.K))
         # lp_W = A * (kappa * np.log(v) - gammaln(kappa)
@@ -269,6 +462,7 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
     def expected_A(self):
         return self.mf_p
 
+    @cached_by_version
     def expected_W(self):
         """
         Compute the expected W under the variational approximation
@@ -277,10 +471,11 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         E_W =  p_A * self.expected_W_given_A(1.0) + (1-p_A) * self.expected_W_given_A(0.0)
 
         if not self.network.allow_self_connections:
-            np.fill_diagonal(E_W, 0.0)
+            E_W[self._self_connections()] = 0.0
 
         return E_W
 
+    @cached_by_version
     def expected_W_given_A(self, A):
         """
         Compute the expected W given A under the variational approximation
@@ -296,6 +491,7 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         """
         return np.sqrt(self.mf_p * (1-self.mf_p))
 
+    @cached_by_version
     def expected_log_W(self):
         """
         Compute the expected log W under the variational approximation
@@ -305,10 +501,11 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
                (1-p_A) * self.expected_log_W_given_A(0.0)
 
         if not self.network.allow_self_connections:
-            np.fill_diagonal(E_ln_W, -np.inf)
+            E_ln_W[self._self_connections()] = -np.inf
 
         return E_ln_W
 
+    @cached_by_version
     def expected_log_W_given_A(self, A):
         """
         Compute the expected log W given A under the variational approximation
@@ -316,6 +513,20 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         return A * (psi(self.mf_kappa_1) - np.log(self.mf_v_1)) + \
                (1.0 - A) * (psi(self.mf_kappa_0) - np.log(self.mf_v_0))
 
+    @cached_by_version
+    def expected_W_edges(self):
+        return self._edges_of(self.expected_W())
+
+    @cached_by_version
+    def expected_log_W_edges(self):
+        return self._edges_of(self.expected_log_W())
+
+    def expected_A_sparse(self):
+        return self._sparse(self._edges_of(self.expected_A()))
+
+    def expected_W_given_A_sparse(self, A):
+        return self._sparse(self._edges_of(self.expected_W_given_A(A)))
+
     def expected_log_likelihood(self,x):
         raise NotImplementedError()
 
@@ -325,8 +536,9 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         parameters of the weight distributions.
         :return:
         """
-        logit_p = self.network.expected_log_p() - self.network.expected_log_notp()
-        logit_p += self.network.kappa * self.network.expected_log_v() - gammaln(self.network.kappa)
+        E_ln_p, E_ln_notp, _, E_ln_v = self._expected_prior()
+        logit_p = E_ln_p - E_ln_notp
+        logit_p += self.network.kappa * E_ln_v - gammaln(self.network.kappa)
         logit_p += gammaln(self.mf_kappa_1) - self.mf_kappa_1 * np.log(self.mf_v_1)
         logit_p += gammaln(self.kappa_0) - self.kappa_0 * np.log(self.nu_0)
         logit_p += self.mf_kappa_0 * np.log(self.mf_v_0) - gammaln(self.mf_kappa_0)
@@ -344,7 +556,7 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         Update the variational weight distributions
         :return:
         """
-        exp_ss = sum([d.compute_exp_weight_ss() for d in data])
+        exp_ss = self._weight_ss(data, expected=True)
 
         # kappa' = kappa + \sum_t \sum_b z[t,k,k',b]
         kappa0_hat = self.kappa_0 + exp_ss[0] / minibatchfrac
@@ -353,11 +565,11 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         self.mf_kappa_1 = (1.0 - stepsize) * self.mf_kappa_1 + stepsize * kappa1_hat
 
         # v_0'[k,k'] = self.nu_0 + N[k]
-        v0_hat = self.nu_0 * np.ones((self.K, self.K)) + exp_ss[1] / minibatchfrac
+        v0_hat = self.nu_0 * np.ones(self._shape) + exp_ss[1] / minibatchfrac
         self.mf_v_0 = (1.0 - stepsize) * self.mf_v_0 + stepsize * v0_hat
 
         # v_1'[k,k'] = E[v[k,k']] + N[k]
-        v1_hat = self.network.expected_v() + exp_ss[1] / minibatchfrac
+        v1_hat = self._expected_prior()[2] + exp_ss[1] / minibatchfrac
         self.mf_v_1 = (1.0 - stepsize) * self.mf_v_1 + stepsize * v1_hat
 
     def meanfieldupdate(self, data=[]):
@@ -381,15 +593,12 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         # E[LN p(A | p)]
         E_A       = self.expected_A()
         E_notA    = 1.0 - E_A
-        E_ln_p    = self.network.expected_log_p()
-        E_ln_notp = self.network.expected_log_notp()
+        E_ln_p, E_ln_notp, E_v, E_ln_v = self._expected_prior()
         vlb += Bernoulli().negentropy(E_x=E_A, E_notx=E_notA,
                                       E_ln_p=E_ln_p, E_ln_notp=E_ln_notp).sum()
 
         # E[LN p(W | A=1, kappa, v)]
         kappa     = self.network.kappa
-        E_v       = self.network.expected_v()
-        E_ln_v    = self.network.expected_log_v()
         E_W1      = self.expected_W_given_A(A=1)
         E_ln_W1   = self.expected_log_W_given_A(A=1)
         vlb += (E_A * Gamma(kappa).negentropy(E_beta=E_v, E_ln_beta=E_ln_v,
@@ -417,13 +626,12 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         Resample from the mean field distribution
         :return:
         """
-        self.A = np.random.rand(self.K, self.K) < self.mf_p
+        self.A = np.random.rand(*self._shape) < self.mf_p
         self.W = (1-self.A) * np.random.gamma(self.mf_kappa_0, 1.0/self.mf_v_0)
         self.W += self.A * np.random.gamma(self.mf_kappa_1, 1.0/self.mf_v_1)
 
     def resample(self, data=[]):
-        ss = np.zeros((2, self.K, self.K)) + \
-             sum([d.compute_weight_ss() for d in data])
+        ss = self._weight_ss(data)
 
         # First resample A from its marginal distribution after integrating out W
         self._resample_A(ss)
@@ -437,46 +645,44 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         :param ss:
         :return:
         """
-        p = self.network.P
-        v = self.network.V
+        p, kappa, v = self._prior()
 
-        kappa0_post = self.kappa_0 + ss[0,:,:]
-        v0_post     = self.nu_0 + ss[1,:,:]
+        kappa0_post = self.kappa_0 + ss[0]
+        v0_post     = self.nu_0 + ss[1]
 
-        kappa1_post = self.network.kappa + ss[0,:,:]
-        v1_post     = v + ss[1,:,:]
+        kappa1_post = kappa + ss[0]
+        v1_post     = v + ss[1]
 
         # Compute the marginal likelihood of A=1 and of A=0
         # The result of the integral is a ratio of gamma distribution normalizing constants
         lp0  = self.kappa_0 * np.log(self.nu_0) - gammaln(self.kappa_0)
         lp0 += gammaln(kappa0_post) - kappa0_post * np.log(v0_post)
 
-        lp1  = self.network.kappa * np.log(v) - gammaln(self.network.kappa)
+        lp1  = kappa * np.log(v) - gammaln(kappa)
         lp1 += gammaln(kappa1_post) - kappa1_post * np.log(v1_post)
 
         # Add the prior and normalize
         lp0 = lp0 + np.log(1.0 - p)
         lp1 = lp1 + np.log(p)
-        Z   = logsumexp(np.concatenate((lp0[:,:,None], lp1[:,:,None]),
-                                       axis=2),
-                        axis=2)
+        Z   = np.logaddexp(lp0, lp1)
 
         # ln p(A=1) = ln (exp(lp1) / (exp(lp0) + exp(lp1)))
         #           = lp1 - ln(exp(lp0) + exp(lp1))
         #           = lp1 - Z
-        self.A = np.log(np.random.rand(self.K, self.K)) < lp1 - Z
+        self.A = np.log(np.random.rand(*self._shape)) < lp1 - Z
 
     def _resample_W_given_A(self, ss):
         # import pdb; pdb.set_trace()
-        kappa_prior = self.kappa_0 * (1-self.A) + self.network.kappa * self.A
-        kappa_cond  = kappa_prior + ss[0,:,:]
+        p, kappa, v = self._prior()
+        kappa_prior = self.kappa_0 * (1-self.A) + kappa * self.A
+        kappa_cond  = kappa_prior + ss[0]
 
-        v_prior     = self.nu_0 * (1-self.A) + self.network.V * self.A
-        v_cond      = v_prior + ss[1,:,:]
+        v_prior     = self.nu_0 * (1-self.A) + v * self.A
+        v_cond      = v_prior + ss[1]
 
         # Resample W from its gamma conditional
         self.W = np.array(np.random.gamma(kappa_cond, 1.0/v_cond)).\
-                        reshape((self.K, self.K))
+                        reshape(self._shape)
 
         self.W = np.clip(self.W, 1e-32, np.inf)
 
@@ -487,6 +693,8 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         :param W: Given weight matrix
         :return:
         """
+        A, W = self._from_dense(A), self._from_dense(W)
+
         # Set mean field probability of connection to conf if A==1
         # and (1-conf) if A == 0
         conf = 0.95
@@ -499,6 +707,148 @@ class GammaMixtureWeights(GibbsSampling, MeanField, MeanFieldSVI):
         self.mf_kappa_1 = scale * W
         self.mf_v_1     = scale
 
+    def initialize_from_sample(self):
+        """
+        Initialize the variational parameters around the current
+        sample of A and W, e.g. one set from a standard model fit
+        """
+        self.mf_kappa_0 = self.nu_0 * self.W.copy()
+        self.mf_v_0     = self.nu_0 * np.ones(self._shape)
+
+        self.mf_kappa_1 = 100 * self.W.copy()
+        self.mf_v_1     = 100 * np.ones(self._shape)
+
+        self.mf_p       = 0.8 * self.A + 0.2 * (1-self.A)
+
+
+class _CandidateEdgeWeights(_WeightEdges):
+    """
+    Mixin for weight models that are restricted to a fixed set of
+    candidate edges, e.g. the strongest weights of a MAP fit. The
+    weights, their variational parameters and their sufficient
+    statistics are stored as length-E vectors over the candidate
+    edges, sorted by receiver, and all other edges are fixed to be
+    absent. The network evaluates its prior on the candidate edges
+    only, and the dense KxK views are only formed by as_dense.
+    """
+    @property
+    def _shape(self):
+        return (self.E,)
+
+    def _edges_of(self, x):
+        return x
+
+    def _from_edges(self, x):
+        return x
+
+    def _from_dense(self, X):
+        # Accept vectors that are already on the candidate edges
+        if np.ndim(X) == 1:
+            return np.asarray(X)
+        return self._on_edges(X)
+
+    def as_dense(self, x, fill=0.0):
+        return self._to_dense(x, fill=fill)
+
+    def _self_connections(self):
+        return self.rows == self.cols
+
+    def _prior(self):
+        return self.network.prior_on_edges(self.rows, self.cols)
+
+    def _expected_prior(self):
+        return self.network.expected_on_edges(self.rows, self.cols)
+
+    @property
+    def A(self):
+        return self.A_edges
+
+    @A.setter
+    def A(self, A):
+        self.A_edges = self._from_dense(A)
+
+    @property
+    def W(self):
+        return self.W_edges
+
+    @W.setter
+    def W(self, W):
+        self.W_edges = self._from_dense(W)
+
+    @property
+    @cached_by_version
+    def W_effective_sparse(self):
+        """
+        The effective weights as a KxK scipy.sparse CSC matrix
+        """
+        return self._sparse(self.W_effective_edges)
+
+
+class SparseSpikeAndSlabGammaWeights(_CandidateEdgeWeights, SpikeAndSlabGammaWeights):
+    """
+    Spike-and-slab gamma weights on a fixed set of candidate edges.
+    Resampling A only evaluates the likelihood of the candidate edges,
+    and only with the filtered data of their senders.
+    """
+    _versioned_params = ("A_edges", "W_edges")
+
+    def __init__(self, model, candidates, **kwargs):
+        """
+        :param candidates: the candidate edges, as accepted by
+                           pyhawkes.utils.utils.candidate_edges
+        """
+        self.candidates = candidates
+        super(SparseSpikeAndSlabGammaWeights, self).__init__(model, **kwargs)
+
+    def _joblib_resample_A_given_W(self, data):
+        self._resample_A_given_W(data)
+
+    def _resample_A_given_W(self, data):
+        """
+        Resample A on the candidate edges given W, one receiving
+        process at a time. This must be immediately followed by an
+        update of z | A, W.
+        """
+        # Use the module trick to avoid copying globals
+        import pyhawkes.internals.parallel_adjacency_resampling as par
+        par.model = self.model
+        par.data = data
+
+        p = self._prior()[0]
+        if len(data) == 0:
+            self.A_edges = (np.random.rand(self.E) < p).astype(np.float64)
+            return
+
+        cols = [k2 for k2 in range(self.K) if self.indptr[k2+1] > self.indptr[k2]]
+        ps = [p[self.indptr[k2]:self.indptr[k2+1]] for k2 in cols]
+        if self.parallel_resampling:
+            A_cols = Parallel(n_jobs=-1, backend="multiprocessing")(
+                delayed(par._resample_candidates_of_column)(k2, pk)
+                for k2, pk in zip(cols, ps))
+        else:
+            A_cols = [par._resample_candidates_of_column(k2, pk)
+                      for k2, pk in zip(cols, ps)]
+
+        self.A_edges = np.concatenate(A_cols) if cols else np.zeros(0)
+
+
+class SparseGammaMixtureWeights(_CandidateEdgeWeights, GammaMixtureWeights):
+    """
+    Gamma mixture weights on a fixed set of candidate edges. The
+    variational parameters and expectations are length-E vectors;
+    off the candidate edges W is zero (and log W is -inf).
+    """
+    _versioned_params = ("A_edges", "W_edges", "mf_p",
+                         "mf_kappa_0", "mf_v_0", "mf_kappa_1", "mf_v_1")
+
+    def __init__(self, model, candidates, **kwargs):
+        """
+        :param candidates: the candidate edges, as accepted by
+                           pyhawkes.utils.utils.candidate_edges
+        """
+        self.candidates = candidates
+        super(SparseGammaMixtureWeights, self).__init__(model, **kwargs)
+
 
 class SpikeAndSlabContinuousTimeGammaWeights(GibbsSampling):
     """
@@ -12,15 +12,80 @@ from pybasicbayes.abstractions import ModelGibbsSampling, ModelMeanField
 from pybasicbayes.util.text import progprint_xrange
 
 from pyhawkes.internals.bias import GammaBias
-from pyhawkes.internals.weights import SpikeAndSlabGammaWeights, GammaMixtureWeights
+from pyhawkes.internals.weights import SpikeAndSlabGammaWeights, GammaMixtureWeights, \
+    SparseSpikeAndSlabGammaWeights, SparseGammaMixtureWeights
 from pyhawkes.internals.impulses import DirichletImpulseResponses
 from pyhawkes.internals.parents import DiscreteTimeParents
 from pyhawkes.internals.network import StochasticBlockModel, StochasticBlockModelFixedSparsity, ErdosRenyiFixedSparsity
 from pyhawkes.utils.basis import CosineBasis
+from pyhawkes.utils.parallel import DatasetPool
+from pyhawkes.utils.stability import SpectralRadiusTracker
+from pyhawkes.utils.utils import check_event_counts, compact_counts, event_counts
 
 
 # TODO: Add a simple HomogeneousPoissonProcessModel
 
+class _StandardHawkesData(object):
+    r"""
+    A data set for the standard Hawkes model. Besides the TxK event
+    counts S and the Tx(1+KxB) filtered inputs F, keep the column
+    sums of F and the rows of F where each process fired, since the
+    log likelihood of process k only depends on those:
+
+        \sum_t S_tk ln(F_t w_k) - dt (\sum_t F_t) w_k
+    """
+    def __init__(self, S, F):
+        self.S = S
+        self.F = F
+        self.T, self.K = S.shape
+
+        # Column sums of F give the integrated rate
+        self.Fsum = F.sum(axis=0)
+
+        # Save sparse versions of S and F. S may be dense or sparse;
+        # the events are sorted by process and then by time.
+        _, ts, ks, counts = event_counts(S)
+        offsets = np.searchsorted(ks, np.arange(self.K+1))
+        self.ts = []
+        self.Ss = []
+        self.Fs = []
+        for k in range(self.K):
+            tk = ts[offsets[k]:offsets[k+1]]
+            self.ts.append(tk)
+            self.Ss.append(counts[offsets[k]:offsets[k+1]].astype(np.float64))
+            self.Fs.append(F[tk])
+        self.Ns = np.array([Sk.sum() for Sk in self.Ss])
+
+        # Rows where any process has events and their counts
+        self.t_any = np.unique(ts)
+        self.S_any = np.zeros((len(self.t_any), self.K))
+        self.S_any[np.searchsorted(self.t_any, ts), ks] = counts
+
+    def __iter__(self):
+        # Allow unpacking as an (S, F) tuple
+        return iter((self.S, self.F))
+
+    def for_process(self, k):
+        """
+        Return a copy that only keeps the events of process k and the
+        column sums of F, which is all that the log likelihood of
+        process k and its gradient need. The other processes are left
+        without events, and the dense S and F are dropped.
+        """
+        data = _StandardHawkesData.__new__(_StandardHawkesData)
+        data.S = data.F = None
+        data.T, data.K = self.T, self.K
+        data.Fsum = self.Fsum
+        data.ts = [tk if j == k else tk[:0] for j, tk in enumerate(self.ts)]
+        data.Ss = [Sk if j == k else Sk[:0] for j, Sk in enumerate(self.Ss)]
+        data.Fs = [Fk if j == k else Fk[:0] for j, Fk in enumerate(self.Fs)]
+        data.Ns = self.Ns
+        data.t_any = self.ts[k]
+        data.S_any = np.zeros((len(data.t_any), self.K))
+        data.S_any[:,k] = self.Ss[k]
+        return data
+
+
 class DiscreteTimeStandardHawkesModel(object):
     """
     Discrete time standard Hawkes process model with support for
@@ -74,10 +139,23 @@ class DiscreteTimeStandardHawkesModel(object):
         # Initialize the data list to empty
         self.data_list = []
 
+        # Track the spectral radius of the weights across samples
+        self.stability_tracker = SpectralRadiusTracker()
+
+        # Number of SGD steps taken, used to schedule monitoring
+        self._sgd_itr = 0
+
     def _remove_self_weights(self):
         for k in range(self.K):
                 self.weights[k,1+(k*self.B):1+(k+1)*self.B] = 1e-32
 
+    def _self_weight_indices(self):
+        """
+        Indices into self.weights of the self connection weights
+        """
+        ks = np.arange(self.K)[:,None]
+        return ks, 1 + ks * self.B + np.arange(self.B)[None,:]
+
     def initialize_with_gibbs_model(self, gibbs_model):
         """
         Initialize with a sample from the network Hawkes model
@@ -90,7 +168,7 @@ class DiscreteTimeStandardHawkesModel(object):
         assert gibbs_model.B == self.B
 
         lambda0 = gibbs_model.bias_model.lambda0,
-        Weff = gibbs_model.weight_model.W_effective
+        Weff = gibbs_model.W_effective
         g = gibbs_model.impulse_model.g
 
         for k in range(self.K):
@@ -104,9 +182,9 @@ class DiscreteTimeStandardHawkesModel(object):
         if len(self.data_list) > 0:
             N = 0
             T = 0
-            for S,_ in self.data_list:
-                N += S.sum(axis=0)
-                T += S.shape[0] * self.dt
+            for data in self.data_list:
+                N += data.Ns
+                T += data.T * self.dt
 
             lambda0 = N / float(T)
             self.weights[:,0] = lambda0
@@ -154,12 +232,10 @@ class DiscreteTimeStandardHawkesModel(object):
         then instantiate a set of parents for this data set.
 
         :param S: a TxK matrix of of event counts for each time bin
-                  and each process.
+                  and each process. This may also be a scipy.sparse
+                  matrix or a tuple of (t, k, count) triplets.
         """
-        assert isinstance(S, np.ndarray) and S.ndim == 2 and S.shape[1] == self.K \
-               and np.amin(S) >= 0 and S.dtype == np.int, \
-               "Data must be a TxK array of event counts"
-
+        S = check_event_counts(S, self.K)
         T = S.shape[0]
 
         if F is None:
@@ -186,26 +262,22 @@ class DiscreteTimeStandardHawkesModel(object):
                 F_mb = F[offset:end,:]
 
                 # Add minibatch to the data list
-                self.data_list.append((S_mb, F_mb))
+                self.data_list.append(_StandardHawkesData(S_mb, F_mb))
 
         else:
-            self.data_list.append((S,F))
+            self.data_list.append(_StandardHawkesData(S, F))
 
-    def check_stability(self):
+    def check_stability(self, verbose=False):
         """
         Check that the weight matrix is stable
 
         :return:
         """
-        # Compute the effective weight matrix
-        W_eff = self.weights.sum(axis=2)
-        eigs = np.linalg.eigvals(W_eff)
-        maxeig = np.amax(np.real(eigs))
-        # print "Max eigenvalue: ", maxeig
-        if maxeig < 1.0:
-            return True
-        else:
-            return False
+        W = self.W
+        if verbose:
+            print("Max eigenvalue: ", self.stability_tracker.spectral_radius(W))
+
+        return self.stability_tracker.is_stable(W)
 
     def copy_sample(self):
         """
@@ -225,6 +297,20 @@ class DiscreteTimeStandardHawkesModel(object):
         self.data_list = data_list
         return model_copy
 
+    def _copy_for_process(self, k):
+        """
+        Return a copy of the model whose data sets only keep what is
+        needed to fit the k-th process, so that it can be sent to a
+        worker process without the dense data of the others.
+        """
+        data_list = self.data_list
+        self.data_list = []
+        model_copy = copy.deepcopy(self)
+        self.data_list = data_list
+
+        model_copy.data_list = [data.for_process(k) for data in data_list]
+        return model_copy
+
     def compute_rate(self, index=None, ks=None):
         """
         Compute the rate of the k-th process.
@@ -235,7 +321,7 @@ class DiscreteTimeStandardHawkesModel(object):
         """
         if index is None:
             index = 0
-        _,F = self.data_list[index]
+        F = self.data_list[index].F
 
         if ks is None:
             ks = np.arange(self.K)
@@ -253,6 +339,17 @@ class DiscreteTimeStandardHawkesModel(object):
         else:
             raise Exception("ks must be int or array of indices in 0..K-1")
 
+    def compute_rate_at_events(self, index, k):
+        """
+        Compute the rate of the k-th process in the time bins
+        where it has events.
+
+        :param index:   Which dataset to compute the rate of
+        :param k:       Which process to compute the rate of
+        :return:        Length N_k array of rates
+        """
+        return self.data_list[index].Fs[k].dot(self.weights[k,:])
+
     def log_prior(self, ks=None):
         """
         Compute the log prior probability of log W
@@ -270,7 +367,9 @@ class DiscreteTimeStandardHawkesModel(object):
 
     def log_likelihood(self, indices=None, ks=None):
         """
-        Compute the log likelihood
+        Compute the log likelihood. Only the time bins with events
+        contribute to the log rate term, and the integrated rate is
+        given by the column sums of F.
         :return:
         """
         ll = 0
@@ -280,14 +379,17 @@ class DiscreteTimeStandardHawkesModel(object):
         if isinstance(indices, int):
             indices = [indices]
 
-        for index in indices:
-            S,F = self.data_list[index]
-            R = self.compute_rate(index, ks=ks)
+        if ks is None:
+            ks = np.arange(self.K)
+        if isinstance(ks, int):
+            ks = [ks]
 
-            if ks is not None:
-                ll += (S[:,ks] * np.log(R) -R*self.dt).sum()
-            else:
-                ll += (S * np.log(R) -R*self.dt).sum()
+        for index in indices:
+            data = self.data_list[index]
+            for k in ks:
+                R = self.compute_rate_at_events(index, k)
+                ll += (data.Ss[k] * np.log(R)).sum()
+                ll -= self.dt * data.Fsum.dot(self.weights[k,:])
 
         return ll
 
@@ -320,12 +422,16 @@ class DiscreteTimeStandardHawkesModel(object):
 
         # d_W_d_log_W = self._d_W_d_logW(k)
         for index in indices:
+            # The rate at the event times contributes S*ln(R)
             d_rate_d_W = self._d_rate_d_W(index, k)
             # d_rate_d_log_W = d_rate_d_W.dot(d_W_d_log_W)
             d_ll_d_rate = self._d_ll_d_rate(index, k)
             # d_ll_d_log_W = d_ll_d_rate.dot(d_rate_d_log_W)
             d_ll_d_W = d_ll_d_rate.dot(d_rate_d_W)
 
+            # The integrated rate contributes -dt * sum_t F_t w
+            d_ll_d_W -= self.dt * self.data_list[index].Fsum
+
             # grad += d_ll_d_log_W
             grad += d_ll_d_W
 
@@ -346,17 +452,20 @@ class DiscreteTimeStandardHawkesModel(object):
         return grad
 
     def _d_ll_d_rate(self, index, k):
-        S,_ = self.data_list[index]
-        T = S.shape[0]
+        """
+        Gradient of S*ln(R) with respect to the rate in the
+        time bins where process k has events. The -R*dt term
+        is accounted for by the column sums of F.
+        """
+        Sk = self.data_list[index].Ss[k]
 
-        rate = self.compute_rate(index, k)
-        # d/dR  S*ln(R) -R*dt
-        grad = S[:,k] / rate  - self.dt * np.ones(T)
+        rate = self.compute_rate_at_events(index, k)
+        # d/dR  S*ln(R)
+        grad = Sk / rate
         return grad
 
     def _d_rate_d_W(self, index, k):
-        _,F = self.data_list[index]
-        grad = F
+        grad = self.data_list[index].Fs[k]
         return grad
 
     def _d_W_d_logW(self, k):
@@ -402,125 +511,222 @@ class DiscreteTimeStandardHawkesModel(object):
         d_log_prior_d_W[1:] += -self.beta
         return d_log_prior_d_W
 
-    def fit_with_bfgs_logspace(self):
+    def compute_gradients(self, indices=None):
         """
-        Fit the model with BFGS
+        Compute the gradient of the log posterior with respect to the
+        weights of all K processes at once. For each data set, the rates
+        in the time bins with any events are computed with one matrix
+        product and the gradient of S*ln(R) with another.
+
+        :return: K x (1+KxB) matrix of gradients
+        """
+        if indices is None:
+            indices = np.arange(len(self.data_list))
+
+        # Gradient of the gamma prior, see _d_log_prior_d_W
+        grad = np.zeros_like(self.weights)
+        if self.alpha > 1.0:
+            grad[:,1:] += (self.alpha-1) / self.weights[:,1:]
+        grad[:,1:] += -self.beta
+
+        for index in indices:
+            data = self.data_list[index]
+            F, S = data.F[data.t_any], data.S_any
+            R = F.dot(self.weights.T)
+            grad += (S / R).T.dot(F)
+            grad -= self.dt * data.Fsum[None,:]
+
+        # Zero out the gradient of the self connections
+        if not self.allow_self_connections:
+            grad[self._self_weight_indices()] = 0
+
+        return grad
+
+    def log_posterior_and_gradient(self, k, indices=None):
+        """
+        Compute the log posterior of the k-th process and its gradient
+        with respect to the weights in a single pass over the data,
+        reusing the rate at the event times for both.
+
+        :param k:   Which process to compute the objective for.
+        :return:    (log posterior, gradient)
+        """
+        if indices is None:
+            indices = np.arange(len(self.data_list))
+
+        w = self.weights[k,:]
+        lp = self.log_prior(ks=[k])
+        grad = self._d_log_prior_d_W(k)
+
+        for index in indices:
+            data = self.data_list[index]
+            Sk, Fk = data.Ss[k], data.Fs[k]
+            R = Fk.dot(w)
+
+            # S*ln(R) at the event times minus the integrated rate
+            lp += (Sk * np.log(R)).sum() - self.dt * data.Fsum.dot(w)
+            grad += (Sk / R).dot(Fk) - self.dt * data.Fsum
+
+        # Zero out the gradient of the self connections
+        if not self.allow_self_connections:
+            grad[1+k*self.B:1+(k+1)*self.B] = 0
+
+        return lp, grad
+
+    def _fit_process_with_bfgs(self, k, logspace=False,
+                               verbose=True, print_interval=10):
+        """
+        Fit the weights of the k-th process with BFGS. The objective
+        returns the negative log posterior and its gradient, and the last
+        value it computed is reused for printing progress.
+
+        :return: The fitted weights of the k-th process
         """
-        # If W_max is specified, set this as a bound
-        if self.W_max is not None:
-            bnds = [(None, None)] + [(None, np.log(self.W_max))] * (self.K * self.B)
+        if logspace:
+            # If W_max is specified, set this as a bound
+            if self.W_max is not None:
+                bnds = [(None, None)] + [(None, np.log(self.W_max))] * (self.K * self.B)
+            else:
+                bnds = None
+
+            def objective(x):
+                self.weights[k,:] = np.exp(x)
+                self.weights[k,:] = np.nan_to_num(self.weights[k,:])
+                lp, dlp_dW = self.log_posterior_and_gradient(k)
+
+                # Chain rule: dW/d(log W) = W
+                return np.nan_to_num(-lp), np.nan_to_num(-dlp_dW * self.weights[k,:])
+
+            x0 = np.log(self.weights[k,:])
+
         else:
-            bnds = None
+            # If W_max is specified, set this as a bound
+            if self.W_max is not None:
+                bnds = [(1e-16, None)] + [(1e-16, self.W_max)] * (self.K * self.B)
+            else:
+                bnds = [(1e-16, None)] * (1 + self.K * self.B)
+
+            def objective(x):
+                self.weights[k,:] = x
+                lp, grad = self.log_posterior_and_gradient(k)
+                return np.nan_to_num(-lp), np.nan_to_num(-grad)
 
-        def objective(x, k):
-            self.weights[k,:] = np.exp(x)
-            self.weights[k,:] = np.nan_to_num(self.weights[k,:])
-            return np.nan_to_num(-self.log_posterior(ks=np.array([k])))
+            x0 = self.weights[k,:].copy()
 
-        def gradient(x, k):
-            self.weights[k,:] = np.exp(x)
-            self.weights[k,:] = np.nan_to_num(self.weights[k,:])
-            dll_dW =  -self.compute_gradient(k)
-            d_W_d_log_W = self._d_W_d_logW(k)
-            return np.nan_to_num(dll_dW.dot(d_W_d_log_W))
+        last_lp = [None]
+        def fused_objective(x):
+            value, grad = objective(x)
+            last_lp[0] = -value
+            return value, grad
 
         itr = [0]
         def callback(x):
-            if itr[0] % 10 == 0:
-                print("Iteration: %03d\t LP: %.1f" % (itr[0], self.log_posterior()))
+            if itr[0] % print_interval == 0:
+                print("Iteration: %03d\t LP: %.1f" % (itr[0], last_lp[0]))
             itr[0] = itr[0] + 1
 
-        for k in range(self.K):
+        if verbose:
             print("Optimizing process ", k)
-            itr[0] = 0
-            x0 = np.log(self.weights[k,:])
-            res = minimize(objective,           # Objective function
-                           x0,                  # Initial value
-                           jac=gradient,        # Gradient of the objective
-                           args=(k,),           # Arguments to the objective and gradient fns
-                           bounds=bnds,         # Bounds on x
-                           callback=callback)
-            self.weights[k,:] = np.exp(res.x)
+        res = minimize(fused_objective,     # Objective function and gradient
+                       x0,                  # Initial value
+                       jac=True,            # Objective also returns the gradient
+                       bounds=bnds,         # Bounds on x
+                       callback=callback if verbose else None)
 
-    def fit_with_bfgs(self):
+        self.weights[k,:] = np.exp(res.x) if logspace else res.x
+        return self.weights[k,:]
+
+    def _fit_all_with_bfgs(self, n_jobs=1, **kwargs):
         """
-        Fit the model with BFGS
+        Fit each process with BFGS. The K problems are independent given
+        the filtered data, so they can be distributed across n_jobs
+        worker processes (n_jobs=-1 uses all cores).
         """
-        # If W_max is specified, set this as a bound
-        if self.W_max is not None:
-            bnds = [(1e-16, None)] + [(1e-16, self.W_max)] * (self.K * self.B)
+        if n_jobs == 1:
+            for k in range(self.K):
+                self._fit_process_with_bfgs(k, **kwargs)
+
         else:
-            bnds = [(1e-16, None)] * (1 + self.K * self.B)
+            from pyhawkes.internals.parallel_bfgs_fitting import \
+                fit_in_parallel, _fit_standard_process
 
-        def objective(x, k):
-            self.weights[k,:] = x
-            return np.nan_to_num(-self.log_posterior(ks=np.array([k])))
+            # Each task only gets the events of its own process, and the
+            # workers do not print since their output would interleave
+            kwargs["verbose"] = False
+            weights = fit_in_parallel(_fit_standard_process,
+                                      ((self._copy_for_process(k), k)
+                                       for k in range(self.K)),
+                                      n_jobs, **kwargs)
+            self.weights = np.array(weights)
 
-        def gradient(x, k):
-            self.weights[k,:] = x
-            return np.nan_to_num(-self.compute_gradient(k))
+    def fit_with_bfgs_logspace(self, n_jobs=1, verbose=True, print_interval=10):
+        """
+        Fit the model with BFGS
+        """
+        self._fit_all_with_bfgs(n_jobs=n_jobs, logspace=True,
+                                verbose=verbose, print_interval=print_interval)
 
-        itr = [0]
-        def callback(x):
-            if itr[0] % 10 == 0:
-                print("Iteration: %03d\t LP: %.1f" % (itr[0], self.log_posterior()))
-            itr[0] = itr[0] + 1
+    def fit_with_bfgs(self, n_jobs=1, verbose=True, print_interval=10):
+        """
+        Fit the model with BFGS
+        """
+        self._fit_all_with_bfgs(n_jobs=n_jobs, logspace=False,
+                                verbose=verbose, print_interval=print_interval)
 
-        for k in range(self.K):
-            print("Optimizing process ", k)
-            itr[0] = 0
-            x0 = self.weights[k,:]
-            res = minimize(objective,           # Objective function
-                           x0,                  # Initial value
-                           jac=gradient,        # Gradient of the objective
-                           args=(k,),           # Arguments to the objective and gradient fns
-                           bounds=bnds,         # Bounds on x
-                           callback=callback)
-            self.weights[k,:] = res.x
-
-    def gradient_descent_step(self, stepsz=0.01):
-        grad = np.zeros((self.K, 1+self.K*self.B))
-
-        # Compute gradient and take a step for each process
-        for k in range(self.K):
-            d_W_d_log_W = self._d_W_d_logW(k)
-            grad[k,:] = self.compute_gradient(k).dot(d_W_d_log_W)
-            self.weights[k,:] = np.exp(np.log(self.weights[k,:]) + stepsz * grad[k,:])
+    def gradient_descent_step(self, stepsz=0.01, monitor=True):
+        """
+        Take a step of gradient descent in log weight space for all
+        processes at once. If monitor is False, skip computing the
+        log likelihood and return None in its place.
+        """
+        # Chain rule: dW/d(log W) = W
+        grad = self.compute_gradients() * self.weights
+
+        # Gradient steps are taken in log weight space
+        self.weights *= np.exp(stepsz * grad)
 
         # Compute the current objective
-        ll = self.log_likelihood()
+        ll = self.log_likelihood() if monitor else None
 
         return self.weights, ll, grad
 
-    def sgd_step(self, prev_velocity, learning_rate, momentum):
+    def sgd_step(self, prev_velocity, learning_rate, momentum,
+                 monitor_interval=1, monitor_fraction=1.0):
         """
-        Take a step of the stochastic gradient descent algorithm
+        Take a step of the stochastic gradient descent algorithm on a
+        randomly chosen data set (minibatch), in log weight space.
+
+        The log likelihood requires a pass over all the data, so it is only
+        computed every monitor_interval steps (never if None), and then on a
+        random fraction monitor_fraction of the data sets, scaled up to
+        estimate the log likelihood of all the data. On the other steps
+        None is returned in its place.
         """
         if prev_velocity is None:
             prev_velocity = np.zeros((self.K, 1+self.K*self.B))
 
-        # Compute this gradient row by row
-        grad = np.zeros((self.K, 1+self.K*self.B))
-        velocity = np.zeros((self.K, 1+self.K*self.B))
-
         # Get a minibatch
         mb = np.random.choice(len(self.data_list))
-        T = self.data_list[mb][0].shape[0]
+        T = self.data_list[mb].T
 
-        # Compute gradient and take a step for each process
-        for k in range(self.K):
-            d_W_d_log_W = self._d_W_d_logW(k)
-            grad[k,:] = self.compute_gradient(k, indices=[mb]).dot(d_W_d_log_W) / T
-            velocity[k,:] = momentum * prev_velocity[k,:] + learning_rate * grad[k,:]
-
-            # Gradient steps are taken in log weight space
-            log_weightsk = np.log(self.weights[k,:]) + velocity[k,:]
+        # Compute the gradients of all processes. Chain rule: dW/d(log W) = W
+        grad = self.compute_gradients(indices=[mb]) * self.weights / T
+        velocity = momentum * prev_velocity + learning_rate * grad
 
-            # The true weights are stored
-            self.weights[k,:] = np.exp(log_weightsk)
+        # Gradient steps are taken in log weight space
+        self.weights *= np.exp(velocity)
 
         # Compute the current objective
-        ll = self.log_likelihood()
+        ll = None
+        if monitor_interval and self._sgd_itr % monitor_interval == 0:
+            M = len(self.data_list)
+            if monitor_fraction < 1.0:
+                n = max(1, int(round(monitor_fraction * M)))
+                indices = np.random.choice(M, size=n, replace=False)
+                ll = self.log_likelihood(indices=indices) * M / float(n)
+            else:
+                ll = self.log_likelihood()
+        self._sgd_itr += 1
 
         return self.weights, ll, velocity
 
@@ -546,6 +752,7 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
 
     # Weight, parent, and network class must be specified by subclasses
     _weight_class           = None
+    _sparse_weight_class    = None
     _default_weight_hypers  = {}
 
     _parent_class           = DiscreteTimeParents
@@ -558,19 +765,35 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
                  bkgd=None, bkgd_hypers={},
                  impulse=None, impulse_hypers={},
                  weights=None, weight_hypers={},
-                 network=None, network_hypers={}):
+                 network=None, network_hypers={},
+                 dtype=np.float64, n_threads=1):
         """
         Initialize a discrete time network Hawkes model with K processes.
 
         :param K:  Number of processes
+        :param dtype: Floating point type used to store the filtered data
+                      and the variational parents. With np.float32 the
+                      event counts are also stored as uint16/uint32, while
+                      sums and rates are still accumulated in double precision.
+        :param n_threads: Number of threads used to update the parents of
+                          different data sets and to compute their sufficient
+                          statistics, or None to use one per core.
         """
         self.K      = K
         self.dt     = dt
         self.dt_max = dt_max
         self.B      = B
 
+        self.dtype  = np.dtype(dtype)
+        assert self.dtype in (np.float32, np.float64), \
+            "dtype must be np.float32 or np.float64"
+
         # Initialize the data list to empty
         self.data_list = []
+        self.data_pool = DatasetPool(n_threads)
+
+        # Track the spectral radius of the weights across samples
+        self.stability_tracker = SpectralRadiusTracker()
 
         # Initialize the basis
         if basis is not None:
@@ -628,21 +851,30 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         else:
             self.weight_hypers = copy.deepcopy(self._default_weight_hypers)
             self.weight_hypers.update(weight_hypers)
-            self.weight_model = self._weight_class(self, **self.weight_hypers)
 
+            # Restrict the weights to a set of candidate edges
+            # if they are given in the weight hyperparameters
+            if self.weight_hypers.get("candidates") is not None:
+                assert self._sparse_weight_class is not None, \
+                    "Candidate edges are not supported by this model"
+                self.weight_model = self._sparse_weight_class(self, **self.weight_hypers)
+            else:
+                self.weight_model = self._weight_class(self, **self.weight_hypers)
 
-    # Expose basic variables
+
+    # Expose basic variables as KxK arrays, even if the weight
+    # model only stores its candidate edges
     @property
     def A(self):
-        return self.weight_model.A
+        return self.weight_model.as_dense(self.weight_model.A)
 
     @property
     def W(self):
-        return self.weight_model.W
+        return self.weight_model.as_dense(self.weight_model.W)
 
     @property
     def W_effective(self):
-        return self.weight_model.W_effective
+        return self.weight_model.as_dense(self.weight_model.W_effective)
 
     @property
     def lambda0(self):
@@ -716,20 +948,23 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         then instantiate a set of parents for this data set.
 
         :param S: a TxK matrix of of event counts for each time bin
-                  and each process.
+                  and each process. This may also be a scipy.sparse
+                  matrix or a tuple of (t, k, count) triplets.
         """
-        assert isinstance(S, np.ndarray) and S.ndim == 2 and S.shape[1] == self.K \
-               and np.amin(S) >= 0 and S.dtype == np.int, \
-               "Data must be a TxK array of event counts"
-
+        S = check_event_counts(S, self.K)
         T = S.shape[0]
 
         # Filter the data into a TxKxB array
         if F is not None:
             assert isinstance(F, np.ndarray) and F.shape == (T, self.K, self.B), \
                 "F must be a filtered event count matrix"
+            F = F.astype(self.dtype, copy=False)
         else:
-            F = self.basis.convolve_with_basis(S)
+            F = self.basis.convolve_with_basis(S, dtype=self.dtype)
+
+        # In compact mode, store the counts with a small unsigned type too
+        if self.dtype != np.float64:
+            S = compact_counts(S)
 
         # If minibatchsize is not None, add minibatches of data
         if minibatchsize is not None:
@@ -758,17 +993,16 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
 
         :return:
         """
-        if self.K < 100:
-            eigs = np.linalg.eigvals(self.weight_model.W_effective)
-            maxeig = np.amax(np.real(eigs))
+        # Use the sparse weights of models restricted to candidate edges
+        if hasattr(self.weight_model, "W_effective_sparse"):
+            W = self.weight_model.W_effective_sparse
         else:
-            from scipy.sparse.linalg import eigs
-            maxeig = eigs(self.weight_model.W_effective, k=1)[0]
+            W = self.weight_model.W_effective
 
         if verbose:
-            print("Max eigenvalue: ", maxeig)
+            print("Max eigenvalue: ", self.stability_tracker.spectral_radius(W))
 
-        return maxeig < 1.0
+        return self.stability_tracker.is_stable(W)
 
     def copy_sample(self):
         """
@@ -808,7 +1042,7 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         G = np.tensordot(self.basis.basis, self.impulse_model.g, axes=([1], [2]))
         L = self.basis.L
         assert G.shape == (L,self.K, self.K)
-        H = self.weight_model.W_effective[None,:,:] * G
+        H = self.W_effective[None,:,:] * G
 
         # Transpose H so that it is faster for tensor mult
         H = np.transpose(H, axes=[0,2,1])
@@ -857,8 +1091,8 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         Get a copy of the parameters of the model
         :return:
         """
-        return self.weight_model.A, \
-               self.weight_model.W, \
+        return self.A, \
+               self.W, \
                self.impulse_model.g, \
                self.bias_model.lambda0, \
                self.network.p, \
@@ -907,20 +1141,21 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         """
         # TODO: Write a Cython function to evaluate this
         if S is not None:
-            assert isinstance(S, np.ndarray) and S.ndim == 2, "S must be a TxK array."
+            S = check_event_counts(S, self.K)
             T,K = S.shape
 
             # Filter the data into a TxKxB array
             if F is not None:
                 assert F.shape == (T,K, self.B)
             else:
-                F = self.basis.convolve_with_basis(S)
+                F = self.basis.convolve_with_basis(S, dtype=self.dtype)
 
         else:
             assert len(self.data_list) > index, "Dataset %d does not exist!" % index
             data = self.data_list[index]
             T,K,S,F = data.T, data.K, data.S, data.F
 
+        weight_model = self.weight_model
         if proc is None:
             # Compute the rate
             R = np.zeros((T,K))
@@ -928,14 +1163,17 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
             # Background rate
             R += self.bias_model.lambda0[None,:]
 
-            # Compute the sum of weighted sum of impulse responses
-            H = self.weight_model.W_effective[:,:,None] * \
-                self.impulse_model.g
+            # Compute the sum of weighted sum of impulse responses of the
+            # edges, H[e,b] = W[k1,k2] * g[k1,k2,b] for the edge e = (k1,k2)
+            H = weight_model.W_effective_edges[:,None] * \
+                self.impulse_model.g[weight_model.rows, weight_model.cols]
 
-            H = np.transpose(H, [2,0,1])
+            # Match the precision of F so that it is not upcast to a copy
+            H = H.astype(F.dtype)
 
             for k2 in range(self.K):
-                R[:,k2] += np.tensordot(F, H[:,:,k2], axes=([2,1], [0,1]))
+                edges, k1s = weight_model._edges_into(k2)
+                R[:,k2] += np.tensordot(F[:,k1s,:], H[edges], axes=([1,2], [0,1]))
 
             return R
 
@@ -948,10 +1186,11 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
             R += self.bias_model.lambda0[proc]
 
             # Compute the sum of weighted sum of impulse responses
-            H = self.weight_model.W_effective[:,proc,None] * \
-                self.impulse_model.g[:,proc,:]
+            edges, k1s = weight_model._edges_into(proc)
+            H = weight_model.W_effective_edges[edges,None] * \
+                self.impulse_model.g[k1s,proc,:]
 
-            R += np.tensordot(F, H, axes=([1,2], [0,1]))
+            R += np.tensordot(F[:,k1s,:], H.astype(F.dtype), axes=([1,2], [0,1]))
 
             return R
 
@@ -959,11 +1198,16 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         """
         Compute the log likelihood of a Poisson matrix with rates R
 
-        :param S:   Count matrix
+        :param S:   Count matrix, dense or sparse
         :param R:   Rate matrix
         :return:    log likelihood
         """
-        return (S * np.log(R) - R*self.dt).sum()
+        if isinstance(S, np.ndarray):
+            return (S * np.log(R) - R*self.dt).sum()
+
+        # Only the time bins with events contribute to the log rate term
+        _, t, k, counts = event_counts(S)
+        return (counts * np.log(R[t,k])).sum() - R.sum() * self.dt
 
     def heldout_log_likelihood(self, S, F=None):
         """
@@ -971,6 +1215,7 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         :param S:   TxK matrix of event counts
         :return:    log likelihood of those counts under the current model
         """
+        S = check_event_counts(S, self.K)
         R = self.compute_rate(S=S, F=F)
         return self._poisson_log_likelihood(S, R)
 
@@ -1003,8 +1248,8 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
             indices = [indices]
 
         # Get the likelihood of the datasets
-        for ind in indices:
-            ll += self.data_list[ind].log_likelihood()
+        ll += sum(self.data_pool.map(lambda ind: self.data_list[ind].log_likelihood(),
+                                     indices))
 
         return ll
 
@@ -1145,7 +1390,7 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
         rates = self.compute_rate(data_index)
         S = data.S
         T_slice = T_slice if T_slice is not None else (0,data.T)
-        ymax = np.max(S[T_slice[0]:T_slice[1],:])
+        ymax = S[T_slice[0]:T_slice[1],:].max()
 
         if lns is None:
             lns = []
@@ -1171,10 +1416,11 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
                 lns.append(ln)
 
             if draw_events:
+                _, ts, ks, counts = event_counts(S)
                 for k in range(self.K):
                     # Get event times and counts
-                    tk = np.nonzero(data.S[:,k])[0]
-                    ck = data.S[tk,k]
+                    tk = ts[ks == k]
+                    ck = counts[ks == k]
 
                     # Stem plot
                     axs[k].stem(tk+self.dt/2., ck, '-k', markerfmt="ko", lw=2)
@@ -1188,6 +1434,7 @@ class _DiscreteTimeNetworkHawkesModelBase(object):
 
 class DiscreteTimeNetworkHawkesModelSpikeAndSlab(_DiscreteTimeNetworkHawkesModelBase, ModelGibbsSampling):
     _weight_class           = SpikeAndSlabGammaWeights
+    _sparse_weight_class    = SparseSpikeAndSlabGammaWeights
     _default_weight_hypers  = {}
 
     _network_class          = ErdosRenyiFixedSparsity
@@ -1203,8 +1450,7 @@ class DiscreteTimeNetworkHawkesModelSpikeAndSlab(_DiscreteTimeNetworkHawkesModel
         """
         # Update the parents.
         # THIS MUST BE DONE IMMEDIATELY FOLLOWING WEIGHT UPDATES!
-        for p in self.data_list:
-            p.resample()
+        self.data_pool.map(lambda p: p.resample(), self.data_list)
 
         # Update the bias model given the parents assigned to the background
         self.bias_model.resample(self.data_list)
@@ -1213,7 +1459,7 @@ class DiscreteTimeNetworkHawkesModelSpikeAndSlab(_DiscreteTimeNetworkHawkesModel
         self.impulse_model.resample(self.data_list)
 
         # Update the network model
-        self.network.resample(data=(self.weight_model.A, self.weight_model.W))
+        self.network.resample(data=(self.weight_model.A_sparse, self.weight_model.W_sparse))
 
         # Update the weight model given the parents assignments
         self.weight_model.resample(self.data_list)
@@ -1240,6 +1486,7 @@ class DiscreteTimeNetworkHawkesModelSpikeAndSlabSBM(DiscreteTimeNetworkHawkesMod
 class DiscreteTimeNetworkHawkesModelGammaMixture(
     _DiscreteTimeNetworkHawkesModelBase, ModelGibbsSampling, ModelMeanField):
     _weight_class           = GammaMixtureWeights
+    _sparse_weight_class    = SparseGammaMixtureWeights
     _default_weight_hypers  = {'kappa_0': 0.1, 'nu_0': 1000.0}
 
     _network_class          = ErdosRenyiFixedSparsity
@@ -1254,8 +1501,7 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
         :return:
         """
         # Update the parents.
-        for p in self.data_list:
-            p.resample()
+        self.data_pool.map(lambda p: p.resample(), self.data_list)
 
         # Update the bias model given the parents assigned to the background
         self.bias_model.resample(self.data_list)
@@ -1268,7 +1514,7 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
 
         # Update the network model
         if resample_network:
-            self.network.resample(data=(self.weight_model.A, self.weight_model.W))
+            self.network.resample(data=(self.weight_model.A_sparse, self.weight_model.W_sparse))
 
     def initialize_with_standard_model(self, standard_model):
         super(DiscreteTimeNetworkHawkesModelGammaMixture, self).\
@@ -1279,13 +1525,7 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
         self.bias_model.mf_beta  = 100 * np.ones(self.K)
 
         # Weight model
-        self.weight_model.mf_kappa_0 = self.weight_model.nu_0 * self.weight_model.W.copy()
-        self.weight_model.mf_v_0     = self.weight_model.nu_0 * np.ones((self.K, self.K))
-
-        self.weight_model.mf_kappa_1 = 100 * self.weight_model.W.copy()
-        self.weight_model.mf_v_1     = 100 * np.ones((self.K, self.K))
-
-        self.weight_model.mf_p       = 0.8 * self.weight_model.A + 0.2 * (1-self.weight_model.A)
+        self.weight_model.initialize_from_sample()
 
         # Set mean field parameters of the impulse model
         self.impulse_model.mf_gamma = 100 * self.impulse_model.g.copy('C')
@@ -1303,10 +1543,29 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
         #     p.resample(self.bias_model, self.weight_model, self.impulse_model)
         #     p.meanfieldupdate(self.bias_model, self.weight_model, self.impulse_model)
 
-    def meanfield_coordinate_descent_step(self):
+    def meanfield_coordinate_descent_step(self, fast_vlb=True):
+        """
+        Perform one round of mean field coordinate ascent and return the VLB.
+
+        :param fast_vlb: If True (default), the parents' part of the VLB is
+                         accumulated while the parents are updated, and the
+                         returned VLB is that of the model right after the
+                         parent update, i.e. before the global parameters are
+                         updated in this step. This saves a full pass over the
+                         data per step and is still a lower bound that
+                         increases monotonically over iterations. If False,
+                         the VLB is computed with get_vlb after the update.
+        """
         # Update the parents.
-        for p in self.data_list:
-            p.meanfieldupdate()
+        parent_vlbs = self.data_pool.map(
+            lambda p: p.meanfieldupdate(compute_vlb=fast_vlb), self.data_list)
+
+        if fast_vlb:
+            vlb = sum(parent_vlbs)
+            vlb += self.bias_model.get_vlb()
+            vlb += self.impulse_model.get_vlb()
+            vlb += self.weight_model.get_vlb()
+            vlb += self.network.get_vlb()
 
         # Update the bias model given the parents assigned to the background
         self.bias_model.meanfieldupdate(self.data_list)
@@ -1320,13 +1579,14 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
         # Update the network model
         self.network.meanfieldupdate(self.weight_model)
 
+        if fast_vlb:
+            return vlb
         return self.get_vlb()
 
     def get_vlb(self):
         # Compute the variational lower bound
         vlb = 0
-        for d in self.data_list:
-            vlb += d.get_vlb()
+        vlb += sum(self.data_pool.map(lambda d: d.get_vlb(), self.data_list))
 
         vlb += self.bias_model.get_vlb()
         vlb += self.impulse_model.get_vlb()
@@ -1334,30 +1594,73 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
         vlb += self.network.get_vlb()
         return vlb
 
-    def sgd_step(self, minibatchsize, stepsize):
-        # Sample a minibatch of data
-        assert len(self.data_list) == 1, "We only sample from the first data set"
-        S, F, T = self.data_list[0].S, self.data_list[0].F, self.data_list[0].T
+    def _exp_expected_log_Wg(self):
+        """
+        Get exp(E[log W[k1,k2]] + E[log g[k1,k2,b]]) as an (E,B) array
+        over the edges e = (k1,k2) of the weight model for the mean field
+        parent updates. It is shared by all data sets and cached until
+        the weight or impulse response model changes.
+        """
+        weight_model = self.weight_model
+        key = (weight_model.version, self.impulse_model.version)
+        cache = getattr(self, "_exp_E_log_Wg_cache", None)
+        if cache is None or cache[0] != key:
+            E_log_g = self.impulse_model.expected_log_g()
+            exp_E_log_Wg = np.exp(weight_model.expected_log_W_edges()[:,None] +
+                                  E_log_g[weight_model.rows, weight_model.cols])
+            cache = (key, exp_E_log_Wg)
+            self._exp_E_log_Wg_cache = cache
+
+        return cache[1]
+
+    def _sgd_minibatch_probs(self, minibatchsize, proportional):
+        """
+        Get the probability of sampling each minibatch of each data set,
+        along with the data set and minibatch indices. These only depend
+        on the lengths of the data sets, so they are cached until the
+        data list changes.
+        """
+        key = (minibatchsize, proportional, tuple(id(d) for d in self.data_list))
+        cache = getattr(self, "_sgd_cache", None)
+        if cache is None or cache[0] != key:
+            probs, datasets, indices = [], [], []
+            for d, data in enumerate(self.data_list):
+                Ts = np.array([p.T for p in data.minibatches(minibatchsize)], dtype=np.float64)
+                if proportional:
+                    probs.append(Ts)
+                else:
+                    probs.append(np.ones_like(Ts) / len(Ts))
+                datasets.append(d * np.ones(len(Ts), dtype=np.int64))
+                indices.append(np.arange(len(Ts)))
 
-        if not hasattr(self, 'sgd_offset'):
-            self.sgd_offset = 0
-        else:
-            self.sgd_offset += minibatchsize
-            if self.sgd_offset >= T:
-                self.sgd_offset = 0
+            probs = np.concatenate(probs)
+            cache = (key, probs / probs.sum(), np.concatenate(datasets), np.concatenate(indices))
+            self._sgd_cache = cache
 
-        # Grab a slice of S
-        sgd_end = min(self.sgd_offset+minibatchsize, T)
-        S_minibatch = S[self.sgd_offset:sgd_end, :]
-        F_minibatch = F[self.sgd_offset:sgd_end, :, :]
-        T_minibatch = S_minibatch.shape[0]
-        minibatchfrac = float(T_minibatch) / T
+        return cache[1:]
 
-        # Create a parent object for this minibatch
-        p = self._parent_class(self, T_minibatch, S_minibatch, F_minibatch)
+    def sgd_step(self, minibatchsize, stepsize, proportional=True):
+        """
+        Take a stochastic variational inference step on a minibatch of
+        minibatchsize consecutive time bins, sampled at random from all
+        the data sets in the data list.
 
-        # TODO: Grab one dataset from the data_list and assume
-        # it has been added in minibatches
+        :param proportional: If True, sample the minibatches in proportion
+                             to their length, so every time bin is equally
+                             likely to be in the minibatch. Otherwise, pick
+                             a data set uniformly at random and then one of
+                             its minibatches.
+        """
+        # The minibatch parents are views into the data sets that are
+        # created on the first step and reused afterward
+        probs, datasets, indices = self._sgd_minibatch_probs(minibatchsize, proportional)
+        i = np.random.choice(len(probs), p=probs)
+        p = self.data_list[datasets[i]].minibatches(minibatchsize)[indices[i]]
+
+        # The expected statistics of the minibatch are scaled up by the inverse
+        # of its sampling probability. With proportional sampling, this is the
+        # fraction of all the time bins, across all data sets, in the minibatch.
+        minibatchfrac = probs[i]
 
         # Update the parents using a standard mean field update
         p.meanfieldupdate()
@@ -1384,9 +1687,6 @@ class DiscreteTimeNetworkHawkesModelGammaMixture(
                                        minibatchfrac=minibatchfrac,
                                        stepsize=stepsize)
 
-        # Clear the parent buffer for this minibatch
-        del p
-
     def resample_from_mf(self):
         self.bias_model.resample_from_mf()
         self.weight_model.resample_from_mf()
@@ -1420,11 +1720,14 @@ class ContinuousTimeNetworkHawkesModel(ModelGibbsSampling):
                  bkgd_hypers={},
                  impulse_hypers={},
                  weight_hypers={},
-                 network=None, network_hypers={}):
+                 network=None, network_hypers={},
+                 n_threads=1):
         """
         Initialize a discrete time network Hawkes model with K processes.
 
         :param K:  Number of processes
+        :param n_threads: Number of threads used to update the parents of
+                          different data sets, or None to use one per core.
         """
         self.K      = K
         self.dt_max = dt_max
@@ -1464,6 +1767,10 @@ class ContinuousTimeNetworkHawkesModel(ModelGibbsSampling):
 
         # Initialize the data list to empty
         self.data_list = []
+        self.data_pool = DatasetPool(n_threads)
+
+        # Track the spectral radius of the weights across samples
+        self.stability_tracker = SpectralRadiusTracker()
 
 
     # Expose basic variables
@@ -1663,24 +1970,17 @@ class ContinuousTimeNetworkHawkesModel(ModelGibbsSampling):
         return S, C
 
 
-    def check_stability(self):
+    def check_stability(self, verbose=False):
         """
         Check that the weight matrix is stable
 
         :return:
         """
-        if self.K < 100:
-            eigs = np.linalg.eigvals(self.weight_model.W_effective)
-            maxeig = np.amax(np.real(eigs))
-        else:
-            from scipy.sparse.linalg import eigs
-            maxeig = eigs(self.weight_model.W_effective, k=1)[0]
+        W = self.weight_model.W_effective
+        if verbose:
+            print("Max eigenvalue: ", self.stability_tracker.spectral_radius(W))
 
-        print("Max eigenvalue: ", maxeig)
-        if maxeig < 1.0:
-            return True
-        else:
-            return False
+        return self.stability_tracker.is_stable(W)
 
     def copy_sample(self):
         """
@@ -1853,8 +2153,7 @@ class ContinuousTimeNetworkHawkesModel(ModelGibbsSampling):
         """
         # Update the parents.
         # THIS MUST BE DONE IMMEDIATELY FOLLOWING WEIGHT UPDATES!
-        for p in self.data_list:
-            p.resample()
+        self.data_pool.map(lambda p: p.resample(), self.data_list)
 
         # Update the bias model given the parents assigned to the background
         self.bias_model.resample(self.data_list)
@@ -0,0 +1,203 @@
+"""
+Streaming summaries of the posterior samples of a model.
+
+Keeping a copy of the model for every sample takes memory linear in the
+length of the chain. A PosteriorAccumulator instead keeps running means
+and variances of the parameters, co-occurrence counts of the edges, and
+a fixed number of thinned snapshots, all in preallocated arrays, so the
+memory it takes only depends on the size of the parameters.
+
+    posterior = PosteriorAccumulator(model, burnin=N_samples // 2)
+    for itr in range(N_samples):
+        model.resample_model()
+        posterior.update()
+
+    A_mean = posterior.mean("A")
+"""
+import numpy as np
+
+from pyhawkes.utils.utils import candidate_edges
+
+
+def _get_parameter(model, path):
+    """
+    Get the value of a parameter given its attribute path, e.g. "network.p"
+    """
+    value = model
+    for attr in path.split("."):
+        value = getattr(value, attr)
+    return np.array(value, dtype=np.float64)
+
+
+class PosteriorAccumulator(object):
+    """
+    Accumulate the samples of the parameters of a model, either Gibbs
+    samples or samples from the mean field posterior, as they are drawn.
+
+    The parameters are given by name and attribute path of the model.
+    By default they are the adjacency matrix A, the weights W and
+    W_effective, the background rates lambda0, and the impulse responses,
+    g in discrete time or mu and tau in continuous time.
+    """
+    def __init__(self, model, burnin=0, parameters={},
+                 cooccurrence_edges=None, n_snapshots=0, thin=1):
+        """
+        :param model:              The model whose samples are accumulated
+        :param burnin:             Number of initial samples to discard
+        :param parameters:         Dict of additional parameters to track,
+                                   by name and attribute path, e.g.
+                                   dict(p="network.p")
+        :param cooccurrence_edges: Edges whose pairwise co-occurrence in A
+                                   is counted, as accepted by
+                                   pyhawkes.utils.utils.candidate_edges.
+                                   This takes memory quadratic in the number
+                                   of edges, so restrict it to the edges of
+                                   interest for large networks.
+        :param n_snapshots:        Number of snapshots of the parameters to keep
+        :param thin:               Initial number of samples between snapshots.
+                                   When the snapshots fill up, every other one
+                                   is dropped and thin is doubled, so they stay
+                                   evenly spaced over the whole chain.
+        """
+        self.model = model
+        self.burnin = burnin
+
+        self.parameters = self._default_parameters(model)
+        self.parameters.update(parameters)
+
+        # Number of samples seen, including the burnin, and accumulated
+        self.n_seen = 0
+        self.N = 0
+
+        # Running means and sums of squared deviations
+        shapes = {name: _get_parameter(model, path).shape
+                  for name, path in self.parameters.items()}
+        self._mean = {name: np.zeros(shape) for name, shape in shapes.items()}
+        self._m2 = {name: np.zeros(shape) for name, shape in shapes.items()}
+
+        # Co-occurrence counts of pairs of edges
+        self.cooccurrence_edges = None
+        if cooccurrence_edges is not None:
+            self.cooccurrence_edges = candidate_edges(cooccurrence_edges, model.K)
+            E = len(self.cooccurrence_edges[0])
+            self.cooccurrence_counts = np.zeros((E, E), dtype=np.int64)
+
+        # Thinned snapshots of the parameters
+        self.thin = thin
+        self.n_snapshots = 0
+        self.snapshot_samples = np.zeros(n_snapshots, dtype=np.int64)
+        self.snapshots = {name: np.zeros((n_snapshots,) + shape)
+                          for name, shape in shapes.items()}
+
+    @staticmethod
+    def _default_parameters(model):
+        parameters = dict(A="A", W="W", W_effective="W_effective",
+                          lambda0="lambda0")
+        if hasattr(model.impulse_model, "g"):
+            parameters["g"] = "impulse_model.g"
+        else:
+            parameters["mu"] = "impulse_model.mu"
+            parameters["tau"] = "impulse_model.tau"
+        return parameters
+
+    def __getstate__(self):
+        # Pickle the summaries without the model and its data
+        state = self.__dict__.copy()
+        state["model"] = None
+        return state
+
+    def update(self):
+        """
+        Accumulate the current parameters of the model
+        """
+        assert self.model is not None, \
+            "The accumulator is not attached to a model"
+        self.n_seen += 1
+        if self.n_seen <= self.burnin:
+            return
+
+        self.N += 1
+        values = {name: _get_parameter(self.model, path)
+                  for name, path in self.parameters.items()}
+
+        # Welford's update of the mean and variance
+        for name, x in values.items():
+            delta = x - self._mean[name]
+            self._mean[name] += delta / self.N
+            self._m2[name] += delta * (x - self._mean[name])
+
+        if self.cooccurrence_edges is not None:
+            a = values["A"][self.cooccurrence_edges] > 0
+            self.cooccurrence_counts += a[:,None] & a[None,:]
+
+        if len(self.snapshot_samples) > 0 and self.N % self.thin == 0:
+            self._add_snapshot(values)
+
+    def _add_snapshot(self, values):
+        if self.n_snapshots == len(self.snapshot_samples):
+            # Keep the snapshots at multiples of twice the thinning
+            keep = slice(1, self.n_snapshots, 2)
+            n_keep = self.n_snapshots // 2
+            self.snapshot_samples[:n_keep] = self.snapshot_samples[keep]
+            for snapshots in self.snapshots.values():
+                snapshots[:n_keep] = snapshots[keep]
+            self.n_snapshots = n_keep
+            self.thin *= 2
+
+            if self.N % self.thin != 0:
+                return
+
+        i = self.n_snapshots
+        self.snapshot_samples[i] = self.N
+        for name, x in values.items():
+            self.snapshots[name][i] = x
+        self.n_snapshots += 1
+
+    def mean(self, name):
+        """
+        Posterior mean of a parameter
+        """
+        return self._mean[name].copy()
+
+    def var(self, name):
+        """
+        Posterior variance of a parameter
+        """
+        return self._m2[name] / max(self.N - 1, 1)
+
+    def std(self, name):
+        return np.sqrt(self.var(name))
+
+    @property
+    def edge_probabilities(self):
+        """
+        Posterior probability of each edge, E[A]
+        """
+        return self.mean("A")
+
+    @property
+    def cooccurrence_probabilities(self):
+        """
+        Posterior probability that both edges of each pair of
+        cooccurrence_edges are present
+        """
+        return self.cooccurrence_counts / float(max(self.N, 1))
+
+    def __len__(self):
+        return self.n_snapshots
+
+    def __getitem__(self, i):
+        """
+        Get snapshot i as a dict of the parameters by name, so that the
+        accumulator can be indexed like a list of samples
+        """
+        i = range(self.n_snapshots)[i]
+        return {name: snapshots[i] for name, snapshots in self.snapshots.items()}
+
+    def get_snapshots(self, name):
+        """
+        Get the thinned snapshots of a parameter and the indices of
+        their samples (after the burnin)
+        """
+        return self.snapshots[name][:self.n_snapshots], \
+               self.snapshot_samples[:self.n_snapshots]
@@ -4,9 +4,40 @@ import abc
 from scipy.optimize import minimize
 
 from pyhawkes.utils.basis import CosineBasis
+from pyhawkes.utils.utils import check_event_counts, event_counts
 
 import autograd.numpy as np
-from autograd import grad
+
+
+def _conjugate_gradient(hessp, b, max_iter=None, tol=1e-2):
+    """
+    Approximately solve H x = b by conjugate gradients given only
+    the Hessian-vector product hessp(v) = H v. The iterations stop
+    early at a relative residual of tol or on negative curvature.
+    """
+    x = np.zeros_like(b)
+    r = b.copy()
+    p = r.copy()
+    rr = r.dot(r)
+    bnorm = np.sqrt(rr)
+    max_iter = b.size if max_iter is None else max_iter
+    for _ in range(max_iter):
+        Hp = hessp(p)
+        pHp = p.dot(Hp)
+        if pHp <= 0:
+            break
+
+        alpha = rr / pHp
+        x += alpha * p
+        r -= alpha * Hp
+        rr_new = r.dot(r)
+        if np.sqrt(rr_new) < tol * bnorm:
+            break
+
+        p = r + (rr_new / rr) * p
+        rr = rr_new
+
+    return x
 
 
 ### Nodes
@@ -33,25 +64,49 @@ class _NonlinearHawkesNodeBase(object):
     def invlink(self, lam):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def d_link(self, psi):
+        """
+        First derivative of the link function
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def d2_link(self, psi):
+        """
+        Second derivative of the link function
+        """
+        raise NotImplementedError
+
     def __init__(self, K, B, dt=1.0, sigma=np.inf, lmbda=np.inf):
         self.K, self.B, self.dt, self.sigma, self.lmbda = K, B, dt, sigma, lmbda
 
         # Initialize weights
         self.w = np.zeros(1+self.K*self.B)
 
-        # List of event counts and filtered inputs
+        # List of filtered inputs, time bins with events, and event counts
         self.data_list = []
 
     def add_data(self, F, S):
+        """
+        :param F: Tx(1+KxB) matrix of filtered inputs
+        :param S: length T vector of event counts, or a tuple (t, counts)
+                  of the time bins with events and their counts
+        """
         T = F.shape[0]
-        assert S.shape == (T,) and S.dtype in (np.int, np.uint, np.uint32)
+        if isinstance(S, tuple):
+            t, counts = S
+        else:
+            assert S.shape == (T,) and np.issubdtype(S.dtype, np.integer)
+            t = np.nonzero(S)[0]
+            counts = S[t]
 
         if F.shape[1] == self.K * self.B:
-            F = np.hstack([np.ones((T,)),  F])
+            F = np.hstack([np.ones((T,1)),  F])
         else:
             assert F.shape[1] == 1 + self.K * self.B
 
-        self.data_list.append((F, S))
+        self.data_list.append((F, t, counts.astype(np.float64)))
 
     def initialize_to_background_rate(self):
         # self.w = abs(1e-6 * np.random.randn(*self.w.shape))
@@ -59,9 +114,9 @@ class _NonlinearHawkesNodeBase(object):
         if len(self.data_list) > 0:
             N = 0
             T = 0
-            for F,S in self.data_list:
+            for F,t,S in self.data_list:
                 N += S.sum(axis=0)
-                T += S.shape[0] * self.dt
+                T += F.shape[0] * self.dt
 
             lambda0 = self.invlink(N / float(T))
             self.w[0] = lambda0
@@ -73,20 +128,20 @@ class _NonlinearHawkesNodeBase(object):
             data_list = [self.data_list[index]]
 
         ll = 0
-        for F,S in data_list:
+        for F,t,S in data_list:
             psi = F.dot(self.w)
             lam = self.link(psi)
-            ll += (S * np.log(lam) -lam*self.dt).sum()
+            ll += (S * np.log(lam[t])).sum() - lam.sum() * self.dt
 
         return ll
 
     def objective(self, w):
         obj = 0
-        N = float(sum([np.sum(d[1]) for d in self.data_list]))
-        for F,S in self.data_list:
+        N = self._N()
+        for F,t,S in self.data_list:
             psi = np.dot(F, w)
             lam = self.link(psi)
-            obj -= np.sum(S * np.log(lam) -lam*self.dt) / N
+            obj -= (np.sum(S * np.log(lam[t])) - np.sum(lam) * self.dt) / N
             # assert np.isfinite(ll)
 
         # Add penalties
@@ -97,6 +152,82 @@ class _NonlinearHawkesNodeBase(object):
 
         return obj
 
+    def _N(self):
+        # Number of events, used to normalize the objective. Nodes
+        # without any events are normalized by one instead.
+        return max(float(sum([np.sum(d[2]) for d in self.data_list])), 1.)
+
+    def _smooth_objective_and_gradient(self, w):
+        """
+        Objective and gradient without the L1 penalty. With psi = F w
+        and lam = link(psi), the gradient of the Poisson log likelihood
+        is F^T [(S/lam - dt) * link'(psi)], where S is zero outside the
+        time bins with events.
+        """
+        N = self._N()
+        obj = 0
+        g = np.zeros_like(w)
+        for F,t,S in self.data_list:
+            psi = F.dot(w)
+            lam = self.link(psi)
+            dlam = self.d_link(psi)
+            obj -= np.sum(S * np.log(lam[t])) - np.sum(lam) * self.dt
+
+            r = -self.dt * dlam
+            r[t] += S * dlam[t] / lam[t]
+            g -= F.T.dot(r)
+
+        obj += 0.5 * np.sum(w[1:]**2) / self.sigma**2
+        g[1:] += w[1:] / self.sigma**2
+        return obj / N, g / N
+
+    def objective_and_gradient(self, w):
+        """
+        Compute self.objective(w) and its gradient in closed form
+        """
+        N = self._N()
+        obj, g = self._smooth_objective_and_gradient(w)
+        obj += np.sum(np.abs(w[1:]) * self.lmbda) / N
+        g[1:] += self.lmbda * np.sign(w[1:]) / N
+        return obj, g
+
+    def gradient(self, w):
+        return self.objective_and_gradient(w)[1]
+
+    def _curvature(self, w):
+        """
+        Compute, for each data set, the diagonal h of the Hessian of the
+        negative log likelihood with respect to psi, so that the Hessian
+        with respect to w is F^T diag(h) F.
+        """
+        hs = []
+        for F,t,S in self.data_list:
+            psi = F.dot(w)
+            lam = self.link(psi)
+            dlam = self.d_link(psi)
+            d2lam = self.d2_link(psi)
+
+            h = self.dt * d2lam
+            h[t] += S * (dlam[t] / lam[t])**2 - S / lam[t] * d2lam[t]
+            hs.append(h)
+        return hs
+
+    def hessian_vector_product(self, w, v, hs=None):
+        """
+        Compute the product of the Hessian of the objective at w with v
+        without forming the Hessian. The L1 penalty contributes nothing
+        away from zero. The curvature hs may be precomputed with
+        self._curvature(w) when taking several products at the same w.
+        """
+        if hs is None:
+            hs = self._curvature(w)
+
+        Hv = np.zeros_like(w)
+        for (F,_,_), h in zip(self.data_list, hs):
+            Hv += F.T.dot(h * F.dot(v))
+
+        Hv[1:] += v[1:] / self.sigma**2
+        return Hv / self._N()
 
     def fit_with_bfgs(self):
         """
@@ -111,20 +242,224 @@ class _NonlinearHawkesNodeBase(object):
         # bnds = [(None, None)] * (1 + self.K * self.B)
 
         itr = [0]
+        last_obj = [None]
+        def objective(w):
+            obj, g = self.objective_and_gradient(w)
+            last_obj[0] = obj
+            return obj, g
+
         def callback(w):
             if itr[0] % 10 == 0:
-                print("Iteration: %03d\t LP: %.5f" % (itr[0], self.objective(w)))
+                print("Iteration: %03d\t LP: %.5f" % (itr[0], last_obj[0]))
             itr[0] = itr[0] + 1
 
-        itr[0] = 0
-        x0 = self.w
-        res = minimize(self.objective,           # Objective function
-                       x0,                       # Initial value
-                       jac=grad(self.objective), # Gradient of the objective
+        res = minimize(objective,                # Objective function and gradient
+                       self.w,                   # Initial value
+                       jac=True,                 # Objective also returns the gradient
                        bounds=bnds,              # Bounds on x
                        callback=callback)
         self.w = res.x
 
+    def _penalty_bounds(self):
+        """
+        Lower bounds on the weights, the per-weight L1 penalty of the
+        normalized objective (the bias is not penalized), and a mask of
+        the penalized weights that are free to change sign.
+        """
+        D = self.w.size
+        if self.constrained:
+            lb = np.array([b[0] for b in self.bias_bnds + self.weight_bnds * (self.K * self.B)])
+        else:
+            lb = -np.inf * np.ones(D)
+
+        l1 = np.zeros(D)
+        l1[1:] = self.lmbda / self._N()
+
+        orthantwise = (l1 > 0) & np.isinf(lb)
+        return lb, l1, orthantwise
+
+    def _pseudo_gradient(self, w, g, lb, l1, orthantwise):
+        """
+        Pseudo-gradient of the penalized objective given the gradient g
+        of its smooth part. At zero, the L1 subgradient absorbs any
+        gradient smaller than the penalty. Also return a mask of the
+        weights that are not held at their bound or at zero.
+        """
+        zero = (w == 0) & orthantwise
+        pg = g + l1 * np.sign(w)
+        pg[zero] = np.sign(g[zero]) * np.maximum(np.abs(g[zero]) - l1[zero], 0)
+
+        fixed = ((w <= lb) & (pg > 0)) | (zero & (pg == 0))
+        return pg, ~fixed
+
+    def fit_with_newton(self, max_iter=100, tol=1e-6,
+                        verbose=False, print_interval=10):
+        """
+        Fit the model with a projected Newton method. Each step solves
+        the Newton system for the free weights with conjugate gradients,
+        using Hessian-vector products, and then backtracks along the
+        step projected back onto the feasible set.
+
+        For constrained nodes the feasible set is given by the lower
+        bounds. For unconstrained nodes with an L1 penalty it is the
+        orthant of the current weights (as in OWL-QN), so that weights
+        can be set exactly to zero.
+
+        If verbose, print the objective every print_interval iterations.
+        """
+        D = self.w.size
+        lb, l1, orthantwise = self._penalty_bounds()
+
+        def objective(w):
+            return self._smooth_objective_and_gradient(w)[0] + np.sum(l1 * np.abs(w))
+
+        def project(w, orthant):
+            w = np.maximum(w, lb)
+            w[orthantwise & (np.sign(w) != orthant)] = 0
+            return w
+
+        w = np.maximum(self.w, lb)
+        for itr in range(max_iter):
+            obj, g = self._smooth_objective_and_gradient(w)
+            obj += np.sum(l1 * np.abs(w))
+            pg, free = self._pseudo_gradient(w, g, lb, l1, orthantwise)
+
+            if verbose and itr % print_interval == 0:
+                print("Iteration: %03d\t LP: %.5f" % (itr, obj))
+
+            if not free.any() or np.amax(np.abs(pg[free])) < tol:
+                break
+
+            # Solve the Newton system restricted to the free weights
+            hs = self._curvature(w)
+            def hessp(v):
+                vfull = np.zeros(D)
+                vfull[free] = v
+                return self.hessian_vector_product(w, vfull, hs)[free]
+
+            d = np.zeros(D)
+            d[free] = _conjugate_gradient(hessp, -pg[free])
+
+            # Only move penalized weights in the direction of descent
+            d[orthantwise & (d * pg > 0)] = 0
+            if d.dot(pg) >= 0:
+                d = -pg * free
+
+            # Backtracking line search on the projected path
+            orthant = np.where(w != 0, np.sign(w), -np.sign(pg))
+            step = 1.0
+            while step > 1e-10:
+                w_new = project(w + step * d, orthant)
+                obj_new = objective(w_new)
+                if obj_new <= obj + 1e-4 * pg.dot(w_new - w):
+                    break
+                step *= 0.5
+            else:
+                break
+
+            w = w_new
+            if obj - obj_new < 1e-12 * max(1., abs(obj)):
+                break
+
+        self.w = w
+
+    def fit_with_coordinate_descent(self, max_iter=100, tol=1e-6, n_passes=10,
+                                    verbose=False, print_interval=10):
+        """
+        Fit the model with proximal Newton steps, as in glmnet. Each outer
+        iteration forms a quadratic approximation to the smooth part of
+        the objective and minimizes it plus the L1 penalty by cyclic
+        coordinate descent with soft thresholding, then backtracks along
+        the resulting step. The L1 penalty yields exact zeros.
+
+        Weights at zero (or at their bound) that satisfy the optimality
+        conditions are screened out of the coordinate passes, so each pass
+        only touches the active columns of F. Their conditions are checked
+        again with the full gradient at the start of every outer iteration.
+
+        If verbose, print the objective every print_interval iterations.
+        """
+        D = self.w.size
+        N = self._N()
+        lb, l1, orthantwise = self._penalty_bounds()
+        ridge = np.zeros(D)
+        ridge[1:] = 1. / self.sigma**2 / N
+
+        def objective(w):
+            return self._smooth_objective_and_gradient(w)[0] + np.sum(l1 * np.abs(w))
+
+        w = np.maximum(self.w, lb)
+        for itr in range(max_iter):
+            obj, g = self._smooth_objective_and_gradient(w)
+            obj += np.sum(l1 * np.abs(w))
+            pg, free = self._pseudo_gradient(w, g, lb, l1, orthantwise)
+
+            if verbose and itr % print_interval == 0:
+                print("Iteration: %03d\t LP: %.5f" % (itr, obj))
+
+            if not free.any() or np.amax(np.abs(pg[free])) < tol:
+                break
+
+            # Restrict the quadratic approximation to the active weights.
+            # The columns are copied to Fortran order for fast access.
+            active = np.where(free)[0]
+            hs = self._curvature(w)
+            FAs = [np.asfortranarray(F[:,active]) for F,_,_ in self.data_list]
+            hdiag = ridge[active] + sum([h.dot(FA**2) for FA, h in zip(FAs, hs)]) / N
+
+            # Cyclic coordinate descent on the penalized quadratic. Keep
+            # h * (F_A d) for each data set so that each coordinate update
+            # costs one pass over a single column.
+            wA, gA, lbA, l1A = w[active], g[active], lb[active], l1[active]
+            owA, ridgeA = orthantwise[active], ridge[active]
+            d = np.zeros(len(active))
+            hus = [np.zeros(F.shape[0]) for F,_,_ in self.data_list]
+            for _ in range(n_passes):
+                max_delta = 0
+                for i in range(len(active)):
+                    if hdiag[i] <= 0:
+                        continue
+
+                    gi = gA[i] + ridgeA[i] * d[i] \
+                         + sum([FA[:,i].dot(hu) for FA, hu in zip(FAs, hus)]) / N
+                    z = wA[i] + d[i] - gi / hdiag[i]
+                    thresh = l1A[i] / hdiag[i]
+                    if owA[i]:
+                        wi = np.sign(z) * max(abs(z) - thresh, 0)
+                    else:
+                        # Weights with a positive lower bound have |w| = w
+                        wi = max(z - thresh, lbA[i])
+
+                    delta = wi - wA[i] - d[i]
+                    if delta != 0:
+                        d[i] += delta
+                        for FA, h, hu in zip(FAs, hs, hus):
+                            hu += delta * h * FA[:,i]
+                        max_delta = max(max_delta, abs(delta))
+
+                if max_delta < tol:
+                    break
+
+            # Backtracking line search. Every point between w and w + d
+            # is feasible, so no projection is needed.
+            dw = np.zeros(D)
+            dw[active] = d
+            decrease = g.dot(dw) + np.sum(l1 * (np.abs(w + dw) - np.abs(w)))
+            step = 1.0
+            while step > 1e-10:
+                w_new = w + step * dw
+                obj_new = objective(w_new)
+                if obj_new <= obj + 1e-4 * step * decrease:
+                    break
+                step *= 0.5
+            else:
+                break
+
+            w = w_new
+            if obj - obj_new < 1e-9 * max(1., abs(obj)):
+                break
+
+        self.w = w
 
     def copy_node(self):
         """
@@ -159,6 +494,12 @@ class LinearHawkesNode(_NonlinearHawkesNodeBase):
     def invlink(self, lam):
         return lam
 
+    def d_link(self, psi):
+        return np.ones_like(psi)
+
+    def d2_link(self, psi):
+        return np.zeros_like(psi)
+
 
 class RectLinearHawkesNode(_NonlinearHawkesNodeBase):
     def link(self, psi):
@@ -167,6 +508,14 @@ class RectLinearHawkesNode(_NonlinearHawkesNodeBase):
     def invlink(self, lam):
         return np.log(np.exp(lam) - 1.)
 
+    def d_link(self, psi):
+        # Logistic function
+        return 1. / (1. + np.exp(-psi))
+
+    def d2_link(self, psi):
+        sig = 1. / (1. + np.exp(-psi))
+        return sig * (1. - sig)
+
 
 class ExpNonlinearHawkesNode(_NonlinearHawkesNodeBase):
     def link(self, psi):
@@ -175,6 +524,12 @@ class ExpNonlinearHawkesNode(_NonlinearHawkesNodeBase):
     def invlink(self, lam):
         return np.log(lam)
 
+    def d_link(self, psi):
+        return np.exp(psi)
+
+    def d2_link(self, psi):
+        return np.exp(psi)
+
 # Dummy class for a homogeneous Hawkes node
 class HomogeneousPoissonNode(_NonlinearHawkesNodeBase):
     def link(self, psi):
@@ -183,11 +538,23 @@ class HomogeneousPoissonNode(_NonlinearHawkesNodeBase):
     def invlink(self, lam):
         return lam
 
+    def d_link(self, psi):
+        return np.ones_like(psi)
+
+    def d2_link(self, psi):
+        return np.zeros_like(psi)
+
     def fit_with_bfgs(self):
         # Rather than fitting, just initialize to background rate
         self.initialize_to_background_rate()
         self.w[1:] = 0
 
+    def fit_with_newton(self, **kwargs):
+        self.fit_with_bfgs()
+
+    def fit_with_coordinate_descent(self, **kwargs):
+        self.fit_with_bfgs()
+
 
 class _NonlinearHawkesProcessBase(object):
     """
@@ -229,6 +596,11 @@ class _NonlinearHawkesProcessBase(object):
                               sigma=self.sigma, lmbda=self.lmbda)
              for _ in range(self.K)]
 
+        # List of filtered inputs and (t, k, count) triplets of the events.
+        # Each node also keeps its own events, but the inputs F are shared
+        # so that all the rates can be computed at once.
+        self.data_list = []
+
     def initialize_to_background_rate(self):
         for node in self.nodes:
             node.initialize_to_background_rate()
@@ -271,6 +643,18 @@ class _NonlinearHawkesProcessBase(object):
         full_W = np.array([node.w for node in self.nodes])
         return full_W[:,0]
 
+    @property
+    def weights(self):
+        """
+        (1+KxB) x K matrix whose columns are the weights of each node
+        """
+        return np.column_stack([node.w for node in self.nodes])
+
+    @weights.setter
+    def weights(self, value):
+        for k, node in enumerate(self.nodes):
+            node.w = value[:,k].copy()
+
     def add_data(self, S, F=None):
         """
         Add a data set to the list of observations.
@@ -278,12 +662,36 @@ class _NonlinearHawkesProcessBase(object):
         then instantiate a set of parents for this data set.
 
         :param S: a TxK matrix of of event counts for each time bin
-                  and each process.
+                  and each process. This may also be a scipy.sparse
+                  matrix or a tuple of (t, k, count) triplets.
+        """
+        data = self._prepare_data(S, F)
+        self.data_list.append(data)
+
+        F, t, ks, counts = data
+        offsets = np.searchsorted(ks, np.arange(self.K+1))
+        for k,node in enumerate(self.nodes):
+            node.add_data(F, (t[offsets[k]:offsets[k+1]], counts[offsets[k]:offsets[k+1]]))
+
+    def _prepare_data(self, S, F=None):
+        """
+        Filter the data and get its events as (t, k, count) triplets
+        sorted by process, without forming a dense count matrix.
+
+        :return: F, t, k, counts
+        """
+        S = check_event_counts(S, self.K)
+        F = self._filter_data(S, F)
+        _, t, k, counts = event_counts(S)
+        return F, t, k, counts.astype(np.float64)
+
+    def _filter_data(self, S, F=None):
         """
-        assert isinstance(S, np.ndarray) and S.ndim == 2 and S.shape[1] == self.K \
-               and np.amin(S) >= 0 and S.dtype == np.int, \
-               "Data must be a TxK array of event counts"
+        Filter the data with the impulse response basis and prepend
+        a column of ones for the bias.
 
+        :return: a Tx(1+KxB) matrix of filtered inputs
+        """
         T = S.shape[0]
 
         if F is None:
@@ -302,22 +710,105 @@ class _NonlinearHawkesProcessBase(object):
             # Prepend a column of ones
             F = np.hstack((np.ones((T,1)), F))
 
-        for k,node in enumerate(self.nodes):
-            node.add_data(F, S[:,k])
+        elif F.shape[1] == self.K * self.B:
+            F = np.hstack((np.ones((T,1)), F))
+
+        else:
+            assert F.shape == (T, 1 + self.K * self.B)
+
+        return F
 
     def remove_data(self, index):
+        del self.data_list[index]
         for node in self.nodes:
             del node.data_list[index]
 
-    def log_likelihood(self, index=None):
-        ll = np.sum([node.log_likelihood(index=index) for node in self.nodes])
+    def joint_log_likelihood(self, weights, data_list=None):
+        """
+        Compute the log likelihood of each node given a (1+KxB) x K matrix
+        of stacked node weights. The rates of all the nodes are computed
+        with a single matrix product per data set, rather than streaming
+        the shared inputs F through memory once per node.
+
+        :return: length K vector of log likelihoods
+        """
+        if data_list is None:
+            data_list = self.data_list
+
+        link = self.nodes[0].link
+        ll = np.zeros(self.K)
+        for F,t,k,S in data_list:
+            lam = link(np.dot(F, weights))
+            ll = ll + np.bincount(k, weights=S * np.log(lam[t,k]), minlength=self.K)
+            ll = ll - lam.sum(axis=0) * self.dt
+
         return ll
 
+    def joint_objective(self, weights):
+        """
+        The objectives of all the nodes (see _NonlinearHawkesNodeBase.objective)
+        evaluated jointly given a (1+KxB) x K matrix of stacked weights.
+
+        :return: length K vector of objectives
+        """
+        N = np.zeros(self.K)
+        for _,_,k,S in self.data_list:
+            N = N + np.bincount(k, weights=S, minlength=self.K)
+        N = np.maximum(N, 1.)
+
+        obj = -self.joint_log_likelihood(weights) / N
+
+        # Add penalties
+        obj = obj + (0.5 * np.sum(weights[1:]**2, axis=0) / self.sigma**2) / N
+        obj = obj + np.sum(np.abs(weights[1:]) * self.lmbda, axis=0) / N
+
+        return obj
+
+    def joint_objective_and_gradient(self, weights):
+        """
+        Compute the objectives of all the nodes and their gradients.
+        Since the nodes are independent, the k-th column of the gradient
+        is the gradient of the k-th node's objective.
+
+        :return: length K vector of objectives and a (1+KxB) x K matrix
+                 of gradients
+        """
+        node = self.nodes[0]
+        N = np.zeros(self.K)
+        ll = np.zeros(self.K)
+        g = np.zeros_like(weights)
+        for F,t,k,S in self.data_list:
+            N = N + np.bincount(k, weights=S, minlength=self.K)
+            Psi = np.dot(F, weights)
+            Lam = node.link(Psi)
+            dLam = node.d_link(Psi)
+            ll = ll + np.bincount(k, weights=S * np.log(Lam[t,k]), minlength=self.K)
+            ll = ll - Lam.sum(axis=0) * self.dt
+
+            R = -self.dt * dLam
+            R[t,k] += S * dLam[t,k] / Lam[t,k]
+            g = g - F.T.dot(R)
+        N = np.maximum(N, 1.)
+
+        # Add penalties
+        obj = -ll
+        obj = obj + 0.5 * np.sum(weights[1:]**2, axis=0) / self.sigma**2
+        obj = obj + np.sum(np.abs(weights[1:]) * self.lmbda, axis=0)
+        g[1:] = g[1:] + weights[1:] / self.sigma**2 + self.lmbda * np.sign(weights[1:])
+
+        return obj / N, g / N
+
+    def log_likelihood(self, index=None):
+        if index is None:
+            data_list = self.data_list
+        else:
+            data_list = [self.data_list[index]]
+
+        return self.joint_log_likelihood(self.weights, data_list).sum()
+
     def heldout_log_likelihood(self, S, F=None):
-        self.add_data(S, F=F)
-        hll = self.log_likelihood(index=-1)
-        self.remove_data(-1)
-        return hll
+        data = self._prepare_data(S, F)
+        return self.joint_log_likelihood(self.weights, [data]).sum()
 
     def copy_sample(self):
         """
@@ -325,6 +816,8 @@ class _NonlinearHawkesProcessBase(object):
         """
         # Shallow copy the data
         nodes_original = copy.copy(self.nodes)
+        data_list = copy.copy(self.data_list)
+        self.data_list = []
 
         # Make a deep copy without the data
         self.nodes = [n.copy_node() for n in nodes_original]
@@ -332,14 +825,130 @@ class _NonlinearHawkesProcessBase(object):
 
         # Reset the data and return the data-less copy
         self.nodes = nodes_original
+        self.data_list = data_list
         return model_copy
 
-    def fit_with_bfgs(self):
-        # TODO: This can be parallelized
-        for k, node in enumerate(self.nodes):
+    def _fit_nodes(self, method, n_jobs=1, **kwargs):
+        """
+        Fit each node with node.fit_with_<method>(**kwargs). The nodes are
+        independent given the filtered data, so they can be distributed
+        across n_jobs worker processes (n_jobs=-1 uses all cores).
+        """
+        if n_jobs == 1:
+            for k, node in enumerate(self.nodes):
+                print("")
+                print("Fitting Node ", k)
+                getattr(node, "fit_with_" + method)(**kwargs)
+
+        else:
+            from pyhawkes.internals.parallel_bfgs_fitting import \
+                fit_in_parallel, _fit_nonlinear_node
+            ws = fit_in_parallel(_fit_nonlinear_node,
+                                 [(node,) for node in self.nodes],
+                                 n_jobs, method=method, **kwargs)
+            for node, w in zip(self.nodes, ws):
+                node.w = w
+
+    def fit_with_bfgs(self, n_jobs=1):
+        """
+        Fit each node with BFGS
+        """
+        self._fit_nodes("bfgs", n_jobs)
+
+    def fit_with_newton(self, n_jobs=1, **kwargs):
+        """
+        Fit each node with a projected Newton method. Keyword arguments,
+        e.g. max_iter, tol or verbose, are passed to the nodes.
+        """
+        self._fit_nodes("newton", n_jobs, **kwargs)
+
+    def fit_with_coordinate_descent(self, n_jobs=1, **kwargs):
+        """
+        Fit each node with proximal Newton and coordinate descent. This
+        is the fastest way to fit L1 penalized models and gives exact zeros.
+        Keyword arguments, e.g. max_iter, n_passes or verbose, are passed
+        to the nodes.
+        """
+        self._fit_nodes("coordinate_descent", n_jobs, **kwargs)
+
+    def fit_path(self, lmbdas, S_heldout=None, method="coordinate_descent",
+                 n_jobs=1, **kwargs):
+        """
+        Fit the model along a path of L1 penalties. The data is filtered
+        once and each fit is warm started from the solution at the
+        previous penalty, going from the largest penalty (the sparsest
+        solution) to the smallest, so the whole path costs little more
+        than a single fit. The model is left at the smallest penalty.
+
+        :param lmbdas:    penalties to fit
+        :param S_heldout: optional TxK matrix of held-out event counts (in
+                          any form accepted by add_data), or a list of them,
+                          to evaluate along the path
+        :param method:    node fitting method, e.g. "bfgs", "newton" or
+                          "coordinate_descent"
+        :param kwargs:    passed to the node fitting method
+        :return: for each penalty in the order given, a copy of the fitted
+                 model, its training log likelihood and, if S_heldout is
+                 given, its held-out log likelihood (otherwise None).
+        """
+        lmbdas = np.asarray(lmbdas, dtype=np.float64)
+
+        heldout_data = None
+        if S_heldout is not None:
+            if not isinstance(S_heldout, list):
+                S_heldout = [S_heldout]
+            heldout_data = [self._prepare_data(S) for S in S_heldout]
+
+        models = [None] * len(lmbdas)
+        lls = np.zeros(len(lmbdas))
+        hlls = np.zeros(len(lmbdas)) if heldout_data is not None else None
+        for i in np.argsort(-lmbdas):
             print("")
-            print("Fitting Node ", k)
-            node.fit_with_bfgs()
+            print("Fitting lambda = ", lmbdas[i])
+            self.lmbda = lmbdas[i]
+            for node in self.nodes:
+                node.lmbda = lmbdas[i]
+
+            self._fit_nodes(method, n_jobs, **kwargs)
+
+            models[i] = self.copy_sample()
+            lls[i] = self.log_likelihood()
+            if heldout_data is not None:
+                hlls[i] = self.joint_log_likelihood(self.weights, heldout_data).sum()
+
+        return models, lls, hlls
+
+    def fit_with_joint_bfgs(self):
+        """
+        Fit all the nodes at once with BFGS on the sum of their objectives,
+        using the joint objective so that each evaluation computes all the
+        rates with one matrix product per data set.
+        """
+        node = self.nodes[0]
+        shape = (1 + self.K * self.B, self.K)
+
+        # Bounds on the flattened (1+KxB) x K weight matrix
+        bnds = node.bias_bnds * self.K + node.weight_bnds * (self.K * self.B * self.K) \
+            if node.constrained else None
+
+        last_obj = [None]
+        def objective(x):
+            obj, g = self.joint_objective_and_gradient(x.reshape(shape))
+            last_obj[0] = obj.sum()
+            return last_obj[0], g.ravel()
+
+        itr = [0]
+        def callback(x):
+            if itr[0] % 10 == 0:
+                print("Iteration: %03d\t LP: %.5f" % (itr[0], last_obj[0]))
+            itr[0] = itr[0] + 1
+
+        res = minimize(objective,                 # Objective function and gradient
+                       self.weights.ravel(),      # Initial value
+                       jac=True,                  # Objective also returns the gradient
+                       bounds=bnds,               # Bounds on x
+                       callback=callback)
+        self.weights = res.x.reshape(shape)
 
 
 class StandardHawkesProcess(_NonlinearHawkesProcessBase):
@@ -353,3 +962,7 @@ class ExpNonlinearHawkesProcess(_NonlinearHawkesProcessBase):
 
 class HomogeneousPoissonProcess(_NonlinearHawkesProcessBase):
     _node_class = HomogeneousPoissonNode
+
+    def fit_with_joint_bfgs(self):
+        # Rather than fitting, just initialize to background rate
+        self.fit_with_bfgs()
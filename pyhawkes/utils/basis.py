@@ -1,9 +1,117 @@
 import os
 import abc
+import hashlib
+import threading
+from collections import OrderedDict
 
 import numpy as np
 import scipy.linalg
 import scipy.signal as sig
+import scipy.sparse
+
+from pyhawkes.utils.utils import event_counts
+
+
+class _LRUCache(object):
+    """
+    A small, thread safe, least-recently-used cache. Values are
+    expected to be read-only arrays so that they can be shared
+    between all the models in this process. The cache holds at
+    most maxsize values and, if maxbytes is not None, at most
+    maxbytes bytes of them; larger values are not cached at all.
+    """
+    def __init__(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._pop(key)
+            if self.maxsize <= 0:
+                return
+            if self.maxbytes is not None and value.nbytes > self.maxbytes:
+                return
+            self._data[key] = value
+            self.nbytes += value.nbytes
+            self._evict()
+
+    def resize(self, maxsize=None, maxbytes=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if maxbytes is not None:
+                self.maxbytes = maxbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def _pop(self, key):
+        value = self._data.pop(key, None)
+        if value is not None:
+            self.nbytes -= value.nbytes
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0) or \
+                (self.maxbytes is not None and self.nbytes > self.maxbytes):
+            _, value = self._data.popitem(last=False)
+            self.nbytes -= value.nbytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Process-wide caches of interpolated bases (keyed on the basis
+# parameters) and of filtered data (keyed on the basis and a hash of S).
+# The filtered data is bounded in bytes so that large data sets are not
+# kept alive after their models are gone.
+_basis_cache = _LRUCache(maxsize=32)
+_filtered_cache = _LRUCache(maxsize=4, maxbytes=256 * 2**20)
+
+def set_basis_cache_size(n_bases=None, n_filtered=None, filtered_nbytes=None):
+    """
+    Set the number of interpolated bases and filtered datasets
+    that are kept in the process-wide caches, and the total
+    number of bytes of filtered data. A size of zero disables
+    the corresponding cache.
+    """
+    if n_bases is not None:
+        _basis_cache.resize(n_bases)
+    if n_filtered is not None or filtered_nbytes is not None:
+        _filtered_cache.resize(n_filtered, filtered_nbytes)
+
+def clear_basis_cache():
+    _basis_cache.clear()
+    _filtered_cache.clear()
+
+def _hash_array(X):
+    X = np.ascontiguousarray(X)
+    return (X.shape, X.dtype.str, hashlib.sha1(X.view(np.uint8)).hexdigest())
+
+def _hash_counts(S):
+    if scipy.sparse.issparse(S):
+        S = scipy.sparse.csc_matrix(S)
+        return ("sparse", S.shape,
+                _hash_array(S.data), _hash_array(S.indices), _hash_array(S.indptr))
+    return _hash_array(S)
+
+def _readonly(X):
+    X.setflags(write=False)
+    return X
+
 
 # TODO: Clean up this interface
 class Basis(object):
@@ -20,39 +128,85 @@ class Basis(object):
         self.norm = norm
         self.allow_instantaneous = allow_instantaneous
 
-        self.basis = self.interpolate_basis(self.create_basis(), self.dt, self.dt_max, self.norm)
+        # The interpolated basis only depends on the parameters above
+        # (and those of the subclass), so share it between models
+        self._key = self._cache_key()
+        self.basis = _basis_cache.get(self._key)
+        if self.basis is None:
+            self.basis = _readonly(self.interpolate_basis(
+                self.create_basis(), self.dt, self.dt_max, self.norm))
+            _basis_cache.put(self._key, self.basis)
         self.L = self.basis.shape[0]
 
+    def _cache_key(self):
+        return (self.__class__.__name__, self.B, self.dt, self.dt_max,
+                self.orth, self.norm, self.allow_instantaneous)
+
     @abc.abstractmethod
     def create_basis(self):
         raise NotImplementedError()
 
-    def convolve_with_basis(self, S):
+    def convolve_with_basis(self, S, dtype=np.float64):
         """
-        Convolve each column of the event count matrix with this basis
+        Convolve each column of the event count matrix with this basis.
+        The result is cached (keyed on a hash of S and the dtype) and
+        returned as a read-only array, so copy it before modifying it
+        in place.
+
         :param S:     TxK matrix of inputs.
                       T is the number of time bins
                       K is the number of input dimensions.
+                      If S is a scipy.sparse matrix of event counts, the
+                      impulse responses of the events are summed directly
+                      rather than convolving a dense matrix.
+        :param dtype: Floating point type of the output. The convolutions
+                      are always computed in double precision.
         :return: TxKxB tensor of inputs convolved with bases
         """
+        dtype = np.dtype(dtype)
+        key = getattr(self, "_key", None)
+        if key is not None:
+            key = (key, _hash_counts(S), dtype.str)
+            F = _filtered_cache.get(key)
+            if F is not None:
+                return F
+
         (T,K) = S.shape
         (R,B) = self.basis.shape
 
+        if scipy.sparse.issparse(S):
+            _, t, k, counts = event_counts(S)
+            F = np.zeros((T,K,B))
 
-        # Initialize array for filtered stimulus
-        F = np.empty((T,K,B))
+            # Add the basis at each lag after the events. The (t,k) pairs
+            # are unique so the fancy indexed update does not collide.
+            for r in range(min(R,T)):
+                valid = t + r < T
+                F[t[valid] + r, k[valid]] += counts[valid,None] * self.basis[r]
 
-        # Compute convolutions fo each basis vector, one at a time
-        for b in np.arange(B):
-            F[:,:,b] = sig.fftconvolve(S,
-                                       np.reshape(self.basis[:,b],(R,1)),
-                                       'full')[:T,:]
+            S_min = counts.min() if counts.size > 0 else 0
+            F = F.astype(dtype, copy=False)
+
+        else:
+            # Initialize array for filtered stimulus
+            F = np.empty((T,K,B), dtype=dtype)
+
+            # Compute convolutions fo each basis vector, one at a time
+            for b in np.arange(B):
+                F[:,:,b] = sig.fftconvolve(S,
+                                           np.reshape(self.basis[:,b],(R,1)),
+                                           'full')[:T,:]
+
+            S_min = np.amin(S)
 
         # Check for positivity
-        if np.amin(self.basis) >= 0 and np.amin(S) >= 0:
+        if np.amin(self.basis) >= 0 and S_min >= 0:
             np.clip(F, 0, np.inf, out=F)
             assert np.amin(F) >= 0, "convolution should be >= 0"
 
+        if key is not None:
+            _filtered_cache.put(key, _readonly(F))
+
         return F
 
     def interpolate_basis(self, basis, dt, dt_max,
@@ -103,6 +257,10 @@ class CosineBasis(Basis):
 
         super(CosineBasis, self).__init__(B, dt, dt_max, orth, norm, allow_instantaneous)
 
+    def _cache_key(self):
+        return super(CosineBasis, self)._cache_key() + \
+               (self.n_eye, self.a, self.b, self.L)
+
     def create_basis(self):
         n_pts = self.L              # Number of points at which to evaluate the basis
         n_cos = self.B - self.n_eye # Number of cosine basis functions'
@@ -167,7 +325,15 @@ class IdentityBasis(Basis):
         self.L = dt_max // dt + 1
 
         # Save allow instantaneous
-        self.basis = self.create_basis()
+        self._key = self._cache_key()
+        self.basis = _basis_cache.get(self._key)
+        if self.basis is None:
+            self.basis = _readonly(self.create_basis())
+            _basis_cache.put(self._key, self.basis)
+
+    def _cache_key(self):
+        return (self.__class__.__name__, self.dt, self.dt_max,
+                self.norm, self.allow_instantaneous)
 
 
     def create_basis(self):
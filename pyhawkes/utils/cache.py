@@ -0,0 +1,70 @@
+"""
+Versioned parameters and per-component caches of derived quantities.
+
+The model components expose derived arrays, like W_effective or the
+expectations under the mean field distribution, that are read by every
+data set and every process in a sweep. Components that inherit from
+VersionedParameters get a new version whenever one of their parameters
+is assigned, and methods decorated with cached_by_version are computed
+once per version.
+"""
+import functools
+import itertools
+
+import numpy as np
+
+# Versions are drawn from one global counter, so that a version
+# identifies the parameters of a component across all components
+_versions = itertools.count(1)
+
+
+class VersionedParameters(object):
+    """
+    Mixin for model components with a cache of derived quantities.
+    Assigning any attribute named in _versioned_params gives the
+    component a new version and clears its cache. Code that changes
+    a parameter array in place must call touch() afterwards.
+    """
+    _versioned_params = ()
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._versioned_params:
+            self.touch()
+
+    def touch(self):
+        """
+        Mark the parameters as changed
+        """
+        self.__dict__["version"] = next(_versions)
+        self.__dict__["_derived_cache"] = {}
+
+    def __getstate__(self):
+        # Copies and pickles, e.g. those sent to the parallel workers,
+        # rebuild the cache rather than sharing its read-only arrays
+        state = self.__dict__.copy()
+        state.pop("_derived_cache", None)
+        return state
+
+
+def cached_by_version(method):
+    """
+    Cache the result of a method of a VersionedParameters component
+    until its parameters change. Cached arrays are made read-only,
+    since they are shared by all callers.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if "_derived_cache" not in self.__dict__:
+            self.touch()
+        cache = self.__dict__["_derived_cache"]
+
+        key = (method.__qualname__, args, tuple(sorted(kwargs.items())))
+        if key not in cache:
+            value = method(self, *args, **kwargs)
+            if isinstance(value, np.ndarray):
+                value.setflags(write=False)
+            cache[key] = value
+        return cache[key]
+
+    return wrapper
@@ -0,0 +1,99 @@
+"""
+Thread pools for the per-dataset updates of the network Hawkes models.
+
+Given the global parameters, the parents of different data sets are
+independent, so their updates and their sufficient statistics can be
+computed concurrently. The heavy parent kernels release the GIL, so a
+pool of threads scales with the number of cores even when every data
+set is too small for the OpenMP loops within a kernel to help. When
+using many threads, consider setting OMP_NUM_THREADS=1 so that the
+threads do not compete with the OpenMP loops of the kernels.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the threads of the pools
+_pool_thread = threading.local()
+
+
+def in_pool_thread():
+    """
+    Whether the caller is running as a task of a pool. Kernels with
+    their own OpenMP teams should then use a single thread, so that
+    the pool and the teams do not oversubscribe the cores.
+    """
+    return getattr(_pool_thread, "active", False)
+
+
+class DatasetPool(object):
+    """
+    Map a function over a list of data sets on a pool of threads, and
+    sum the results with a tree reduction. With one thread, everything
+    runs serially in the calling thread, in the order of the data sets.
+    Maps called from within a task of a pool, e.g. over the shards of a
+    data set that is itself being updated on the pool, also run serially,
+    since waiting on the pool from one of its threads could deadlock.
+    """
+    def __init__(self, n_threads=1):
+        """
+        :param n_threads: Number of threads, or None to use one per core
+        """
+        self.n_threads = os.cpu_count() if n_threads is None else n_threads
+        assert self.n_threads >= 1, "n_threads must be positive"
+        self._executor = None
+
+    def __getstate__(self):
+        # Threads cannot be copied or pickled, e.g. with the model
+        # samples, so the executor is recreated on first use
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.n_threads)
+        return self._executor
+
+    def map(self, f, data):
+        """
+        Compute [f(d) for d in data]
+        """
+        data = list(data)
+        if self.n_threads == 1 or len(data) <= 1 or in_pool_thread():
+            return [f(d) for d in data]
+        return list(self._get_executor().map(lambda d: self._run(f, d), data))
+
+    @staticmethod
+    def _run(f, d):
+        _pool_thread.active = True
+        try:
+            return f(d)
+        finally:
+            _pool_thread.active = False
+
+    def sum(self, f, data):
+        """
+        Compute sum([f(d) for d in data]), adding the results pairwise
+        in a balanced tree. This takes log2(len(data)) rounds of
+        additions, each spread over the pool, instead of len(data)
+        additions in the calling thread. Like sum, return 0 if there
+        are no data sets.
+        """
+        stats = self.map(f, data)
+        while len(stats) > 1:
+            summed = self.map(lambda i: stats[i] + stats[i+1],
+                              range(0, len(stats) - 1, 2))
+            if len(stats) % 2 == 1:
+                summed.append(stats[-1])
+            stats = summed
+
+        return stats[0] if len(stats) > 0 else 0
+
+    def shutdown(self):
+        """
+        Stop the threads of the pool
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
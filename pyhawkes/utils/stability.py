@@ -0,0 +1,115 @@
+"""
+Track the spectral radius of the nonnegative weight matrices of the
+network Hawkes models, e.g. to check the stability of every sample.
+"""
+import numpy as np
+import scipy.sparse
+
+
+class SpectralRadiusTracker(object):
+    """
+    Estimate the spectral radius of a sequence of nonnegative KxK
+    matrices, like the effective weights of successive Gibbs samples,
+    with a power iteration warm-started from the leading eigenvector
+    of the previous matrix.
+
+    For nonnegative W and any positive vector x the Collatz-Wielandt
+    bounds give min_i (Wx)_i / x_i <= rho(W) <= max_i (Wx)_i / x_i,
+    which for x = 1 are the min and max row sums. The iteration stops
+    as soon as these bounds answer the question being asked, so a
+    stability check of a sample close to the previous one usually
+    takes only a few matrix-vector products.
+    """
+    def __init__(self, tol=1e-6, maxiter=100):
+        """
+        :param tol:     Relative width of the bounds on the spectral radius
+                        at which the power iteration has converged
+        :param maxiter: Maximum number of power iterations before falling
+                        back to an Arnoldi (or dense) eigensolver
+        """
+        self.tol = tol
+        self.maxiter = maxiter
+
+        # Leading eigenvector of the last matrix
+        self.x = None
+
+    def _check_matrix(self, W):
+        if scipy.sparse.issparse(W):
+            W = scipy.sparse.csr_matrix(W)
+        else:
+            W = np.asarray(W, dtype=np.float64)
+        assert W.ndim == 2 and W.shape[0] == W.shape[1], \
+            "W must be a square matrix"
+        return W
+
+    def _converged(self, lower, upper, threshold):
+        if threshold is not None and (upper < threshold or lower >= threshold):
+            return True
+        return upper - lower <= self.tol * upper
+
+    def bounds(self, W, threshold=None):
+        """
+        Compute lower and upper bounds on the spectral radius of W.
+        Start from the row and column sums and refine them with the
+        shifted power iteration x <- (W + I) x, which also converges for
+        periodic W, until they are within tol of each other or, given a
+        threshold, both on the same side of it.
+
+        :param W:         KxK nonnegative array or scipy.sparse matrix
+        :param threshold: Optional value to compare the spectral radius to
+        :return:          lower, upper
+        """
+        W = self._check_matrix(W)
+        K = W.shape[0]
+
+        row_sums = np.asarray(W.sum(axis=1)).ravel()
+        col_sums = np.asarray(W.sum(axis=0)).ravel()
+        lower = max(row_sums.min(), col_sums.min())
+        upper = min(row_sums.max(), col_sums.max())
+
+        x = self.x if self.x is not None and self.x.shape == (K,) \
+            else np.ones(K) / K
+        for itr in range(self.maxiter):
+            if self._converged(lower, upper, threshold):
+                break
+
+            Wx = W.dot(x)
+            ratio = Wx / x
+            lower = max(lower, ratio.min())
+            upper = min(upper, ratio.max())
+
+            x = x + Wx
+            x /= x.sum()
+
+        self.x = x
+        return lower, upper
+
+    def _exact_spectral_radius(self, W):
+        if W.shape[0] < 100:
+            W = W.toarray() if scipy.sparse.issparse(W) else W
+            return np.amax(np.abs(np.linalg.eigvals(W)))
+
+        from scipy.sparse.linalg import eigs
+        return np.abs(eigs(W, k=1, v0=self.x)[0][0])
+
+    def spectral_radius(self, W):
+        """
+        Estimate the spectral radius of W
+        """
+        W = self._check_matrix(W)
+        lower, upper = self.bounds(W)
+        if self._converged(lower, upper, None):
+            return (lower + upper) / 2.0
+        return self._exact_spectral_radius(W)
+
+    def is_stable(self, W, threshold=1.0):
+        """
+        Check whether the spectral radius of W is less than threshold
+        """
+        W = self._check_matrix(W)
+        lower, upper = self.bounds(W, threshold=threshold)
+        if upper < threshold:
+            return True
+        if lower >= threshold:
+            return False
+        return self._exact_spectral_radius(W) < threshold
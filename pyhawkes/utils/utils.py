@@ -1,5 +1,6 @@
 import os
 import numpy as np
+import scipy.sparse
 
 def initialize_pyrngs():
     from gslrandom import PyRNG, get_omp_num_threads
@@ -40,7 +41,98 @@ def convert_continuous_to_discrete(S, C, dt, T_min, T_max):
         S_dt[:,k] = np.histogram(S[C==k], bins)[0]
 
     assert S_dt.sum() == len(S)
-    return S_dt.astype(np.int)
+    return S_dt.astype(int)
+
+def check_event_counts(S, K):
+    """
+    Check that S is a valid matrix of event counts for K processes and
+    return it either as a dense array or as a scipy.sparse CSC matrix.
+
+    :param S: a TxK integer array of event counts, a TxK scipy.sparse
+              matrix of counts, or a tuple (t, k, counts) of the time bins,
+              processes and counts of the events. For triplets, T is taken
+              to be one more than the last time bin; to specify T, pass
+              scipy.sparse.coo_matrix((counts, (t, k)), shape=(T, K)).
+    :return:  S as a TxK array or CSC matrix of counts
+    """
+
+    if isinstance(S, tuple):
+        t, k, counts = [np.asarray(x) for x in S]
+        T = int(t.max()) + 1 if t.size > 0 else 0
+        S = scipy.sparse.coo_matrix((counts, (t, k)), shape=(T, K))
+
+    if scipy.sparse.issparse(S):
+        S = scipy.sparse.csc_matrix(S)
+        S.sum_duplicates()
+        S.eliminate_zeros()
+        assert S.ndim == 2 and S.shape[1] == K \
+               and np.issubdtype(S.dtype, np.integer) \
+               and (S.nnz == 0 or S.data.min() >= 0), \
+               "Data must be a TxK sparse matrix of event counts"
+        return S
+
+    assert isinstance(S, np.ndarray) and S.ndim == 2 and S.shape[1] == K \
+           and np.amin(S) >= 0 and np.issubdtype(S.dtype, np.integer), \
+           "Data must be a TxK array of event counts"
+    return S
+
+def compact_counts(S):
+    """
+    Store a (checked) TxK array or sparse matrix of event counts with
+    the smallest unsigned integer type that holds them, uint16 if the
+    counts are less than 2**16 and uint32 otherwise.
+    """
+
+    counts = S.data if scipy.sparse.issparse(S) else S
+    S_max = counts.max() if counts.size > 0 else 0
+    dtype = np.uint16 if S_max < 2**16 else np.uint32
+    return S.astype(dtype)
+
+def event_counts(S):
+    """
+    Get the events in a TxK array or sparse matrix of counts as
+    (t, k, count) triplets, sorted by process and then by time bin,
+    without forming a dense matrix of counts.
+
+    :return: T, t, k, counts
+    """
+
+    T, K = S.shape
+    if scipy.sparse.issparse(S):
+        S = scipy.sparse.csc_matrix(S)
+        S.sum_duplicates()
+        S.eliminate_zeros()
+        k = np.repeat(np.arange(K), np.diff(S.indptr))
+        return T, S.indices.astype(np.int64), k, S.data
+
+    k, t = np.nonzero(S.T)
+    return T, t, k, S[t, k]
+
+def candidate_edges(candidates, K):
+    """
+    Get a set of candidate edges of a K process network as arrays of
+    senders and receivers, sorted by receiver and then by sender
+    (i.e. in CSC order).
+
+    :param candidates: a KxK array or scipy.sparse matrix whose nonzero
+                       entries are the candidate edges (e.g. the
+                       thresholded weights of a MAP fit), or a tuple
+                       (rows, cols) of the senders and receivers.
+    :return:           rows, cols
+    """
+
+    if isinstance(candidates, tuple):
+        rows, cols = [np.asarray(x) for x in candidates]
+        candidates = scipy.sparse.coo_matrix(
+            (np.ones(rows.size), (rows, cols)), shape=(K, K))
+
+    C = scipy.sparse.csc_matrix(candidates, dtype=np.float64)
+    assert C.shape == (K, K), "candidates must be a KxK matrix of edges"
+    C.sum_duplicates()
+    C.eliminate_zeros()
+    C.sort_indices()
+    cols = np.repeat(np.arange(K), np.diff(C.indptr))
+    return C.indices.astype(np.int64), cols
 
 def get_unique_file_name(filedir, filename):
     """
@@ -12,38 +12,44 @@ def test_parallel_parent_updates():
     T = 10000
     K = 100
     B = 3
-    S = np.random.poisson(2.0, size=((T,K))).astype(np.int)
+    S = np.random.poisson(2.0, size=((T,K))).astype(np.uint32)
 
-    EZ0 = np.zeros((T,K))
-    EZ  = np.zeros((T,K,K,B))
+    # Pack the events of all processes like DiscreteTimeParents does
+    ks = np.repeat(np.arange(K), T)
+    S = S.T.ravel()
+    EZ = np.zeros((T*K, 1+K*B))
+
+    # Every pair of processes is an edge, sorted by receiver
+    rows              = np.tile(np.arange(K), K)
+    indptr            = np.arange(0, K*K+1, K)
 
     exp_E_log_lambda0 = np.random.gamma(1.0, 1.0, size=(K))
-    exp_E_log_W       = np.random.gamma(1.0, 1.0, size=(K,K))
-    exp_E_log_g       = np.random.gamma(1.0, 1.0, size=(K,K,B))
-    F                 = np.random.gamma(1.0, 1.0, size=(T,K,B))
+    exp_E_log_Wg      = np.random.gamma(1.0, 1.0, size=(K*K,B))
+    F                 = np.random.gamma(1.0, 1.0, size=(T*K,K,B))
 
     for itr in range(1000):
         if itr % 10 == 0:
             print("Iteration\t", itr)
 
-        mf_update_Z(EZ0,
-                    EZ,
+        mf_update_Z(EZ,
                     S,
+                    ks,
                     exp_E_log_lambda0,
-                    exp_E_log_W,
-                    exp_E_log_g,
+                    indptr,
+                    rows,
+                    exp_E_log_Wg,
                     F)
 
         # It looks like the big problem is that check_EZ
         # is done on a single core (slow!)
-        # check_EZ(EZ0, EZ, S)
+        # check_EZ(EZ, S)
 
-def check_EZ(EZ0, EZ, S):
+def check_EZ(EZ, S):
     """
     Check that Z adds up to the correct amount
     :return:
     """
-    EZsum = EZ0 + EZ.sum(axis=(1,3))
+    EZsum = EZ.sum(axis=1)
     # assert np.allclose(self.S, Zsum), "_check_Z failed. Zsum does not add up to S!"
     if not np.allclose(S, EZsum):
         print("_check_Z failed. Zsum does not add up to S!")
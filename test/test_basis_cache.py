@@ -0,0 +1,77 @@
+"""
+Tests for the process-wide basis and filtered data caches
+"""
+import numpy as np
+
+from pyhawkes.utils.basis import CosineBasis, IdentityBasis, \
+    clear_basis_cache, set_basis_cache_size, _filtered_cache
+
+
+def test_shared_basis():
+    clear_basis_cache()
+    basis1 = CosineBasis(3, 1.0, 10.0)
+    basis2 = CosineBasis(3, 1.0, 10.0)
+    basis3 = CosineBasis(3, 1.0, 20.0)
+
+    # Identical parameters share the same read-only basis
+    assert basis1.basis is basis2.basis
+    assert not basis1.basis.flags.writeable
+    assert basis1.L == basis2.L
+    assert basis3.basis is not basis1.basis
+
+    ibasis1 = IdentityBasis(1.0, 10.0)
+    ibasis2 = IdentityBasis(1.0, 10.0)
+    assert ibasis1.basis is ibasis2.basis
+
+def test_filtered_cache():
+    clear_basis_cache()
+    basis = CosineBasis(3, 1.0, 10.0)
+    S = np.random.poisson(0.5, size=(100, 4)).astype(np.int64)
+
+    F1 = basis.convolve_with_basis(S)
+    F2 = basis.convolve_with_basis(S.copy())
+    assert F1 is F2
+    assert not F1.flags.writeable
+
+    # Changing the data must not return a stale result
+    S[0,0] += 1
+    F3 = basis.convolve_with_basis(S)
+    assert F3 is not F1
+    assert not np.allclose(F3, F1)
+
+    # The cached result matches a fresh convolution
+    clear_basis_cache()
+    F4 = CosineBasis(3, 1.0, 10.0).convolve_with_basis(S)
+    assert np.allclose(F3, F4)
+
+def test_filtered_cache_nbytes():
+    clear_basis_cache()
+    basis = CosineBasis(3, 1.0, 10.0)
+    S1 = np.random.poisson(0.5, size=(100, 4)).astype(np.int64)
+    S2 = np.random.poisson(0.5, size=(200, 4)).astype(np.int64)
+    nbytes1 = 100 * 4 * 3 * 8
+    nbytes2 = 200 * 4 * 3 * 8
+
+    try:
+        # Only the most recent data set fits in the budget
+        set_basis_cache_size(filtered_nbytes=nbytes2)
+        F1 = basis.convolve_with_basis(S1)
+        F2 = basis.convolve_with_basis(S2)
+        assert len(_filtered_cache) == 1 and _filtered_cache.nbytes == nbytes2
+        assert basis.convolve_with_basis(S2) is F2
+        assert basis.convolve_with_basis(S1) is not F1
+
+        # Data sets larger than the budget are not cached
+        clear_basis_cache()
+        set_basis_cache_size(filtered_nbytes=nbytes1)
+        basis.convolve_with_basis(S2)
+        assert len(_filtered_cache) == 0 and _filtered_cache.nbytes == 0
+    finally:
+        set_basis_cache_size(filtered_nbytes=256 * 2**20)
+        clear_basis_cache()
+
+
+if __name__ == "__main__":
+    test_shared_basis()
+    test_filtered_cache()
+    test_filtered_cache_nbytes()
@@ -0,0 +1,128 @@
+"""
+Test the weight models restricted to a set of candidate edges
+"""
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.utils.utils import candidate_edges
+
+np.random.seed(0)
+K = 4
+B = 3
+T = 1000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T, keep=False)
+
+# Keep the true edges and a few spurious ones as candidates
+candidates = true_model.weight_model.A.copy()
+candidates[0,:] = 1
+
+def forbid_dense(weight_model):
+    """
+    Make the dense views of the weights and the KxK expectations of the
+    network raise, so that the updates can only use the candidate edges
+    """
+    def _raise(*args, **kwargs):
+        raise AssertionError("Formed a dense KxK array")
+
+    weight_model._to_dense = _raise
+    for name in ["expected_p", "expected_log_p", "expected_log_notp",
+                 "expected_v", "expected_log_v"]:
+        setattr(weight_model.network, name, _raise)
+
+def allow_dense(weight_model):
+    del weight_model._to_dense
+    for name in ["expected_p", "expected_log_p", "expected_log_notp",
+                 "expected_v", "expected_log_v"]:
+        delattr(weight_model.network, name)
+
+def test_candidate_edges():
+    rows, cols = candidate_edges(candidates, K)
+    assert np.all(candidates[rows, cols] > 0)
+    assert rows.size == (candidates > 0).sum()
+    assert np.all(np.diff(cols) >= 0)
+
+    rows2, cols2 = candidate_edges((rows[::-1], cols[::-1]), K)
+    assert np.all(rows2 == rows) and np.all(cols2 == cols)
+
+def test_full_candidates_gibbs():
+    dense_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    sparse_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, weight_hypers=dict(candidates=np.ones((K,K))))
+    sparse_model.weight_model.A = dense_model.weight_model.A
+    sparse_model.weight_model.W = dense_model.weight_model.W
+    sparse_model.impulse_model.g = dense_model.impulse_model.g.copy()
+    sparse_model.bias_model.lambda0 = dense_model.bias_model.lambda0.copy()
+
+    assert np.allclose(sparse_model.W_effective, dense_model.W_effective)
+    assert np.allclose(sparse_model.weight_model.log_probability(),
+                       dense_model.weight_model.log_probability())
+
+    dense_model.add_data(S)
+    sparse_model.add_data(S)
+    assert np.allclose(sparse_model.log_likelihood(), dense_model.log_likelihood())
+
+def test_sparse_gibbs():
+    test_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, weight_hypers=dict(candidates=candidates,
+                                     parallel_resampling=False))
+    test_model.add_data(S)
+    wm = test_model.weight_model
+    for itr in range(10):
+        forbid_dense(wm)
+        test_model.resample_model()
+        allow_dense(wm)
+        assert np.all(test_model.A[candidates == 0] == 0)
+        assert np.isfinite(test_model.log_probability())
+
+    # The statistics of each candidate edge match those of the impulse responses
+    d = test_model.data_list[0]
+    ss = d.compute_weight_ss()
+    assert ss.shape == (2, wm.E)
+    assert np.allclose(ss[0], d.compute_ir_ss().sum(2)[wm.rows, wm.cols])
+    assert np.allclose(ss[1], d.Ns[wm.rows])
+
+    W_sparse = test_model.weight_model.W_effective_sparse
+    assert np.allclose(W_sparse.toarray(), test_model.W_effective)
+    test_model.check_stability()
+
+def test_full_candidates_meanfield():
+    vlbs = []
+    for weight_hypers in [{}, dict(candidates=np.ones((K,K)))]:
+        test_model = DiscreteTimeNetworkHawkesModelGammaMixture(
+            K=K, B=B, weight_hypers=weight_hypers,
+            network_hypers=dict(alpha=6., beta=1.))
+        test_model.add_data(S)
+        vlbs.append([test_model.meanfield_coordinate_descent_step()
+                     for itr in range(10)])
+
+    assert np.allclose(vlbs[0], vlbs[1])
+
+def test_sparse_meanfield():
+    test_model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, weight_hypers=dict(candidates=candidates),
+        network_hypers=dict(alpha=6., beta=1.))
+    test_model.add_data(S)
+    wm = test_model.weight_model
+    vlbs = []
+    for itr in range(10):
+        forbid_dense(wm)
+        vlbs.append(test_model.meanfield_coordinate_descent_step())
+        allow_dense(wm)
+    assert np.all(np.diff(vlbs) > -1e-6)
+
+    # The expectations are stored on the candidate edges
+    E_W = wm.expected_W()
+    assert E_W.shape == (wm.E,)
+    assert np.all(wm.as_dense(E_W)[candidates == 0] == 0)
+    test_model.resample_from_mf()
+    assert np.all(test_model.W_effective[candidates == 0] == 0)
+
+
+if __name__ == "__main__":
+    test_candidate_edges()
+    test_full_candidates_gibbs()
+    test_sparse_gibbs()
+    test_full_candidates_meanfield()
+    test_sparse_meanfield()
@@ -0,0 +1,111 @@
+"""
+Test that storing the filtered data and the variational parents in
+single precision gives the same results as double precision
+"""
+import numpy as np
+import scipy.sparse
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.internals.parent_updates import mf_update_Z, mf_vlb
+
+np.random.seed(0)
+K = 3
+B = 3
+T = 1000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T, keep=False)
+
+def test_compact_filtering():
+    F64 = true_model.basis.convolve_with_basis(S)
+    F32 = true_model.basis.convolve_with_basis(S, dtype=np.float32)
+    assert F32.dtype == np.float32
+    assert np.allclose(F32, F64, rtol=1e-5, atol=1e-6)
+
+    F32_sparse = true_model.basis.convolve_with_basis(
+        scipy.sparse.csr_matrix(S), dtype=np.float32)
+    assert F32_sparse.dtype == np.float32
+    assert np.allclose(F32_sparse, F64, rtol=1e-5, atol=1e-6)
+
+def test_compact_likelihood():
+    compact_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B, dtype=np.float32)
+    compact_model.weight_model.A = true_model.weight_model.A.copy()
+    compact_model.weight_model.W = true_model.weight_model.W.copy()
+    compact_model.impulse_model.g = true_model.impulse_model.g.copy()
+    compact_model.bias_model.lambda0 = true_model.bias_model.lambda0.copy()
+
+    true_model.add_data(S)
+    compact_model.add_data(S)
+    data = compact_model.data_list[0]
+    assert data.F.dtype == np.float32
+    assert data.S.dtype == np.uint16
+    assert data.S_events.dtype == np.uint16
+
+    assert np.allclose(compact_model.log_likelihood(), true_model.log_likelihood(), rtol=1e-5)
+    assert np.allclose(compact_model.heldout_log_likelihood(S),
+                       true_model.heldout_log_likelihood(S), rtol=1e-5)
+    assert np.allclose(compact_model.compute_rate(), true_model.compute_rate(), rtol=1e-5)
+    true_model.data_list.pop()
+
+    # The sampled parents keep the compact type of the counts
+    compact_model.resample_model()
+    data._check_Z()
+    assert data.Z[0].dtype == np.uint16
+
+def test_compact_meanfield():
+    models = []
+    for dtype in [np.float64, np.float32]:
+        np.random.seed(0)
+        model = DiscreteTimeNetworkHawkesModelGammaMixture(
+            K=K, B=B, dtype=dtype, network_hypers=dict(alpha=6., beta=1.))
+        model.add_data(S)
+        assert model.data_list[0].EZ[0].dtype == dtype
+
+        vlbs = []
+        for itr in range(10):
+            vlbs.append(model.meanfield_coordinate_descent_step())
+        models.append((model, np.array(vlbs)))
+
+    (model64, vlbs64), (model32, vlbs32) = models
+    print("VLB (float64): ", vlbs64[-1], "\tVLB (float32): ", vlbs32[-1])
+    assert np.allclose(vlbs32, vlbs64, rtol=1e-4)
+    for EZ32, EZ64 in zip(model32.data_list[0].EZ, model64.data_list[0].EZ):
+        assert np.allclose(EZ32, EZ64, rtol=1e-3, atol=1e-4)
+
+def test_compact_count_kernels():
+    # The Cython kernels take the compact counts without casting them
+    N = 50
+    S16 = np.random.randint(1, 5, size=N).astype(np.uint16)
+    ks = np.zeros(N, dtype=np.int64)
+    F = np.random.rand(N, K, B)
+    exp_E_log_lambda0 = np.random.rand(K)
+    E_log_lambda0, E_lambda0 = np.log(exp_E_log_lambda0), exp_E_log_lambda0
+    Ns = np.zeros(K, dtype=np.int64)
+
+    # Every pair of processes is an edge, sorted by receiver
+    rows, cols = np.tile(np.arange(K), K), np.repeat(np.arange(K), K)
+    indptr = np.searchsorted(cols, np.arange(K+1))
+    exp_E_log_Wg = np.random.rand(K*K, B)
+    E_log_W, E_W = np.log(np.random.rand(K*K)), np.random.rand(K*K)
+
+    results = []
+    for S_events in [S16, S16.astype(np.uint32)]:
+        EZ = np.zeros((N, 1+K*B))
+        vlb = mf_update_Z(EZ, S_events, ks, exp_E_log_lambda0,
+                          indptr, rows, exp_E_log_Wg, F, True)
+        vlb_full = mf_vlb(0, T, EZ, S_events, Ns, E_log_lambda0, E_lambda0,
+                          rows[:K], E_log_W[:K], E_W[:K], np.zeros((K, K, B)), F)
+        results.append((EZ, vlb, vlb_full))
+
+    (EZ16, vlb16, vlb_full16), (EZ32, vlb32, vlb_full32) = results
+    assert np.allclose(EZ16.sum(1), S16)
+    assert np.allclose(EZ16, EZ32)
+    assert np.allclose(vlb16, vlb32)
+    assert np.allclose(vlb_full16, vlb_full32)
+
+
+if __name__ == "__main__":
+    test_compact_filtering()
+    test_compact_likelihood()
+    test_compact_meanfield()
+    test_compact_count_kernels()
@@ -0,0 +1,69 @@
+"""
+Test the thread pool over data sets
+"""
+import copy
+import pickle
+
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.utils.parallel import DatasetPool, in_pool_thread
+
+np.random.seed(0)
+K = 3
+B = 3
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+Ss = [true_model.generate(T=200, keep=False)[0] for _ in range(7)]
+
+def test_tree_sum():
+    pool = DatasetPool(n_threads=4)
+    xs = [np.random.rand(2, K, K) for _ in range(11)]
+    assert np.allclose(pool.sum(lambda x: 2 * x, xs), 2 * sum(xs))
+    assert np.allclose(pool.sum(lambda x: x, xs[:1]), xs[0])
+    assert pool.sum(lambda x: x, []) == 0
+    assert pool.map(lambda x: x + 1, range(5)) == [1, 2, 3, 4, 5]
+
+    # Tasks know they run on the pool, e.g. to run their kernels serially
+    assert not in_pool_thread()
+    assert all(pool.map(lambda x: in_pool_thread(), range(5)))
+    assert not in_pool_thread()
+
+    # The pool can be copied and pickled, e.g. with the model samples
+    pool2 = pickle.loads(pickle.dumps(copy.deepcopy(pool)))
+    assert np.allclose(pool2.sum(lambda x: x, xs), sum(xs))
+    pool.shutdown()
+
+def test_threaded_meanfield():
+    vlbs = []
+    for n_threads in [1, 4]:
+        np.random.seed(1)
+        test_model = DiscreteTimeNetworkHawkesModelGammaMixture(
+            K=K, B=B, n_threads=n_threads,
+            network_hypers=dict(alpha=6., beta=1.))
+        for S in Ss:
+            test_model.add_data(S)
+        vlbs.append([test_model.meanfield_coordinate_descent_step()
+                     for itr in range(5)])
+
+    assert np.allclose(vlbs[0], vlbs[1])
+
+def test_threaded_gibbs():
+    test_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, n_threads=4, weight_hypers=dict(parallel_resampling=False))
+    for S in Ss:
+        test_model.add_data(S)
+
+    samples = []
+    for itr in range(5):
+        test_model.resample_model()
+        assert np.isfinite(test_model.log_likelihood())
+        samples.append(test_model.copy_sample())
+
+    assert samples[-1].data_pool.n_threads == 4
+
+
+if __name__ == "__main__":
+    test_tree_sum()
+    test_threaded_meanfield()
+    test_threaded_gibbs()
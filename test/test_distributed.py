@@ -0,0 +1,93 @@
+"""
+Test the data-parallel model against the serial model
+"""
+import copy
+import multiprocessing
+from multiprocessing.connection import Listener
+
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.distributed import DataParallelModel, ConnectionTransport, serve
+
+np.random.seed(0)
+K = 3
+B = 3
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+Ss = [true_model.generate(T=200, keep=False)[0] for _ in range(5)]
+
+def test_distributed_meanfield():
+    model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, network_hypers=dict(alpha=6., beta=1.))
+    serial_model = copy.deepcopy(model)
+    for S in Ss:
+        serial_model.add_data(S)
+    serial_vlbs = [serial_model.meanfield_coordinate_descent_step()
+                   for itr in range(5)]
+
+    with DataParallelModel(model, n_workers=2) as parallel_model:
+        for S in Ss:
+            parallel_model.add_data(S)
+        assert parallel_model.shard_sizes.tolist() == [3, 2]
+        parallel_vlbs = [parallel_model.meanfield_coordinate_descent_step()
+                         for itr in range(5)]
+
+        assert np.allclose(parallel_vlbs, serial_vlbs)
+        assert np.allclose(parallel_model.weight_model.expected_W(),
+                           serial_model.weight_model.expected_W())
+
+def test_distributed_gibbs():
+    model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, weight_hypers=dict(joint_resampling=True))
+
+    with DataParallelModel(model, n_workers=2) as parallel_model:
+        for S in Ss:
+            parallel_model.add_data(S)
+
+        samples = []
+        for itr in range(5):
+            parallel_model.resample_model()
+            samples.append(parallel_model.copy_sample())
+
+            # The workers evaluate the likelihood with the sampled parameters
+            serial_model = samples[-1]
+            for S in Ss:
+                serial_model.add_data(S)
+            assert np.allclose(parallel_model.log_likelihood(),
+                               serial_model.log_likelihood())
+
+def test_connection_transport():
+    listener = Listener(("localhost", 0), authkey=b"pyhawkes")
+    workers = [multiprocessing.Process(target=serve,
+                                       args=(listener.address, b"pyhawkes"))
+               for _ in range(2)]
+    for w in workers:
+        w.start()
+    transport = ConnectionTransport.accept(listener, 2)
+    listener.close()
+
+    model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, network_hypers=dict(alpha=6., beta=1.))
+    with DataParallelModel(model, transport) as parallel_model:
+        for S in Ss:
+            parallel_model.add_data(S)
+        vlbs = [parallel_model.meanfield_coordinate_descent_step()
+                for itr in range(5)]
+        assert np.all(np.diff(vlbs) > -1e-6)
+
+        # Errors on the workers are raised on the master
+        try:
+            parallel_model.add_data(np.zeros((10, K+1)))
+            assert False, "Adding data with the wrong shape should fail"
+        except RuntimeError:
+            pass
+
+    for w in workers:
+        w.join()
+
+
+if __name__ == "__main__":
+    test_distributed_meanfield()
+    test_distributed_gibbs()
+    test_connection_transport()
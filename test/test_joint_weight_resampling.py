@@ -0,0 +1,66 @@
+"""
+Test the collapsed joint resampling of the spike-and-slab weights
+"""
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab
+
+np.random.seed(0)
+K = 4
+B = 3
+T = 1000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T, keep=False)
+
+def test_collapsed_sample():
+    weight_model = true_model.weight_model
+    p, kappa, v = 0.3, 2.0, 4.0
+
+    # Without parents, A=1 with probability p (v/(v+N))^kappa / Z
+    N = 5.0
+    E = 20000
+    ss = np.zeros((2, E))
+    ss[1] = N
+    A, W = weight_model._collapsed_sample_A_W(ss, p, kappa, v)
+    r = p * (v / (v + N))**kappa
+    assert np.allclose(A.mean(), r / (r + 1 - p), atol=0.02)
+
+    # and the weights of absent edges come from the prior
+    assert np.allclose(W[~A].mean(), kappa / v, rtol=0.05)
+
+    # Edges with parents are always present
+    ss[0] = 1.0
+    A, W = weight_model._collapsed_sample_A_W(ss, p, kappa, v)
+    assert np.all(A)
+    assert np.allclose(W.mean(), (kappa + 1) / (v + N), rtol=0.05)
+
+def _check_joint_gibbs(test_model):
+    test_model.add_data(S)
+    for itr in range(10):
+        test_model.resample_model()
+        assert np.isfinite(test_model.log_probability())
+
+        # Every edge with parent assignments must be present
+        wm = test_model.weight_model
+        ss = sum([d.compute_weight_ss() for d in test_model.data_list])
+        assert np.all(test_model.A[wm.rows, wm.cols][ss[0] > 0])
+
+def test_joint_gibbs():
+    test_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, weight_hypers=dict(joint_resampling=True))
+    _check_joint_gibbs(test_model)
+
+def test_sparse_joint_gibbs():
+    candidates = np.ones((K,K))
+    candidates[0,1:] = 0
+    test_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(
+        K=K, B=B, weight_hypers=dict(candidates=candidates,
+                                     joint_resampling=True))
+    _check_joint_gibbs(test_model)
+    assert np.all(test_model.A[candidates == 0] == 0)
+
+
+if __name__ == "__main__":
+    test_collapsed_sample()
+    test_joint_gibbs()
+    test_sparse_joint_gibbs()
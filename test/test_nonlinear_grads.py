@@ -0,0 +1,167 @@
+from scipy.optimize import check_grad
+import numpy as np
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab
+from pyhawkes.standard_models import StandardHawkesProcess, \
+    ReluNonlinearHawkesProcess, ExpNonlinearHawkesProcess, \
+    HomogeneousPoissonProcess
+
+def test_nonlinear_gradients():
+    np.random.seed(0)
+    K = 2
+    B = 3
+    T = 1000
+    true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    S,R = true_model.generate(T=T)
+
+    for cls in [StandardHawkesProcess, ReluNonlinearHawkesProcess, ExpNonlinearHawkesProcess]:
+        test_model = cls(K=K, B=B, sigma=10.0, lmbda=1.0)
+        test_model.add_data(S)
+        test_model.initialize_to_background_rate()
+        node = test_model.nodes[0]
+        w0 = node.w + 0.01 * np.random.rand(*node.w.shape)
+
+        print("Checking gradient of ", cls.__name__)
+        err = check_grad(node.objective, node.gradient, w0) \
+              / np.linalg.norm(node.gradient(w0))
+        print(err)
+        assert err < 1e-3
+
+        # Compare the Hessian-vector product to finite differences of the gradient
+        print("Checking Hessian-vector product of ", cls.__name__)
+        v = np.random.randn(*w0.shape)
+        eps = 1e-6
+        Hv_fd = (node.gradient(w0 + eps * v) - node.gradient(w0 - eps * v)) / (2 * eps)
+        Hv = node.hessian_vector_product(w0, v)
+        print(np.amax(abs(Hv - Hv_fd)))
+        assert np.allclose(Hv, Hv_fd, rtol=1e-3, atol=1e-3)
+
+        # Newton and coordinate descent should do at least as well as BFGS
+        bfgs_model = test_model.copy_sample()
+        bfgs_model.add_data(S)
+        bfgs_model.initialize_to_background_rate()
+        bfgs_model.fit_with_bfgs()
+
+        cd_model = test_model.copy_sample()
+        cd_model.add_data(S)
+        cd_model.initialize_to_background_rate()
+        cd_model.fit_with_coordinate_descent()
+
+        test_model.fit_with_newton()
+        obj_bfgs = sum([n.objective(n.w) for n in bfgs_model.nodes])
+        obj_newton = sum([n.objective(n.w) for n in test_model.nodes])
+        obj_cd = sum([n.objective(n.w) for n in cd_model.nodes])
+        print("BFGS: ", obj_bfgs, "\tNewton: ", obj_newton, "\tCD: ", obj_cd)
+        assert obj_newton < obj_bfgs + 1e-4
+        assert obj_cd < obj_bfgs + 1e-4
+
+def test_coordinate_descent_sparsity():
+    np.random.seed(0)
+    K = 4
+    B = 3
+    T = 5000
+    true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    S,R = true_model.generate(T=T)
+
+    # A large penalty should set most of the weights exactly to zero
+    test_model = ReluNonlinearHawkesProcess(K=K, B=B, lmbda=100.0)
+    test_model.add_data(S)
+    test_model.initialize_to_background_rate()
+    test_model.fit_with_coordinate_descent()
+    n_zero = (test_model.weights[1:] == 0).sum()
+    print("Zero weights: ", n_zero, " of ", K * B * K)
+    assert n_zero > 0
+
+def test_fit_keywords():
+    np.random.seed(0)
+    K = 2
+    B = 3
+    T = 1000
+    true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    S,R = true_model.generate(T=T)
+
+    # The homogeneous nodes accept the keywords of the other nodes
+    for cls in [StandardHawkesProcess, HomogeneousPoissonProcess]:
+        test_model = cls(K=K, B=B)
+        test_model.add_data(S)
+        test_model.initialize_to_background_rate()
+        test_model.fit_with_newton(max_iter=5, tol=1e-4, verbose=True, print_interval=1)
+        models, lls, _ = test_model.fit_path([1.0, 10.0], method="newton", max_iter=5)
+        assert len(models) == 2 and np.all(np.isfinite(lls))
+
+        test_model.fit_with_coordinate_descent(max_iter=5, n_passes=2,
+                                               verbose=True, print_interval=1)
+        models, lls, _ = test_model.fit_path([1.0, 10.0], n_passes=2)
+        assert len(models) == 2 and np.all(np.isfinite(lls))
+
+def test_joint_bfgs():
+    np.random.seed(0)
+    K = 3
+    B = 3
+    T = 1000
+    true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    S,R = true_model.generate(T=T)
+
+    for cls in [StandardHawkesProcess, ReluNonlinearHawkesProcess, ExpNonlinearHawkesProcess]:
+        # Without the L1 penalty the objective is smooth, so both
+        # fits should reach the same objective
+        test_model = cls(K=K, B=B, sigma=10.0, lmbda=0.0)
+        test_model.add_data(S)
+        test_model.initialize_to_background_rate()
+        W0 = test_model.weights + 0.01 * np.random.rand(*test_model.weights.shape)
+
+        # The joint objective stacks the objectives of the nodes
+        print("Checking joint objective of ", cls.__name__)
+        obj, g = test_model.joint_objective_and_gradient(W0)
+        assert np.allclose(obj, test_model.joint_objective(W0))
+        for k, node in enumerate(test_model.nodes):
+            assert np.allclose(obj[k], node.objective(W0[:,k]))
+            assert np.allclose(g[:,k], node.gradient(W0[:,k]))
+
+        # Joint BFGS should do as well as fitting each node with BFGS
+        bfgs_model = test_model.copy_sample()
+        bfgs_model.add_data(S)
+        bfgs_model.initialize_to_background_rate()
+        bfgs_model.fit_with_bfgs()
+
+        test_model.fit_with_joint_bfgs()
+        obj_bfgs = sum([n.objective(n.w) for n in bfgs_model.nodes])
+        obj_joint = sum([n.objective(n.w) for n in test_model.nodes])
+        print("BFGS: ", obj_bfgs, "\tJoint BFGS: ", obj_joint)
+        assert obj_joint < obj_bfgs + 1e-4
+
+def test_fit_path():
+    np.random.seed(0)
+    K = 3
+    B = 3
+    T = 2000
+    true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    S,R = true_model.generate(T=T)
+    S_train, S_test = S[:T//2], S[T//2:]
+
+    lmbdas = [1.0, 100.0, 10.0]
+    test_model = ReluNonlinearHawkesProcess(K=K, B=B, sigma=10.0)
+    test_model.add_data(S_train)
+    test_model.initialize_to_background_rate()
+    models, lls, hlls = test_model.fit_path(lmbdas, S_heldout=S_test)
+
+    # The warm started path should match fitting each penalty from scratch
+    for lmbda, model, ll, hll in zip(lmbdas, models, lls, hlls):
+        cold_model = ReluNonlinearHawkesProcess(K=K, B=B, sigma=10.0, lmbda=lmbda)
+        cold_model.add_data(S_train)
+        cold_model.initialize_to_background_rate()
+        cold_model.fit_with_coordinate_descent()
+
+        obj_path = cold_model.joint_objective(model.weights).sum()
+        obj_cold = cold_model.joint_objective(cold_model.weights).sum()
+        print("lambda: ", lmbda, "\tPath: ", obj_path, "\tCold: ", obj_cold)
+        assert np.allclose(obj_path, obj_cold, atol=1e-4)
+        assert np.allclose(ll, cold_model.log_likelihood(), rtol=1e-3)
+        assert np.allclose(hll, model.heldout_log_likelihood(S_test))
+
+
+if __name__ == "__main__":
+    test_nonlinear_gradients()
+    test_coordinate_descent_sparsity()
+    test_fit_keywords()
+    test_joint_bfgs()
+    test_fit_path()
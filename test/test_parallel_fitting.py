@@ -0,0 +1,60 @@
+"""
+Test that fitting the processes in parallel worker processes gives
+the same weights as fitting them serially
+"""
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeStandardHawkesModel
+from pyhawkes.standard_models import ReluNonlinearHawkesProcess
+
+np.random.seed(0)
+K = 3
+B = 3
+T = 1000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T, keep=False)
+
+def test_parallel_standard_model():
+    weights = []
+    for n_jobs in [1, 2]:
+        model = DiscreteTimeStandardHawkesModel(K=K, B=B, alpha=1.0, beta=1.0)
+        model.add_data(S)
+        model.initialize_to_background_rate()
+        model.fit_with_bfgs(n_jobs=n_jobs, verbose=False)
+        weights.append(model.weights.copy())
+
+    assert np.allclose(weights[0], weights[1])
+
+def test_process_copy():
+    model = DiscreteTimeStandardHawkesModel(K=K, B=B, alpha=1.0, beta=1.0)
+    model.add_data(S)
+    model.initialize_to_background_rate()
+
+    # The copy sent to a worker only keeps the events of its process
+    for k in range(K):
+        model_k = model._copy_for_process(k)
+        data_k = model_k.data_list[0]
+        assert data_k.F is None and data_k.S is None
+        assert all([len(data_k.Fs[j]) == 0 for j in range(K) if j != k])
+        assert np.allclose(model_k.log_posterior_and_gradient(k)[0],
+                           model.log_posterior_and_gradient(k)[0])
+        assert np.allclose(model_k.log_posterior_and_gradient(k)[1],
+                           model.log_posterior_and_gradient(k)[1])
+
+def test_parallel_nonlinear_model():
+    weights = []
+    for n_jobs in [1, 2]:
+        model = ReluNonlinearHawkesProcess(K=K, B=B, lmbda=1.0)
+        model.add_data(S)
+        model.initialize_to_background_rate()
+        model.fit_with_coordinate_descent(n_jobs=n_jobs)
+        weights.append(model.weights.copy())
+
+    assert np.allclose(weights[0], weights[1])
+
+
+if __name__ == "__main__":
+    test_parallel_standard_model()
+    test_process_copy()
+    test_parallel_nonlinear_model()
@@ -0,0 +1,109 @@
+"""
+Test the Cython mean field parent update against the python reference
+"""
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.internals.parents import DiscreteTimeParents
+
+np.random.seed(0)
+K = 3
+B = 3
+T = 1000
+
+def test_mf_update_Z():
+    for dtype in [np.float64, np.float32]:
+        model = DiscreteTimeNetworkHawkesModelGammaMixture(
+            K=K, B=B, dtype=dtype, network_hypers=dict(alpha=6., beta=1.))
+        S, _ = model.generate(T=T)
+        parents = model.data_list[0]
+
+        parents._mf_update_Z_python()
+        EZ_python = [EZk.copy() for EZk in parents.EZ]
+
+        parents._mf_update_Z()
+        parents._check_EZ()
+        for EZk, EZk_python in zip(parents.EZ, EZ_python):
+            assert EZk.dtype == dtype
+            assert np.allclose(EZk, EZk_python, rtol=1e-4, atol=1e-5)
+
+def test_mf_update_vlb():
+    model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, network_hypers=dict(alpha=6., beta=1.))
+    S, _ = model.generate(T=T)
+    parents = model.data_list[0]
+
+    # The VLB accumulated during the update matches a separate pass
+    for update in [parents._mf_update_Z, parents._mf_update_Z_python]:
+        vlb = update(compute_vlb=True)
+        print(vlb, parents.get_vlb(), parents.get_vlb_python())
+        assert np.allclose(vlb, parents.get_vlb())
+        assert np.allclose(vlb, parents.get_vlb_python())
+
+    # The fast VLB is evaluated after the parent update and before the
+    # global updates, so it lies between the full VLBs of consecutive steps
+    vlb_full = model.meanfield_coordinate_descent_step(fast_vlb=False)
+    for itr in range(10):
+        vlb_fast = model.meanfield_coordinate_descent_step()
+        assert vlb_fast > vlb_full - 1e-6
+        vlb_full = model.get_vlb()
+        assert vlb_full > vlb_fast - 1e-6
+
+def test_minibatches():
+    model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, network_hypers=dict(alpha=6., beta=1.))
+    S, _ = model.generate(T=T)
+    data = model.data_list[0]
+    minibatchsize = 300
+
+    # The minibatch views match parents built from slices of the data
+    minibatches = data.minibatches(minibatchsize)
+    assert len(minibatches) == 4
+    assert data.minibatches(minibatchsize) is minibatches
+    for i, p in enumerate(minibatches):
+        start, end = i * minibatchsize, min((i+1) * minibatchsize, T)
+        p_slice = DiscreteTimeParents(model, end-start, S[start:end], data.F[start:end])
+        assert p.T == p_slice.T
+        assert np.all(p.Ns == p_slice.Ns)
+        for attr in ["ts", "Ss", "Fs"]:
+            for x, x_slice in zip(getattr(p, attr), getattr(p_slice, attr)):
+                assert np.all(x == x_slice)
+
+        p.meanfieldupdate()
+        p_slice.meanfieldupdate()
+        for EZk, EZk_slice in zip(p.EZ, p_slice.EZ):
+            assert np.allclose(EZk, EZk_slice)
+
+    # SVI steps reuse the same minibatches
+    for itr in range(10):
+        model.sgd_step(minibatchsize, stepsize=0.1)
+    assert data.minibatches(minibatchsize) is minibatches
+
+def test_multiple_dataset_svi():
+    model = DiscreteTimeNetworkHawkesModelGammaMixture(
+        K=K, B=B, network_hypers=dict(alpha=6., beta=1.))
+    for T_data in [1000, 200, 50]:
+        model.generate(T=T_data)
+    minibatchsize = 100
+
+    # With proportional sampling, the minibatch fractions are the
+    # fractions of all the time bins in each minibatch
+    probs, datasets, indices = model._sgd_minibatch_probs(minibatchsize, True)
+    assert len(probs) == 10 + 2 + 1
+    assert np.allclose(probs, [100. / 1250] * 12 + [50. / 1250])
+
+    # Otherwise each data set is equally likely
+    probs, datasets, indices = model._sgd_minibatch_probs(minibatchsize, False)
+    for d in range(3):
+        assert np.allclose(probs[datasets == d].sum(), 1. / 3)
+
+    for itr in range(10):
+        model.sgd_step(minibatchsize, stepsize=0.1)
+        assert np.all(np.isfinite(model.bias_model.mf_alpha))
+
+
+if __name__ == "__main__":
+    test_mf_update_Z()
+    test_mf_update_vlb()
+    test_minibatches()
+    test_multiple_dataset_svi()
@@ -0,0 +1,90 @@
+"""
+Test the streaming posterior summaries against stored samples
+"""
+import pickle
+
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    ContinuousTimeNetworkHawkesModel
+from pyhawkes.posterior import PosteriorAccumulator
+
+np.random.seed(0)
+K = 3
+B = 3
+
+def _random_parameters(model):
+    model.weight_model.A = np.random.rand(K,K) < 0.5
+    model.weight_model.W = np.random.gamma(1.0, 1.0, size=(K,K))
+    model.bias_model.lambda0 = np.random.gamma(1.0, 1.0, size=K)
+
+def test_running_moments():
+    model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    edges = np.ones((K,K))
+    posterior = PosteriorAccumulator(model, burnin=5,
+                                     parameters=dict(p="network.p"),
+                                     cooccurrence_edges=edges)
+
+    As, W_effs, lambda0s = [], [], []
+    for itr in range(50):
+        _random_parameters(model)
+        posterior.update()
+        if itr >= 5:
+            As.append(model.A.astype(np.float64))
+            W_effs.append(model.W_effective.copy())
+            lambda0s.append(model.lambda0.copy())
+
+    assert posterior.N == 45
+    assert np.allclose(posterior.edge_probabilities, np.mean(As, axis=0))
+    assert np.allclose(posterior.mean("W_effective"), np.mean(W_effs, axis=0))
+    assert np.allclose(posterior.var("lambda0"), np.var(lambda0s, axis=0, ddof=1))
+    assert np.allclose(posterior.mean("p"), model.network.p)
+
+    As = np.array(As).reshape((-1, K*K))
+    rows, cols = posterior.cooccurrence_edges
+    As = As[:, rows * K + cols]
+    assert np.allclose(posterior.cooccurrence_probabilities,
+                       As.T.dot(As) / len(As))
+
+    # The summaries can be pickled without the model
+    posterior2 = pickle.loads(pickle.dumps(posterior))
+    assert posterior2.model is None
+    assert np.allclose(posterior2.mean("W"), posterior.mean("W"))
+
+def test_snapshots():
+    model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    posterior = PosteriorAccumulator(model, n_snapshots=4, thin=1)
+
+    lambda0s = []
+    for itr in range(19):
+        _random_parameters(model)
+        posterior.update()
+        lambda0s.append(model.lambda0.copy())
+
+        # The snapshots are evenly spaced over the chain so far
+        snapshots, samples = posterior.get_snapshots("lambda0")
+        assert 1 <= len(samples) <= 4
+        assert np.all(samples == posterior.thin * np.arange(1, len(samples)+1))
+        assert np.allclose(snapshots, np.array(lambda0s)[samples - 1])
+
+    assert posterior.thin == 4
+
+    # The accumulator can be indexed like a list of the snapshots
+    snapshots, samples = posterior.get_snapshots("lambda0")
+    assert len(posterior) == len(samples)
+    assert np.allclose(posterior[-1]["lambda0"], snapshots[-1])
+    assert np.allclose(posterior[0]["lambda0"], lambda0s[samples[0] - 1])
+
+def test_continuous_time():
+    model = ContinuousTimeNetworkHawkesModel(K=K)
+    posterior = PosteriorAccumulator(model)
+    for itr in range(3):
+        posterior.update()
+    assert np.allclose(posterior.mean("mu"), model.impulse_model.mu)
+    assert np.allclose(posterior.var("tau"), 0)
+
+
+if __name__ == "__main__":
+    test_running_moments()
+    test_snapshots()
+    test_continuous_time()
@@ -0,0 +1,113 @@
+"""
+Test the block statistics of the Gibbs sampled and mean field
+stochastic block models
+"""
+import numpy as np
+import scipy.sparse
+
+from pyhawkes.internals.network import GibbsSBM, MeanFieldSBM
+
+def test_block_stats():
+    K = 50
+    C = 4
+    network = GibbsSBM(K, C)
+    A = np.random.rand(K,K) < 0.3
+    W = np.random.gamma(2.0, 1.0, size=(K,K))
+
+    n_edges, n_nonedges, W_sum = network._block_stats(A, W)
+    for c1 in range(C):
+        for c2 in range(C):
+            Ac1c2 = A[np.ix_(network.c==c1, network.c==c2)]
+            Wc1c2 = W[np.ix_(network.c==c1, network.c==c2)]
+            assert n_edges[c1,c2] == Ac1c2.sum()
+            assert n_nonedges[c1,c2] == (1-Ac1c2).sum()
+            assert np.allclose(W_sum[c1,c2], Wc1c2[Ac1c2].sum())
+
+def test_resample_c():
+    K = 50
+    C = 2
+    c = np.arange(C).repeat(K // C)
+
+    # Blocks with very different connection probabilities
+    # should be recovered after a few sweeps
+    p = np.array([[0.9, 0.05], [0.05, 0.9]])
+    A = np.random.rand(K,K) < p[np.ix_(c,c)]
+    W = np.random.gamma(1.0, 1.0, size=(K,K))
+
+    network = GibbsSBM(K, C)
+    network.p = p
+    network.v = np.ones((C,C))
+    for itr in range(5):
+        network.resample_c(A, W)
+
+    agree = (network.c == c).mean()
+    assert max(agree, 1 - agree) == 1.0
+
+def test_mf_averages():
+    K = 20
+    C = 3
+    network = MeanFieldSBM(K, C)
+    network.mf_tau1 = np.random.gamma(1.0, 1.0, size=(C,C))
+
+    # Compare to the explicit sum over pairs of blocks
+    E_p = np.zeros((K,K))
+    for c1 in range(C):
+        for c2 in range(C):
+            pc1c2 = network.mf_m[:,c1][:, None] * network.mf_m[:,c2][None, :]
+            E_p += pc1c2 * network.mf_tau1[c1,c2] / (network.mf_tau0[c1,c2] + network.mf_tau1[c1,c2])
+    assert np.allclose(network.expected_p(), E_p)
+
+    # The averages on a list of edges match the KxK averages
+    rows, cols = np.random.randint(K, size=(2, 30))
+    E_ln_p, E_ln_notp, E_v, E_ln_v = network.expected_on_edges(rows, cols)
+    assert np.allclose(E_ln_p, network.expected_log_p()[rows, cols])
+    assert np.allclose(E_ln_notp, network.expected_log_notp()[rows, cols])
+    assert np.allclose(E_v, network.expected_v()[rows, cols])
+    assert np.allclose(E_ln_v, network.expected_log_v()[rows, cols])
+
+    E_A = np.random.rand(K,K)
+    E_W = np.random.gamma(2.0, 1.0, size=(K,K))
+    network.mf_update_c(E_A, E_W)
+    assert np.allclose(network.mf_m.sum(1), 1.0)
+
+def test_sparse_stats():
+    K = 30
+    C = 3
+    A = np.random.rand(K,K) < 0.2
+    W = np.random.gamma(2.0, 1.0, size=(K,K))
+
+    # Gibbs updates see the same statistics with dense or sparse inputs
+    network = GibbsSBM(K, C)
+    for dense, sparse in zip(network._block_stats(A, W),
+                             network._block_stats(scipy.sparse.csc_matrix(A),
+                                                  scipy.sparse.csc_matrix(A * W))):
+        assert np.allclose(dense, sparse)
+
+    c = network.c.copy()
+    np.random.seed(0)
+    network.resample_c(A, W)
+    c_dense = network.c.copy()
+    network.c = c
+    np.random.seed(0)
+    network.resample_c(scipy.sparse.csc_matrix(A), scipy.sparse.csc_matrix(A * W))
+    assert np.all(network.c == c_dense)
+
+    # and so do the mean field updates
+    network = MeanFieldSBM(K, C)
+    E_A = A * np.random.rand(K,K)
+    mf_m = network.mf_m.copy()
+    network.mf_update_p(E_A)
+    network.mf_update_c(E_A, W, stepsize=0.5)
+    tau1, m_dense = network.mf_tau1.copy(), network.mf_m.copy()
+    network.mf_m = mf_m
+    network.mf_update_p(scipy.sparse.csc_matrix(E_A))
+    network.mf_update_c(scipy.sparse.csc_matrix(E_A), scipy.sparse.csc_matrix(A * W), stepsize=0.5)
+    assert np.allclose(network.mf_tau1, tau1)
+    assert np.allclose(network.mf_m, m_dense)
+
+
+if __name__ == "__main__":
+    test_block_stats()
+    test_resample_c()
+    test_mf_averages()
+    test_sparse_stats()
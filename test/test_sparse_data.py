@@ -0,0 +1,75 @@
+"""
+Test that sparse count matrices and (t, k, count) triplets give the
+same results as dense count matrices
+"""
+import numpy as np
+import scipy.sparse
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeStandardHawkesModel
+from pyhawkes.standard_models import ReluNonlinearHawkesProcess
+
+K = 3
+B = 3
+T = 1000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T)
+
+# Make sure the last time bin has an event so that the
+# triplets have the same number of time bins as S
+S[-1,0] += 1
+t, k = np.nonzero(S)
+sparse_forms = [scipy.sparse.csr_matrix(S),
+                scipy.sparse.csc_matrix(S),
+                (t, k, S[t,k])]
+
+def test_sparse_filtering():
+    F = true_model.basis.convolve_with_basis(S)
+    F_sparse = true_model.basis.convolve_with_basis(scipy.sparse.csr_matrix(S))
+    assert np.allclose(F, F_sparse)
+
+def test_sparse_network_model():
+    true_model.add_data(S)
+    ll = true_model.log_likelihood()
+    hll = true_model.heldout_log_likelihood(S)
+    true_model.data_list.pop()
+
+    for S_sparse in sparse_forms:
+        true_model.add_data(S_sparse)
+        assert np.allclose(true_model.log_likelihood(), ll)
+        assert np.allclose(true_model.heldout_log_likelihood(S_sparse), hll)
+        true_model.data_list.pop()
+
+def test_sparse_standard_model():
+    test_model = DiscreteTimeStandardHawkesModel(K=K, B=B)
+    test_model.add_data(S)
+    ll = test_model.log_likelihood()
+    grad = test_model.compute_gradients()
+
+    for S_sparse in sparse_forms:
+        test_model.data_list = []
+        test_model.add_data(S_sparse)
+        assert np.allclose(test_model.log_likelihood(), ll)
+        assert np.allclose(test_model.compute_gradients(), grad)
+
+def test_sparse_nonlinear_model():
+    test_model = ReluNonlinearHawkesProcess(K=K, B=B)
+    test_model.add_data(S)
+    test_model.initialize_to_background_rate()
+    ll = test_model.log_likelihood()
+    obj, grad = test_model.joint_objective_and_gradient(test_model.weights)
+
+    for S_sparse in sparse_forms:
+        test_model.remove_data(0)
+        test_model.add_data(S_sparse)
+        assert np.allclose(test_model.log_likelihood(), ll)
+        obj_sparse, grad_sparse = test_model.joint_objective_and_gradient(test_model.weights)
+        assert np.allclose(obj_sparse, obj)
+        assert np.allclose(grad_sparse, grad)
+
+
+if __name__ == "__main__":
+    test_sparse_filtering()
+    test_sparse_network_model()
+    test_sparse_standard_model()
+    test_sparse_nonlinear_model()
@@ -0,0 +1,63 @@
+"""
+Test the spectral radius tracker used to check the stability of the models
+"""
+import numpy as np
+import scipy.sparse
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeStandardHawkesModel
+from pyhawkes.utils.stability import SpectralRadiusTracker
+
+
+def test_spectral_radius():
+    tracker = SpectralRadiusTracker()
+    for K in [1, 5, 50, 200]:
+        # Keep the diagonal so that the spectral radius is positive
+        mask = (np.random.rand(K,K) < 0.2) | np.eye(K, dtype=bool)
+        W = np.random.gamma(1.0, 1.0, size=(K,K)) * mask
+        rho = np.amax(np.abs(np.linalg.eigvals(W)))
+        assert np.allclose(tracker.spectral_radius(W), rho, rtol=1e-5)
+        assert np.allclose(tracker.spectral_radius(scipy.sparse.csr_matrix(W)), rho, rtol=1e-5)
+
+        lower, upper = tracker.bounds(W, threshold=0.5 * rho)
+        assert lower <= rho * (1 + 1e-8) and upper >= rho * (1 - 1e-8)
+        assert tracker.is_stable(W, threshold=1.01 * rho)
+        assert not tracker.is_stable(W, threshold=0.99 * rho)
+
+    # A periodic matrix, for which the plain power iteration does not converge
+    W = 0.9 * np.roll(np.eye(10), 1, axis=1)
+    assert np.allclose(tracker.spectral_radius(W), 0.9)
+
+def test_warm_start():
+    K = 50
+    mask = (np.random.rand(K,K) < 0.2) | np.eye(K, dtype=bool)
+    W = np.random.gamma(1.0, 1.0, size=(K,K)) * mask
+    W /= np.amax(np.abs(np.linalg.eigvals(W)))
+
+    tracker = SpectralRadiusTracker(maxiter=1000)
+    tracker.spectral_radius(W)
+
+    # A small perturbation is decided within a few warm-started iterations
+    tracker.maxiter = 5
+    W2 = W * (1 + 0.01 * np.random.rand(K,K))
+    rho2 = np.amax(np.abs(np.linalg.eigvals(W2)))
+    lower, upper = tracker.bounds(W2, threshold=0.95)
+    assert lower >= 0.95
+    assert lower <= rho2 * (1 + 1e-8) <= upper * (1 + 1e-8) + 1e-8
+
+def test_model_stability():
+    K = 4
+    model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=3)
+    rho = np.amax(np.abs(np.linalg.eigvals(model.W_effective)))
+    assert model.check_stability() == (rho < 1.0)
+
+    std_model = DiscreteTimeStandardHawkesModel(K=K, B=3)
+    assert std_model.check_stability()
+    std_model.weights[:,1:] = 1.0
+    assert not std_model.check_stability()
+
+
+if __name__ == "__main__":
+    test_spectral_radius()
+    test_warm_start()
+    test_model_stability()
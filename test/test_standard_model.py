@@ -0,0 +1,154 @@
+"""
+Compare the event time likelihood of the standard Hawkes model
+with a direct computation over all the time bins, and its fused
+objective and gradient with finite differences, and its
+vectorized gradient steps with steps taken one process at a time
+"""
+from scipy.optimize import check_grad, minimize
+import numpy as np
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeStandardHawkesModel
+
+np.random.seed(0)
+K = 3
+B = 3
+T = 1000
+dt = 1.0
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B, dt=dt)
+S,R = true_model.generate(T=T, keep=False)
+
+def make_model():
+    model = DiscreteTimeStandardHawkesModel(K=K, B=B, dt=dt, alpha=2.0, beta=1.0)
+    model.add_data(S)
+    model.add_data(S[:T//2])
+    model.initialize_to_background_rate()
+    model.weights += 0.01 * np.random.rand(*model.weights.shape)
+    return model
+
+def dense_log_likelihood(model, k):
+    ll, grad = 0, 0
+    for data in model.data_list:
+        R = data.F.dot(model.weights[k,:])
+        ll += (data.S[:,k] * np.log(R) - R * dt).sum()
+        grad += (data.S[:,k] / R - dt).dot(data.F)
+    return ll, grad
+
+def test_event_time_likelihood():
+    model = make_model()
+    for k in range(K):
+        ll, grad = dense_log_likelihood(model, k)
+        grad += model._d_log_prior_d_W(k)
+
+        print("Checking log likelihood of process ", k)
+        assert np.allclose(model.log_likelihood(ks=k), ll)
+        assert np.allclose(model.compute_gradient(k), grad)
+
+    # Summed over processes
+    assert np.allclose(model.log_likelihood(),
+                       sum([dense_log_likelihood(model, k)[0] for k in range(K)]))
+
+def test_fused_gradient():
+    model = make_model()
+    for k in range(K):
+        def objective(x):
+            model.weights[k,:] = x
+            return model.log_posterior_and_gradient(k)[0]
+
+        def gradient(x):
+            model.weights[k,:] = x
+            return model.log_posterior_and_gradient(k)[1]
+
+        x0 = model.weights[k,:].copy()
+        print("Checking fused gradient of process ", k)
+        assert np.allclose(objective(x0), model.log_posterior(ks=[k]))
+        err = check_grad(objective, gradient, x0) / np.linalg.norm(gradient(x0))
+        print(err)
+        assert err < 1e-4
+
+def test_fused_bfgs():
+    # Fit with the fused objective and with the separate objective
+    # and gradient functions it replaced
+    model = make_model()
+    baseline = make_model()
+    baseline.weights = model.weights.copy()
+    model.fit_with_bfgs(verbose=False)
+
+    bnds = [(1e-16, None)] * (1 + K * B)
+    for k in range(K):
+        def objective(x):
+            baseline.weights[k,:] = x
+            return np.nan_to_num(-baseline.log_posterior(ks=[k]))
+
+        def gradient(x):
+            baseline.weights[k,:] = x
+            return np.nan_to_num(-baseline.compute_gradient(k))
+
+        res = minimize(objective, baseline.weights[k,:].copy(),
+                       jac=gradient, bounds=bnds)
+        baseline.weights[k,:] = res.x
+
+    print("Fused: ", model.log_posterior(), "\tBaseline: ", baseline.log_posterior())
+    assert np.allclose(model.log_posterior(), baseline.log_posterior(), rtol=1e-6)
+    assert np.allclose(model.weights, baseline.weights, rtol=1e-2, atol=1e-3)
+
+def test_vectorized_gradients():
+    model = make_model()
+    for indices in [None, [1]]:
+        grads = np.array([model.compute_gradient(k, indices=indices)
+                          for k in range(K)])
+        assert np.allclose(model.compute_gradients(indices=indices), grads)
+
+def loop_gradient_descent_step(model, stepsz):
+    grad = np.zeros((K, 1+K*B))
+    for k in range(K):
+        grad[k,:] = model.compute_gradient(k).dot(model._d_W_d_logW(k))
+        model.weights[k,:] = np.exp(np.log(model.weights[k,:]) + stepsz * grad[k,:])
+    return model.weights, model.log_likelihood(), grad
+
+def loop_sgd_step(model, prev_velocity, learning_rate, momentum):
+    velocity = np.zeros((K, 1+K*B))
+    mb = np.random.choice(len(model.data_list))
+    T = model.data_list[mb].T
+    for k in range(K):
+        grad = model.compute_gradient(k, indices=[mb]).dot(model._d_W_d_logW(k)) / T
+        velocity[k,:] = momentum * prev_velocity[k,:] + learning_rate * grad
+        model.weights[k,:] = np.exp(np.log(model.weights[k,:]) + velocity[k,:])
+    return model.weights, model.log_likelihood(), velocity
+
+def test_vectorized_steps():
+    model = make_model()
+    baseline = make_model()
+    baseline.weights = model.weights.copy()
+
+    print("Checking gradient descent steps")
+    for itr in range(5):
+        W, ll, grad = model.gradient_descent_step(stepsz=1e-4)
+        W_loop, ll_loop, grad_loop = loop_gradient_descent_step(baseline, 1e-4)
+        assert np.allclose(W, W_loop)
+        assert np.allclose(ll, ll_loop)
+        assert np.allclose(grad, grad_loop)
+
+    print("Checking SGD steps")
+    velocity = velocity_loop = np.zeros((K, 1+K*B))
+    for itr in range(5):
+        seed = np.random.randint(2**16)
+        np.random.seed(seed)
+        W, ll, velocity = model.sgd_step(velocity, 1e-2, 0.9)
+        np.random.seed(seed)
+        W_loop, ll_loop, velocity_loop = \
+            loop_sgd_step(baseline, velocity_loop, 1e-2, 0.9)
+        assert np.allclose(W, W_loop)
+        assert np.allclose(ll, ll_loop)
+        assert np.allclose(velocity, velocity_loop)
+
+    # Unmonitored steps skip the log likelihood
+    assert model.gradient_descent_step(stepsz=1e-4, monitor=False)[1] is None
+    assert model.sgd_step(velocity, 1e-2, 0.9, monitor_interval=None)[1] is None
+
+
+if __name__ == "__main__":
+    test_event_time_likelihood()
+    test_fused_gradient()
+    test_fused_bfgs()
+    test_vectorized_gradients()
+    test_vectorized_steps()
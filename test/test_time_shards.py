@@ -0,0 +1,87 @@
+"""
+Test the parent updates on shards of the events of a data set
+"""
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixture
+from pyhawkes.internals.parents import _sample_multinomial_rows
+
+np.random.seed(0)
+K = 3
+B = 3
+T = 2000
+true_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+S,R = true_model.generate(T=T, keep=False)
+
+def test_sample_multinomial_rows():
+    rng = np.random.RandomState(0)
+    P = np.array([[1., 2., 0., 1.],
+                  [0., 0., 3., 0.],
+                  [5., 1., 1., 1.]])
+    counts = np.array([4, 2, 7], dtype=np.uint32)
+    Z = np.zeros(P.shape, dtype=np.uint32)
+
+    Zsum = np.zeros(P.shape)
+    N_samples = 5000
+    for _ in range(N_samples):
+        _sample_multinomial_rows(rng, counts, P, Z)
+        assert np.all(Z.sum(1) == counts)
+        assert np.all(Z[P == 0] == 0)
+        Zsum += Z
+
+    expected = counts[:,None] * P / P.sum(1)[:,None]
+    assert np.allclose(Zsum / N_samples, expected, atol=0.1)
+
+def test_sharded_gibbs():
+    test_model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B, n_threads=4)
+    test_model.weight_model.A = true_model.weight_model.A
+    test_model.weight_model.W = true_model.weight_model.W
+    test_model.bias_model.lambda0 = true_model.bias_model.lambda0
+    test_model.impulse_model.g = true_model.impulse_model.g
+    test_model.add_data(S)
+    parents = test_model.data_list[0]
+
+    # Use small shards
+    parents.SHARD_BYTES = 2**12
+    assert len(parents._shards()) > 4
+
+    ir_ss = 0
+    N_samples = 200
+    for _ in range(N_samples):
+        parents.resample()
+        parents._check_Z()
+        ir_ss += parents.compute_ir_ss()
+
+    # Compare with the expected parents under the same parameters
+    Wg = parents._weighted_impulse_responses()
+    P = parents._parent_probabilities(Wg, 0, len(parents.S_events))
+    EZ = parents.S_events[:,None] * P / P.sum(1)[:,None]
+    exp_ir_ss = np.zeros((K, K, B))
+    for k2, (start, end) in enumerate(zip(parents.offsets[:-1], parents.offsets[1:])):
+        exp_ir_ss[:,k2,:] = EZ[start:end,1:].sum(0).reshape((K,B))
+
+    assert np.allclose(ir_ss / N_samples, exp_ir_ss, rtol=0.1, atol=1.0)
+
+def test_sharded_meanfield():
+    vlbs = []
+    EZs = []
+    for n_threads in [1, 4]:
+        np.random.seed(1)
+        test_model = DiscreteTimeNetworkHawkesModelGammaMixture(
+            K=K, B=B, n_threads=n_threads,
+            network_hypers=dict(alpha=6., beta=1.))
+        test_model.add_data(S)
+        test_model.data_list[0].SHARD_BYTES = 2**12
+        vlbs.append([test_model.meanfield_coordinate_descent_step(fast_vlb=True)
+                     for itr in range(5)])
+        EZs.append(test_model.data_list[0]._EZ_events.copy())
+
+    assert np.allclose(vlbs[0], vlbs[1])
+    assert np.allclose(EZs[0], EZs[1])
+
+
+if __name__ == "__main__":
+    test_sample_multinomial_rows()
+    test_sharded_gibbs()
+    test_sharded_meanfield()
@@ -0,0 +1,90 @@
+"""
+Test that the cached derived quantities of the model components are
+invalidated whenever their parameters change
+"""
+import copy
+import pickle
+
+import numpy as np
+
+from pyhawkes.models import DiscreteTimeNetworkHawkesModelSpikeAndSlab, \
+    DiscreteTimeNetworkHawkesModelGammaMixtureSBM
+from pyhawkes.internals.network import StochasticBlockModel
+
+K = 4
+B = 3
+
+def test_cached_expectations():
+    model = DiscreteTimeNetworkHawkesModelGammaMixtureSBM(K=K, B=B)
+    bias_model, impulse_model = model.bias_model, model.impulse_model
+
+    E_ln_lam = bias_model.expected_log_lambda0()
+    assert bias_model.expected_log_lambda0() is E_ln_lam
+    assert not E_ln_lam.flags.writeable
+
+    # Assigning a parameter invalidates the cache
+    version = bias_model.version
+    bias_model.mf_alpha = 2 * bias_model.mf_alpha
+    assert bias_model.version != version
+    assert not np.allclose(bias_model.expected_log_lambda0(), E_ln_lam)
+
+    E_ln_g = impulse_model.expected_log_g()
+    impulse_model.mf_gamma = impulse_model.mf_gamma + 1.0
+    assert not np.allclose(impulse_model.expected_log_g(), E_ln_g)
+
+    # The weight expectations are cached per value of A
+    weight_model = model.weight_model
+    assert weight_model.expected_W_given_A(1.0) is weight_model.expected_W_given_A(1.0)
+    assert not np.allclose(weight_model.expected_W_given_A(1.0),
+                           weight_model.expected_W_given_A(0.0))
+
+    # Copies rebuild their caches rather than sharing the cached arrays
+    for bias_copy in [copy.deepcopy(bias_model),
+                      pickle.loads(pickle.dumps(bias_model))]:
+        assert "_derived_cache" not in bias_copy.__dict__
+        assert np.allclose(bias_copy.expected_log_lambda0(),
+                           bias_model.expected_log_lambda0())
+        assert bias_copy.expected_log_lambda0().flags.owndata
+
+def test_cached_weights():
+    model = DiscreteTimeNetworkHawkesModelSpikeAndSlab(K=K, B=B)
+    weight_model = model.weight_model
+    W_eff = weight_model.W_effective
+    assert weight_model.W_effective is W_eff
+
+    weight_model.A = np.ones((K,K))
+    assert np.allclose(weight_model.W_effective, weight_model.W)
+
+    # The serial resampling changes A in place
+    S,_ = model.generate(T=100, keep=True)
+    weight_model.parallel_resampling = False
+    for itr in range(3):
+        model.resample_model()
+        assert np.allclose(weight_model.W_effective, weight_model.A * weight_model.W)
+
+def test_cached_network():
+    network = StochasticBlockModel(K=K, C=2)
+    P = network.P
+    assert network.P is P
+
+    network.c = 1 - network.c
+    assert np.allclose(network.P, network.p[np.ix_(network.c, network.c)])
+
+    # Gibbs updates of the block assignments change c in place
+    A = np.random.rand(K,K) < 0.5
+    W = np.random.gamma(1.0, 1.0, size=(K,K))
+    for itr in range(5):
+        network.resample_c(A, W)
+        assert np.allclose(network.P, network.p[np.ix_(network.c, network.c)])
+
+    # as do the mean field updates of the block probabilities
+    E_p = network.expected_p()
+    network.mf_update_c(E_A=0.5 * np.ones((K,K)), E_W_given_A=np.ones((K,K)))
+    assert np.allclose(network.expected_p(),
+                       network._average_over_c(network.mf_tau1 / (network.mf_tau0 + network.mf_tau1)))
+
+
+if __name__ == "__main__":
+    test_cached_expectations()
+    test_cached_weights()
+    test_cached_network()